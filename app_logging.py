@@ -0,0 +1,84 @@
+# logging for the app, configured from the environment when main.py is imported:
+#
+#   LOG_LEVEL        debug, info (the default), warning, error, or off
+#   LOG_FORMAT       json (the default), one object per line for the log collector, or text for reading in a terminal
+#   LOG_SAMPLE_RATE  fraction of debug and info records that are kept, 1 by default. warnings and errors always are
+#
+# modules log through get_logger(name) and put the details in extra={...} rather than in the message, so
+# every field ends up as its own key in the json output:
+#
+#   log.info("member added", extra={"board_id": board_id, "members": len(members)})
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+# attributes every LogRecord has. anything else on a record came from extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class SampleFilter(logging.Filter):
+    # keeps a random `rate` of the records below WARNING, so debug logging can stay on under load
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [f"{key}={value}" for key, value in vars(record).items() if key not in _RECORD_FIELDS and not key.startswith("_")]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+def configure(environ=os.environ):
+    level = environ.get("LOG_LEVEL", "info").lower()
+    if level != "off" and level not in LEVELS:
+        raise ValueError(f"Unknown LOG_LEVEL {level!r}")
+    log_format = environ.get("LOG_FORMAT", "json").lower()
+    if log_format not in ("json", "text"):
+        raise ValueError(f"Unknown LOG_FORMAT {log_format!r}")
+    rate = float(environ.get("LOG_SAMPLE_RATE", "1"))
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if log_format == "json" else TextFormatter())
+    handler.addFilter(SampleFilter(rate))
+
+    # only the app's own loggers are configured here, uvicorn keeps its access log
+    logger = logging.getLogger("app")
+    logger.handlers = [handler]
+    logger.propagate = False
+    # off is a level above anything that gets logged
+    logger.setLevel(LEVELS.get(level, logging.CRITICAL + 1))
+    return logger
+
+
+def get_logger(name):
+    # loggers live under "app" so that configure() covers them, e.g. get_logger("main") is "app.main"
+    return logging.getLogger(f"app.{name}")
@@ -0,0 +1,39 @@
+# loads main.py for in-process benchmarks: points it at a FakeFirestore instead of the real project and lets us mint
+# tokens without talking to firebase.
+import os
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(fake_db):
+    # main.py builds its datastore on first use (see lazy.py). the in-memory one needs no credentials, and we swap in
+    # fake_db (with whatever latency the benchmark wants) before anything talks to it
+    os.environ.setdefault("DATASTORE", "memory")
+
+    # main.py mounts ./static and ./templates relative to the working directory, in the repo they are the same files
+    workdir = tempfile.mkdtemp(prefix="taskmanager-bench-")
+    for name in ("static", "templates"):
+        os.symlink(REPO_DIR, os.path.join(workdir, name))
+    os.chdir(workdir)
+
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import main
+
+    main.db = fake_db
+    fake_db.observer = main.metrics.record_operation
+    return main
+
+
+def login(main, user_id, email=None):
+    # returns cookies for user_id. the claims go straight into the token cache so verification is a cache hit
+    token = f"bench-token-{user_id}"
+    main.token_verifier.tokens.put(token, {
+        "sub": user_id,
+        "email": email or f"{user_id}@example.com",
+        "exp": time.time() + 86400,
+    })
+    return {"token": token}
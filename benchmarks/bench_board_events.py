@@ -0,0 +1,157 @@
+# holds thousands of idle GET /boards/{id}/events subscribers against one worker and reports what they cost.
+#
+#   python benchmarks/bench_board_events.py [--subscribers 1000,5000] [--members 10]
+#
+# the app runs under uvicorn in a child process (with a FakeFirestore) so its resident memory can be measured on its
+# own. for each step we open that many SSE connections, wait until every one has its stream open, read the worker's RSS,
+# then create a task and time how long it takes to reach all of them.
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BOARD_ID = "bench-board"
+
+
+def serve(port, members):
+    import uvicorn
+
+    from app_harness import load_app, login
+    from bench_concurrency import seed
+    from fake_firestore import FakeFirestore
+
+    db = FakeFirestore()
+    main = load_app(db)
+    seed(db, members, 10)
+    for member_id in members:
+        login(main, member_id)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", backlog=65535)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def request_bytes(method, path, member_id, body=None):
+    lines = [f"{method} {path} HTTP/1.1", "Host: bench", f"Cookie: token=bench-token-{member_id}"]
+    payload = b""
+    if body is not None:
+        payload = json.dumps(body).encode("utf-8")
+        lines += ["Content-Type: application/json", f"Content-Length: {len(payload)}"]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("ascii") + payload
+
+
+async def subscribe(port, member_id):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request_bytes("GET", f"/boards/{BOARD_ID}/events", member_id))
+    await writer.drain()
+    # the stream starts with a retry: line once the subscription is registered
+    await reader.readuntil(b"retry:")
+    return reader, writer
+
+
+async def wait_for_event(reader, event):
+    await reader.readuntil(f"event: {event}".encode("ascii"))
+    return time.perf_counter()
+
+
+async def create_task(port, member_id, title):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = {"title": title, "description": "", "due_date": "2030-01-01T00:00:00"}
+    writer.write(request_bytes("POST", f"/boards/{BOARD_ID}/tasks", member_id, body))
+    await writer.drain()
+    status = (await reader.readline()).decode("ascii").strip()
+    writer.close()
+    return status
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def step(port, pid, members, count, connections):
+    # grow to `count` open subscribers, then measure
+    while len(connections) < count:
+        batch = min(500, count - len(connections))
+        offset = len(connections)
+        connections += await asyncio.gather(*(subscribe(port, members[(offset + i) % len(members)]) for i in range(batch)))
+    await asyncio.sleep(0.5)
+    rss = rss_kb(pid)
+
+    waiters = [asyncio.ensure_future(wait_for_event(reader, "task_created")) for reader, _ in connections]
+    started = time.perf_counter()
+    status = await create_task(port, members[0], f"Fan-out {count}")
+    delivered = await asyncio.gather(*waiters)
+    latencies = [(at - started) * 1000 for at in delivered]
+    return rss, status, percentile(latencies, 0.5), percentile(latencies, 0.99), max(latencies)
+
+
+async def run(port, pid, members, steps):
+    connections = []
+    # one subscriber first so the baseline includes everything that gets allocated on first use
+    await step(port, pid, members, 1, connections)
+    baseline = rss_kb(pid)
+    print(f"worker RSS with 1 subscriber: {baseline / 1024:.1f} MB\n")
+    print(f"{'subscribers':>12} {'RSS MB':>8} {'KB/conn':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  create")
+    for count in steps:
+        rss, status, p50, p99, worst = await step(port, pid, members, count, connections)
+        per_connection = (rss - baseline) / max(1, count - 1)
+        print(f"{count:>12} {rss / 1024:>8.1f} {per_connection:>8.1f} {p50:>8.1f} {p99:>8.1f} {worst:>8.1f}  {status}")
+    for _, writer in connections:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", default="1000,5000")
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    members = [f"bench-user-{i}" for i in range(args.members)]
+    if args.serve:
+        serve(args.serve, members)
+        return
+
+    steps = [int(count) for count in args.subscribers.split(",")]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = max(steps) + 100
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    port = free_port()
+    env = dict(os.environ, STORAGE_MODE=os.environ.get("STORAGE_MODE", "canonical"))
+    worker = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port), "--members", str(args.members)], env=env)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        asyncio.run(run(port, worker.pid, members, steps))
+    finally:
+        worker.terminate()
+        worker.wait()
+
+
+if __name__ == "__main__":
+    main()
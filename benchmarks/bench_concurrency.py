@@ -0,0 +1,87 @@
+# requests/sec for N concurrent board loads against a firestore with simulated latency.
+#
+#   python benchmarks/bench_concurrency.py [--concurrency 1,10,50] [--latency-ms 20] [--tasks 50]
+#
+# "blocking" reproduces the old synchronous firestore.Client: every RPC sleeps on the event loop so concurrent requests
+# queue up behind each other. "async" is the AsyncClient the app uses now.
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app_harness import load_app, login  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+BOARD_ID = "bench-board"
+
+
+def seed(db, members, tasks):
+    import storage
+
+    board = {"title": "Bench", "creator_id": members[0], "members": members, "created_at": datetime.utcnow()}
+    holders = [None] if storage.STORAGE_MODE == storage.CANONICAL else members
+    for member_id in members:
+        db.seed(f"users/{member_id}", {"email": f"{member_id}@example.com", "created_at": datetime.utcnow()})
+    for holder in holders:
+        board_ref = storage.canonical_board_ref(db, BOARD_ID) if holder is None else storage.replica_board_ref(db, holder, BOARD_ID)
+        db.seed(board_ref.path, board)
+        for i in range(tasks):
+            db.seed(f"{board_ref.path}/tasks/task-{i}", {
+                "title": f"Task {i}",
+                "description": "",
+                "due_date": datetime.utcnow() + timedelta(days=i % 30),
+                "completed": i % 3 == 0,
+                "completed_at": None,
+                "created_at": datetime.utcnow(),
+                "assigned_to": members[i % len(members)],
+                "created_by": members[0],
+            })
+
+
+async def run(main, db, concurrency, requests_per_client, cookies):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies) as client:
+        async def worker():
+            for _ in range(requests_per_client):
+                response = await client.get(f"/boards/{BOARD_ID}/tasks")
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,10,50")
+    parser.add_argument("--requests", type=int, default=5, help="requests per concurrent client")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--tasks", type=int, default=50)
+    args = parser.parse_args()
+
+    db = FakeFirestore(latency=args.latency_ms / 1000)
+    app = load_app(db)
+    members = ["bench-user-0", "bench-user-1"]
+    seed(db, members, args.tasks)
+    cookies = login(app, members[0])
+
+    print(f"GET /boards/{{id}}/tasks, {args.tasks} tasks, {args.latency_ms:.0f} ms per firestore RPC\n")
+    print(f"{'concurrency':>12} {'blocking req/s':>16} {'async req/s':>14} {'speedup':>9}")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        total = concurrency * args.requests
+        results = {}
+        for blocking in (True, False):
+            db.blocking = blocking
+            elapsed = asyncio.run(run(app, db, concurrency, args.requests, cookies))
+            results[blocking] = total / elapsed
+        print(f"{concurrency:>12} {results[True]:>16.1f} {results[False]:>14.1f} {results[False] / results[True]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
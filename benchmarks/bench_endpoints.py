@@ -0,0 +1,197 @@
+# latency percentiles and firestore operations per request for the main endpoints, across board and user base sizes.
+#
+#   python benchmarks/bench_endpoints.py [--members 1,10,100] [--tasks 10,1000] [--users 100,10000] [--requests 50]
+#                                        [--latency-ms 0] [--cold] [--json results.json]
+#
+# every combination of the --members, --tasks and --users sizes gets its own freshly seeded FakeFirestore. the app runs
+# in process behind an ASGI client, so with the default zero latency the times are the app's own overhead and the
+# operation counts are what a request would cost against real firestore. run it under each STORAGE_MODE to compare the
+# layouts; fan-out shows up as writes per request growing with members. range queries (the GET /users prefix search)
+# scan the whole collection in the fake, so their times grow with --users where firestore's wouldn't.
+#
+# requests go out one at a time so each one's operations can be counted. --cold empties the board access and user
+# directory caches before every request, otherwise they are as warm as they would be for a user clicking around.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app_harness import load_app, login  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+BOARD_ID = "bench-board"
+
+COUNTERS = ("reads", "writes", "queries", "commits")
+
+
+def seed(db, member_count, task_count, user_count):
+    # users first, the board's members are the first member_count of them. everything the handlers expect to find is
+    # written in the layouts the current STORAGE_MODE reads: memberships, title reservations, counters and version
+    import board_stats
+    import storage
+    import title_index
+
+    now = datetime.utcnow()
+    user_ids = [f"bench-user-{i}" for i in range(max(user_count, member_count))]
+    for user_id in user_ids:
+        email = f"{user_id}@example.com"
+        db.seed(f"users/{user_id}", {"email": email, "email_lower": email, "created_at": now})
+    members = user_ids[:member_count]
+
+    tasks = {}
+    for i in range(task_count):
+        tasks[f"task-{i:06d}"] = {
+            "title": f"Task {i}",
+            "description": "Synthetic task",
+            "due_date": now + timedelta(days=i % 30),
+            "completed": i % 3 == 0,
+            "completed_at": now if i % 3 == 0 else None,
+            "created_at": now,
+            "assigned_to": members[i % len(members)] if i % 4 else None,
+            "created_by": members[0],
+        }
+    board = {
+        "title": "Bench",
+        "creator_id": members[0],
+        "members": members,
+        "created_at": now,
+        "stats": board_stats.compute_stats(tasks.values()),
+        "version": 1,
+    }
+
+    board_refs = []
+    if storage.uses_canonical():
+        board_refs.append(storage.canonical_board_ref(db, BOARD_ID))
+        for member_id in members:
+            db.seed(storage.membership_ref(db, member_id, BOARD_ID).path, {"joined_at": now})
+    if storage.uses_replicas():
+        board_refs.extend(storage.replica_board_ref(db, member_id, BOARD_ID) for member_id in members)
+    for board_ref in board_refs:
+        db.seed(board_ref.path, board)
+        for task_id, task_data in tasks.items():
+            db.seed(f"{board_ref.path}/tasks/{task_id}", task_data)
+    for task_id, task_data in tasks.items():
+        db.seed(title_index.reservation_ref(db, BOARD_ID, task_data["title"]).path, {"task_id": task_id, "title": task_data["title"]})
+    return members, list(tasks)
+
+
+def scenarios(members, task_ids):
+    # (name, function building the next request as (method, url, json)) for every endpoint measured
+    created = itertools.count()
+    toggled = itertools.count()
+
+    def update(counter):
+        i = next(counter)
+        return "PUT", f"/tasks/{task_ids[i % len(task_ids)]}", {"board_id": BOARD_ID, "completed": i % 2 == 0}
+
+    return [
+        ("GET /board/{id} (view_board)", lambda: ("GET", f"/board/{BOARD_ID}", None)),
+        ("GET /boards", lambda: ("GET", "/boards", None)),
+        ("GET /boards/{id}/members", lambda: ("GET", f"/boards/{BOARD_ID}/members", None)),
+        ("GET /boards/{id}/tasks", lambda: ("GET", f"/boards/{BOARD_ID}/tasks", None)),
+        ("GET /boards/{id}/tasks?limit=50", lambda: ("GET", f"/boards/{BOARD_ID}/tasks?limit=50", None)),
+        ("GET /boards/{id}/stats", lambda: ("GET", f"/boards/{BOARD_ID}/stats", None)),
+        ("GET /boards/{id}/snapshot", lambda: ("GET", f"/boards/{BOARD_ID}/snapshot", None)),
+        ("GET /users?prefix=", lambda: ("GET", "/users?prefix=bench-user-1&limit=20", None)),
+        ("POST /boards/{id}/tasks", lambda: ("POST", f"/boards/{BOARD_ID}/tasks", {
+            "title": f"Created {next(created)}", "description": "", "due_date": "2030-01-01T00:00:00",
+            "assigned_to": members[-1],
+        })),
+        ("PUT /tasks/{id}", lambda: update(toggled)),
+    ]
+
+
+def clear_caches():
+    import board_access
+    import user_directory
+
+    board_access.cache.clear()
+    user_directory.search_cache.clear()
+    user_directory.profile_cache.clear()
+
+
+def sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def measure(main, db, cookies, build, requests, cold):
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    totals = dict.fromkeys(COUNTERS, 0)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies) as client:
+        for _ in range(requests):
+            method, url, body = build()
+            if cold:
+                clear_caches()
+            db.reset_counters()
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise SystemExit(f"{method} {url}: {response.status_code} {response.text[:200]}")
+            for counter in COUNTERS:
+                totals[counter] += getattr(db, counter)
+    return {
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        **{f"{counter}_per_request": totals[counter] / requests for counter in COUNTERS},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", default="1,10,100")
+    parser.add_argument("--tasks", default="10,1000")
+    parser.add_argument("--users", default="100,10000")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint and dataset")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--cold", action="store_true", help="empty the in-process caches before every request")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    app = None
+    results = []
+    for member_count, task_count, user_count in itertools.product(sizes(args.members), sizes(args.tasks), sizes(args.users)):
+        db = FakeFirestore(latency=args.latency_ms / 1000)
+        if app is None:
+            app = load_app(db)
+        app.db = db
+        clear_caches()
+        members, task_ids = seed(db, member_count, task_count, user_count)
+        cookies = login(app, members[0])
+
+        import storage
+
+        print(f"\n{member_count} members, {task_count} tasks, {user_count} users ({storage.STORAGE_MODE}, "
+              f"{args.latency_ms:.0f} ms per RPC{', cold caches' if args.cold else ''})")
+        print(f"{'endpoint':<34} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'reads':>8} {'writes':>8} {'queries':>8} {'commits':>8}")
+        for name, build in scenarios(members, task_ids):
+            stats = asyncio.run(measure(app, db, cookies, build, args.requests, args.cold))
+            print(f"{name:<34} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                  + " ".join(f"{stats[f'{counter}_per_request']:>8.1f}" for counter in COUNTERS))
+            results.append({
+                "endpoint": name, "members": member_count, "tasks": task_count, "users": user_count,
+                "storage_mode": storage.STORAGE_MODE, "cold": args.cold, **stats,
+            })
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# cold start time: from a fresh interpreter importing main.py to its first 200 response, so startup regressions show up
+# as numbers instead of slower autoscaling.
+#
+#   python benchmarks/bench_startup.py [--runs 10] [--warm-up firestore,certs,templates] [--json results.json]
+#
+# every run is a new python process. it times the import of main.py, the startup hooks, the first 200 from GET /healthz
+# and the first 200 from GET /readyz (which waits for the --warm-up hooks, see warmup.py), each from the moment the
+# process started importing, then a first GET / that renders a page. the requests go through an in-process ASGI
+# client, so there is no server or network in the numbers. DATASTORE defaults to memory, set DATASTORE=firestore (with
+# credentials) to include the real client's setup.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STEPS = ("import_ms", "startup_ms", "healthz_ms", "readyz_ms", "first_page_ms")
+
+# seconds a process gets to become ready before the run is given up on
+READY_TIMEOUT = 60
+
+
+def child():
+    # runs in the measured process and prints its timings as one json line
+    started = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix="taskmanager-startup-")
+    for name in ("static", "templates"):
+        os.symlink(REPO_DIR, os.path.join(workdir, name))
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import asyncio
+
+    import main
+
+    imported = time.perf_counter()
+
+    async def run():
+        import httpx
+
+        timings = {"import_ms": (imported - started) * 1000}
+        await main.app.router.startup()
+        timings["startup_ms"] = (time.perf_counter() - started) * 1000
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            for step, path in (("healthz_ms", "/healthz"), ("readyz_ms", "/readyz")):
+                while True:
+                    status_code = (await client.get(path)).status_code
+                    if status_code == 200:
+                        break
+                    if status_code != 503 or time.perf_counter() - started > READY_TIMEOUT:
+                        raise SystemExit(f"GET {path}: {status_code}")
+                    await asyncio.sleep(0.001)
+                timings[step] = (time.perf_counter() - started) * 1000
+            page_started = time.perf_counter()
+            response = await client.get("/")
+            if response.status_code != 200:
+                raise SystemExit(f"GET /: {response.status_code}")
+            timings["first_page_ms"] = (time.perf_counter() - page_started) * 1000
+        await main.app.router.shutdown()
+        return timings
+
+    print(json.dumps(asyncio.run(run())))
+
+
+def measure(runs, warm_up):
+    env = {**os.environ, "WARM_UP": warm_up, "LOG_LEVEL": "warning"}
+    env.setdefault("DATASTORE", "memory")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child"],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warm-up", default="", help="WARM_UP hooks for the measured processes")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    results = measure(args.runs, args.warm_up)
+    print(f"{args.runs} cold starts, WARM_UP={args.warm_up or '(none)'}, DATASTORE={os.environ.get('DATASTORE', 'memory')}")
+    print(f"{'step':<16} {'p50 ms':>8} {'max ms':>8}")
+    for step in STEPS:
+        values = [result[step] for result in results]
+        print(f"{step:<16} {percentile(values, 0.5):>8.1f} {max(values):>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"warm_up": args.warm_up, "runs": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
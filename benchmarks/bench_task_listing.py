@@ -0,0 +1,157 @@
+# time to first byte, total latency and peak memory of GET /boards/{id}/tasks on one big board, for each way of
+# encoding the response.
+#
+#   python benchmarks/bench_task_listing.py [--tasks 10000] [--runs 5] [--limit N]
+#
+#   json stdlib    one JSON array, encoded with the standard library (what fast_json falls back to without orjson)
+#   json orjson    one JSON array, encoded with orjson
+#   ndjson         Accept: application/x-ndjson, one task per line written as it comes off the query stream
+#
+# the app is driven straight through its ASGI interface so the numbers are about building and encoding the response,
+# not an HTTP client. memory is measured with tracemalloc in separate runs because tracing slows everything down.
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app_harness import load_app, login  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+BOARD_ID = "bench-board"
+
+MODES = ("json stdlib", "json orjson", "ndjson")
+
+
+def seed(db, members, tasks):
+    # the real client returns timestamps as DatetimeWithNanoseconds, which orjson only handles through its default hook
+    import storage
+
+    now = DatetimeWithNanoseconds.now()
+    board = {"title": "Bench", "creator_id": members[0], "members": members, "created_at": now}
+    holders = [None] if storage.STORAGE_MODE == storage.CANONICAL else members[:1]
+    for holder in holders:
+        board_ref = storage.canonical_board_ref(db, BOARD_ID) if holder is None else storage.replica_board_ref(db, holder, BOARD_ID)
+        db.seed(board_ref.path, board)
+        for i in range(tasks):
+            db.seed(f"{board_ref.path}/tasks/task-{i:06d}", {
+                "title": f"Task {i}",
+                "description": "Synthetic task description that is about as long as a real one tends to be.",
+                "due_date": now + timedelta(days=i % 30),
+                "completed": i % 3 == 0,
+                "completed_at": now if i % 3 == 0 else None,
+                "created_at": now,
+                "assigned_to": members[i % len(members)],
+                "previously_assigned": [],
+                "created_by": members[0],
+            })
+
+
+async def request(main, path, query, cookies, accept):
+    # returns (status, seconds to the first body byte, seconds to the end, body size)
+    headers = [(b"host", b"bench"), (b"cookie", f"token={cookies['token']}".encode("ascii"))]
+    if accept:
+        headers.append((b"accept", accept.encode("ascii")))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode("ascii"), "query_string": query.encode("ascii"), "root_path": "",
+        "headers": headers, "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    result = {"status": None, "first": None, "size": 0}
+    finished = asyncio.Event()
+    received = []
+    started = time.perf_counter()
+
+    async def receive():
+        # the request body, then nothing until the response is done (StreamingResponse listens for a disconnect)
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if result["first"] is None:
+                result["first"] = time.perf_counter() - started
+            # count the bytes and let them go, like a socket would
+            result["size"] += len(message["body"])
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            finished.set()
+
+    await main.app(scope, receive, send)
+    return result["status"], result["first"], time.perf_counter() - started, result["size"]
+
+
+async def run_mode(main, mode, query, cookies, runs, trace):
+    import fast_json
+
+    real_orjson = fast_json.orjson
+    if mode == "json stdlib":
+        fast_json.orjson = None
+    accept = fast_json.NDJSON_MEDIA_TYPE if mode == "ndjson" else None
+    try:
+        samples = []
+        for _ in range(runs):
+            if trace:
+                tracemalloc.start()
+            status, first, total, size = await request(main, f"/boards/{BOARD_ID}/tasks", query, cookies, accept)
+            peak = 0
+            if trace:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if status != 200:
+                raise SystemExit(f"{mode}: status {status}")
+            samples.append((first, total, size, peak))
+        return samples
+    finally:
+        fast_json.orjson = real_orjson
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--limit", type=int, help="page size, the whole board by default")
+    args = parser.parse_args()
+
+    db = FakeFirestore()
+    app = load_app(db)
+    import fast_json
+
+    if fast_json.orjson is None:
+        raise SystemExit("orjson is not installed (pip install orjson)")
+    members = ["bench-user-0", "bench-user-1"]
+    seed(db, members, args.tasks)
+    cookies = login(app, members[0])
+    query = f"limit={args.limit}" if args.limit else ""
+
+    print(f"{args.tasks} tasks, {'limit ' + str(args.limit) if args.limit else 'whole board'}, median of {args.runs} runs\n")
+    print(f"{'mode':<12} {'first byte ms':>14} {'total ms':>10} {'body KB':>9} {'peak MB':>9}")
+    for mode in MODES:
+        # one untimed request so imports and caches are warm
+        asyncio.run(run_mode(app, mode, query, cookies, 1, False))
+        timed = asyncio.run(run_mode(app, mode, query, cookies, args.runs, False))
+        traced = asyncio.run(run_mode(app, mode, query, cookies, max(1, args.runs // 2), True))
+        first = median(sample[0] for sample in timed) * 1000
+        total = median(sample[1] for sample in timed) * 1000
+        size = timed[0][2] / 1024
+        peak = median(sample[3] for sample in traced) / (1024 * 1024)
+        print(f"{mode:<12} {first:>14.1f} {total:>10.1f} {size:>9.0f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
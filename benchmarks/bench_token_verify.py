@@ -0,0 +1,129 @@
+# compares cold and warm firebase token verification latency.
+#
+#   python benchmarks/bench_token_verify.py [--iterations 200]
+#
+# everything runs offline: we mint our own RSA key and self signed cert, sign a firebase shaped token with it and serve
+# the cert through a fake request adapter that sleeps like a real round trip to googleapis.com would.
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+import google.auth.crypt
+import google.auth.jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from token_cache import TokenVerifier  # noqa: E402
+
+KEY_ID = "bench-key"
+CERT_FETCH_LATENCY = 0.05
+
+
+def make_key_and_cert():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    return key_pem, cert_pem
+
+
+def make_token(key_pem, subject):
+    signer = google.auth.crypt.RSASigner.from_string(key_pem, KEY_ID)
+    now = int(time.time())
+    payload = {
+        "iss": "https://securetoken.google.com/bench",
+        "aud": "bench",
+        "sub": subject,
+        "email": f"{subject}@example.com",
+        "iat": now,
+        "exp": now + 3600,
+    }
+    return google.auth.jwt.encode(signer, payload).decode("utf-8")
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.status = 200
+        self.headers = {"Cache-Control": "public, max-age=19000, must-revalidate, no-transform"}
+        self.data = data
+
+
+class FakeRequest:
+    def __init__(self, cert_pem):
+        self.body = json.dumps({KEY_ID: cert_pem.decode("utf-8")}).encode("utf-8")
+        self.calls = 0
+
+    def __call__(self, url, method="GET", **kwargs):
+        self.calls += 1
+        time.sleep(CERT_FETCH_LATENCY)
+        return FakeResponse(self.body)
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) > 1 else samples[0]
+    print(f"{label:<34} mean {statistics.mean(samples):9.3f} ms   p50 {statistics.median(samples):9.3f} ms   p95 {p95:9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    iterations = args.iterations
+    key_pem, cert_pem = make_key_and_cert()
+    request = FakeRequest(cert_pem)
+    tokens = [make_token(key_pem, f"user-{i}") for i in range(iterations)]
+
+    # cold: nothing cached, every verification fetches certs and does the RSA check (what main.py did before)
+    cold_tokens = iter(tokens)
+    cold = timed(lambda: TokenVerifier(request).verify(next(cold_tokens)), min(iterations, 50))
+
+    # certs cached but a new token each time, i.e. a user we haven't seen since the process started
+    verifier = TokenVerifier(request)
+    verifier.certs.get()
+    fresh_tokens = iter(tokens)
+    certs_only = timed(lambda: verifier.verify(next(fresh_tokens)), iterations)
+
+    # warm: a returning user whose token is already in the LRU
+    warm = timed(lambda: verifier.verify(tokens[0]), iterations)
+
+    print(f"{iterations} iterations, simulated cert fetch latency {CERT_FETCH_LATENCY * 1000:.0f} ms\n")
+    report("cold (cert fetch + RSA verify)", cold)
+    report("certs cached (RSA verify only)", certs_only)
+    report("warm (token LRU hit)", warm)
+    print(f"\nverifier stats: {verifier.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# the benchmarks' name for the in-memory backend in memory_store.py, which also counts firestore operations and can add
+# simulated latency.
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from memory_store import MemoryFirestore as FakeFirestore  # noqa: E402,F401
@@ -0,0 +1,171 @@
+# who can do what on a board: the members and creator of every board this worker has seen recently, so board-scoped
+# requests can be authorized without reading the board document first.
+#
+# main.py wraps this in the board_member / board_creator dependencies. an entry is dropped when this worker adds or
+# removes a member or deletes the board, and expires after ACCESS_CACHE_TTL so changes made by other workers are picked
+# up too. setting BOARD_ACCESS_LISTENER=1 also drops entries as soon as firestore reports a change to the board (see
+# start_listener).
+#
+# the cache is only trusted for authorization and, in canonical mode, for where the board lives. with replicas a
+# mutation still reads the board so it fans out to the current member list (see BoardAccess.write_refs), and a member
+# who has no copy of the board yet is checked against the owner's copy, found through the board index.
+import os
+import threading
+import time
+
+import board_index
+import storage
+
+# how long a board's members and creator are trusted without reading the board again
+ACCESS_CACHE_TTL = 30
+
+MAX_CACHED_BOARDS = 10000
+
+
+class AccessDenied(Exception):
+    # turned into {"message": ...} with this status code by the exception handler in main.py
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class BoardAccess:
+    # what a handler gets back from the board_member / board_creator dependencies
+    def __init__(self, db, board_id, user_id, canonical, creator_id, members, board=None):
+        self.db = db
+        self.board_id = board_id
+        self.user_id = user_id
+        self.creator_id = creator_id
+        self.members = members
+        if canonical:
+            self.board_ref = storage.canonical_board_ref(db, board_id)
+        else:
+            self.board_ref = storage.replica_board_ref(db, user_id, board_id)
+        if board is not None:
+            self.board_ref = board[0]
+        self._board = board
+
+    @property
+    def is_member(self):
+        return self.user_id in self.members
+
+    @property
+    def is_creator(self):
+        return self.user_id == self.creator_id
+
+    async def board(self):
+        # (board_ref, board_data) for handlers that need what is on the board document. read at most once per request,
+        # and not at all if the access check already had to load it
+        if self._board is None:
+            board_ref, board_data = await load(self.db, self.board_id, self.user_id)
+            if board_data is None:
+                cache.invalidate(self.board_id)
+                raise AccessDenied(404, "Board not found")
+            self._board = (board_ref, board_data)
+            self.board_ref = board_ref
+        return self._board
+
+    async def write_refs(self):
+        # every copy of the board a mutation has to reach. a canonical board is a single document so the cache is
+        # enough, replicas depend on the current member list and layout
+        if storage.uses_replicas():
+            board_ref, board_data = await self.board()
+            return storage.write_refs(self.db, self.board_id, board_ref, board_data.get("members", []))
+        return [self.board_ref]
+
+
+class AccessCache:
+    def __init__(self, ttl=ACCESS_CACHE_TTL, max_size=MAX_CACHED_BOARDS):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = {}
+        # the firestore listener calls invalidate() from its own thread
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board_id):
+        with self._lock:
+            entry = self._entries.get(board_id)
+            if entry is None or time.time() >= entry[3]:
+                self._entries.pop(board_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, board_id, board_ref, board_data):
+        with self._lock:
+            if len(self._entries) >= self._max_size:
+                # cheaper than keeping an LRU order on every hit; the entries are short lived anyway
+                self._entries.clear()
+            self._entries[board_id] = (
+                storage.is_canonical(board_ref),
+                board_data.get("creator_id"),
+                frozenset(board_data.get("members", [])),
+                time.time() + self._ttl,
+            )
+
+    def invalidate(self, board_id):
+        with self._lock:
+            self._entries.pop(board_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "ttl": self._ttl}
+
+
+cache = AccessCache()
+
+
+async def load(db, board_id, user_id):
+    # (board_ref, board_data) of the user's copy, or of the owner's copy when replicas are in use and the user doesn't
+    # have one. board_data is None if neither exists
+    board_ref, board_data = await storage.load_board(db, board_id, user_id)
+    if board_data is None and storage.uses_replicas():
+        board_ref, board_doc = await board_index.find_board(db, board_id)
+        if board_doc is not None:
+            board_data = board_doc.to_dict()
+    return board_ref, board_data
+
+
+async def lookup(db, board_id, user_id):
+    # returns BoardAccess for the user, or None if the board doesn't exist (as far as this user can see)
+    entry = cache.get(board_id)
+    if entry is not None:
+        canonical, creator_id, members, _ = entry
+        return BoardAccess(db, board_id, user_id, canonical, creator_id, members)
+
+    board_ref, board_data = await load(db, board_id, user_id)
+    if board_data is None:
+        return None
+    cache.put(board_id, board_ref, board_data)
+    canonical = storage.is_canonical(board_ref)
+    members = frozenset(board_data.get("members", []))
+    return BoardAccess(db, board_id, user_id, canonical, board_data.get("creator_id"), members, (board_ref, board_data))
+
+
+def start_listener():
+    # optional: watch the board documents and drop cache entries the moment they change, instead of waiting for the
+    # ttl. this uses the synchronous client because the async one has no listeners, and its callbacks run on a
+    # background thread. the initial snapshot reads every board once per worker, so it is off unless
+    # BOARD_ACCESS_LISTENER=1. the in-memory datastore only changes through this process, so it never needs one
+    if os.environ.get("BOARD_ACCESS_LISTENER") != "1" or storage.DATASTORE != storage.FIRESTORE:
+        return []
+    from google.cloud import firestore
+
+    def on_change(docs, changes, read_time):
+        for change in changes:
+            cache.invalidate(change.document.id)
+
+    client = firestore.Client()
+    watches = []
+    if storage.uses_canonical():
+        watches.append(client.collection(storage.BOARDS_COLLECTION).on_snapshot(on_change))
+    if storage.uses_replicas():
+        watches.append(client.collection_group("taskboards").on_snapshot(on_change))
+    return watches
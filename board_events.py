@@ -0,0 +1,123 @@
+# per-board push channel behind GET /boards/{board_id}/events (server-sent events).
+#
+# the mutation handlers publish a delta after their writes land and every client subscribed to that board gets it:
+#
+#   task_created / task_updated   {"task": {...}} the whole task, same shape as GET /boards/{board_id}/tasks
+#   task_deleted                  {"id": task_id}
+#   tasks_changed                 {"tasks": [{...}, ...], "deleted": [task_id, ...]} everything a tasks:batch request did
+#   member_added                  {"member": {"id": ..., "email": ...}}
+#   member_removed                {"id": member_id}
+#   board_updated                 {"title": ...}
+#   board_deleted                 {}
+#   task_due                      {"kind": "due_soon" | "overdue", "task": {...}} with DUE_NOTIFICATIONS=events (due_dates.py)
+#
+# subscribers only hear about mutations handled by the same worker process. with more than one worker the feed has to
+# come from somewhere shared (a firestore on_snapshot listener per board, or pub/sub) instead of publish() calls. until
+# then the feed is an extra: the board page still refetches after each of its own changes, whichever worker its stream
+# is connected to.
+#
+# an idle subscriber is a small bounded queue plus the response generator that drains it, so thousands of them per
+# worker are cheap (see benchmarks/bench_board_events.py). a client that stops reading until its queue fills up is sent
+# "resync" and disconnected; it reconnects and refetches the board.
+import asyncio
+
+import fast_json
+
+# events a subscriber can fall behind by before it is cut off
+MAX_PENDING_EVENTS = 100
+
+# a comment line every so often so proxies don't drop idle connections and dead clients are noticed
+KEEPALIVE_INTERVAL = 25
+
+# what EventSource waits before reconnecting after the stream drops, in milliseconds
+RETRY_MS = 3000
+
+_CLOSE = object()
+
+
+class Subscriber:
+    __slots__ = ("user_id", "queue")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(MAX_PENDING_EVENTS)
+
+
+class BoardEvents:
+    def __init__(self):
+        self._boards = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, board_id, user_id):
+        subscriber = Subscriber(user_id)
+        self._boards.setdefault(board_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, board_id, subscriber):
+        subscribers = self._boards.get(board_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._boards[board_id]
+
+    def publish(self, board_id, event, data):
+        # called from the event loop, never blocks. the message is encoded once and shared by every subscriber
+        subscribers = self._boards.get(board_id)
+        if not subscribers:
+            return
+        self.published += 1
+        message = encode(event, data)
+        for subscriber in list(subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                self._close(board_id, subscriber)
+                continue
+            # a member that was removed, or a board that is gone, ends the stream after this event
+            if event == "board_deleted" or (event == "member_removed" and data.get("id") == subscriber.user_id):
+                self._close(board_id, subscriber)
+
+    def _close(self, board_id, subscriber):
+        if subscriber.queue.full():
+            # the client has fallen behind, throw its backlog away and tell it to start over
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(encode("resync", {}))
+        subscriber.queue.put_nowait(_CLOSE)
+        self.unsubscribe(board_id, subscriber)
+
+    async def stream(self, board_id, user_id):
+        # the body of the text/event-stream response. runs until the client goes away or the subscription is closed.
+        # subscribing here rather than in the handler means a response that never starts can't leave a subscriber behind
+        subscriber = self.subscribe(board_id, user_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is _CLOSE:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(board_id, subscriber)
+
+    def stats(self):
+        return {
+            "boards": len(self._boards),
+            "subscribers": sum(len(subscribers) for subscribers in self._boards.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+def encode(event, data):
+    return f"event: {event}\ndata: {fast_json.dumps(data).decode('utf-8')}\n\n"
+
+
+hub = BoardEvents()
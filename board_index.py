@@ -0,0 +1,103 @@
+# maintains board_index/{board_id} -> {"owner_id": ..., "replicas": [...]} so we can find where a board lives with a
+# single point read instead of walking every user's taskboards collection.
+#
+# the index is written by create_board and add_board_member (and kept honest by remove_board_member). boards that were
+# created before the index existed can be picked up with:
+#
+#   python board_index.py backfill [--dry-run]
+import argparse
+import asyncio
+
+from google.cloud import firestore
+
+import storage
+
+INDEX_COLLECTION = "board_index"
+
+
+def index_ref(db, board_id):
+    return db.collection(INDEX_COLLECTION).document(board_id)
+
+
+def replica_ref(db, user_id, board_id):
+    return db.collection("users").document(user_id).collection("taskboards").document(board_id)
+
+
+async def record_board(db, board_id, owner_id):
+    await index_ref(db, board_id).set({"owner_id": owner_id, "replicas": [owner_id]})
+
+
+async def add_replica(db, board_id, user_id):
+    await index_ref(db, board_id).set({"replicas": firestore.ArrayUnion([user_id])}, merge=True)
+
+
+async def remove_replica(db, board_id, user_id):
+    await index_ref(db, board_id).set({"replicas": firestore.ArrayRemove([user_id])}, merge=True)
+
+
+async def remove_board(db, board_id):
+    await index_ref(db, board_id).delete()
+
+
+async def lookup(db, board_id):
+    # returns the index entry for a board or None if we have never seen it
+    doc = await index_ref(db, board_id).get()
+    if not doc.exists:
+        return None
+    return doc.to_dict()
+
+
+async def find_board(db, board_id):
+    # returns (board_ref, board_doc) for the owner's copy of the board, which is the one every other copy is synced
+    # from. (None, None) if the board isn't in the index
+    entry = await lookup(db, board_id)
+    if not entry or not entry.get("owner_id"):
+        return None, None
+
+    board_ref = replica_ref(db, entry["owner_id"], board_id)
+    board_doc = await board_ref.get()
+    if not board_doc.exists:
+        return None, None
+    return board_ref, board_doc
+
+
+async def backfill(db, dry_run=False):
+    # one pass over every taskboards copy in the database
+    entries = {}
+    async for board in storage.iter_board_copies(db, canonical=False, replicas=True):
+        holder_id = board.reference.parent.parent.id
+        entry = entries.setdefault(board.id, {"owner_id": None, "replicas": []})
+        entry["replicas"].append(holder_id)
+        creator_id = board.to_dict().get("creator_id")
+        if creator_id == holder_id:
+            entry["owner_id"] = creator_id
+
+    batcher = storage.WriteBatcher(db)
+    for board_id, entry in entries.items():
+        if not entry["owner_id"]:
+            # the creator's copy is gone, fall back to whichever replica we saw first so the board stays reachable
+            entry["owner_id"] = entry["replicas"][0]
+        batcher.set(index_ref(db, board_id), entry)
+
+    if not dry_run:
+        failures = await batcher.commit()
+        if failures:
+            raise RuntimeError(f"{len(failures)} index writes failed, first error: {failures[0]['error']}")
+
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the board_id -> location index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="build the index from existing taskboards copies")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="scan and count without writing")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        count = asyncio.run(backfill(storage.client(), dry_run=args.dry_run))
+        print(f"{'Would index' if args.dry_run else 'Indexed'} {count} boards")
+
+
+if __name__ == "__main__":
+    main()
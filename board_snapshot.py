@@ -0,0 +1,64 @@
+# everything board.html needs to show a board, in one response. GET /boards/{board_id}/snapshot returns it and
+# GET /board/{board_id} embeds it in the page, so the board renders with data on first paint instead of after another
+# round trip each for the members, the tasks and the stats:
+#
+#   {"board": {"id": ..., "title": ..., "creator_id": ..., "version": ...},
+#    "members": [...], "stats": {...}, "tasks": [...], "next_cursor": ... or None}
+#
+# members and stats are what their own endpoints return. tasks is the first page of the board's tasks with the fields a
+# task card shows, the next ones come from GET /boards/{board_id}/tasks?cursor=<next_cursor>. the caller reads the board
+# document once, then the task page, the member profiles and (for a board without counters) the stats are read at the
+# same time.
+import asyncio
+
+import board_stats
+import board_versions
+import task_query
+import user_directory
+
+TASK_PAGE_SIZE = 50
+
+# what a task card in board.html shows
+CARD_FIELDS = "title,description,due_date,completed,completed_at,assigned_to,previously_assigned,created_by"
+
+
+async def members(db, board_data):
+    # the board's members in board order, with their emails from the profile cache or one batched read
+    member_ids = board_data.get("members", [])
+    profiles = await user_directory.get_profiles(db, member_ids)
+    return [{
+        "id": member_id,
+        "email": profiles[member_id]["email"],
+        "is_creator": member_id == board_data.get("creator_id"),
+    } for member_id in member_ids if member_id in profiles]
+
+
+async def stats(board_ref, board_data):
+    # the counters on the board document. boards that haven't had their counters initialised yet (see board_stats.py
+    # recompute) are still counted the slow way
+    counters = board_stats.read_stats(board_data)
+    if counters is None:
+        tasks = [task.to_dict() async for task in board_ref.collection("tasks").stream()]
+        counters = board_stats.read_stats({"stats": board_stats.compute_stats(tasks)})
+    return counters
+
+
+async def read(db, board_id, board_ref, board_data):
+    page = task_query.TaskPage({"limit": str(TASK_PAGE_SIZE), "fields": CARD_FIELDS})
+    (tasks, next_cursor), member_list, counters = await asyncio.gather(
+        page.fetch(board_ref.collection("tasks")),
+        members(db, board_data),
+        stats(board_ref, board_data),
+    )
+    return {
+        "board": {
+            "id": board_id,
+            "title": board_data.get("title", ""),
+            "creator_id": board_data.get("creator_id"),
+            "version": board_versions.board_version(board_data),
+        },
+        "members": member_list,
+        "stats": counters,
+        "tasks": tasks,
+        "next_cursor": next_cursor,
+    }
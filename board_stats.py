@@ -0,0 +1,130 @@
+# task counters kept on the board document so /boards/{id}/stats is answered from the board read every handler
+# already does, instead of streaming every task.
+#
+# create_task, update_task, delete_task, batch_tasks and remove_board_member apply firestore.Increment deltas in the same
+# write batch as the task change. update_task, delete_task and batch_tasks work the delta out from the task's search
+# index entry and only write if the entry hasn't changed since, so two requests completing the same task at once don't
+# both count it (see task_search.counted). boards created before the counters existed (or whose counters drifted) are
+# fixed with:
+#
+#   python board_stats.py recompute [--board BOARD_ID] [--dry-run]
+import argparse
+import asyncio
+
+from google.cloud import firestore
+
+import board_index
+import board_versions
+import storage
+
+STATS_FIELDS = ("total_tasks", "active_tasks", "completed_tasks", "unassigned_tasks")
+
+
+def initial_stats():
+    # "tracked" is only ever written together with a full set of counters, so a board that has picked up increments
+    # without being initialised (or recomputed) can be told apart and isn't trusted
+    stats = {field: 0 for field in STATS_FIELDS}
+    stats["tracked"] = True
+    return stats
+
+
+def task_counts(task_data):
+    # how much a single task contributes to each counter. None means no task
+    if task_data is None:
+        return {field: 0 for field in STATS_FIELDS}
+    completed = bool(task_data.get("completed", False))
+    return {
+        "total_tasks": 1,
+        "active_tasks": 0 if completed else 1,
+        "completed_tasks": 1 if completed else 0,
+        "unassigned_tasks": 0 if task_data.get("assigned_to") else 1,
+    }
+
+
+def compute_stats(tasks):
+    stats = initial_stats()
+    for task_data in tasks:
+        for field, count in task_counts(task_data).items():
+            stats[field] += count
+    return stats
+
+
+def increments(before, after):
+    # firestore update fields that move the counters from a task looking like `before` to looking like `after`
+    return total_increments([(before, after)])
+
+
+def total_increments(changes):
+    # the same for several (before, after) task changes written together, as one increment per counter
+    totals = {field: 0 for field in STATS_FIELDS}
+    for before, after in changes:
+        old, new = task_counts(before), task_counts(after)
+        for field in STATS_FIELDS:
+            totals[field] += new[field] - old[field]
+    return {f"stats.{field}": firestore.Increment(delta) for field, delta in totals.items() if delta}
+
+
+def read_stats(board_data):
+    stats = board_data.get("stats") or {}
+    if not stats.get("tracked"):
+        return None
+    return {field: stats.get(field, 0) for field in STATS_FIELDS}
+
+
+async def _one_board(db, board_id):
+    # the copies of a single board, with point reads: the canonical board, and the replicas of everyone the board index
+    # or a copy of the board lists
+    board_refs = []
+    holders = set()
+    if storage.uses_canonical():
+        board_refs.append(storage.canonical_board_ref(db, board_id))
+    if storage.uses_replicas():
+        entry = await board_index.lookup(db, board_id) or {}
+        holders.update(entry.get("replicas", []))
+        board_refs.extend(storage.replica_board_ref(db, holder_id, board_id) for holder_id in sorted(holders))
+
+    while board_refs:
+        members = set()
+        async for board in db.get_all(board_refs):
+            if board.exists and not storage.is_stub(board.to_dict()):
+                members.update(board.to_dict().get("members", []))
+                yield board
+        # members whose copy the index doesn't know about yet
+        missing = sorted(members - holders) if storage.uses_replicas() else []
+        holders.update(missing)
+        board_refs = [storage.replica_board_ref(db, member_id, board_id) for member_id in missing]
+
+
+async def recompute(db, board_id=None, dry_run=False):
+    # recount every copy of the board we store from its own tasks. returns the number of board documents checked and
+    # how many of them had drifted
+    checked = 0
+    repaired = 0
+    async for board in _one_board(db, board_id) if board_id else storage.iter_board_copies(db):
+        stats = compute_stats([task.to_dict() async for task in board.reference.collection("tasks").stream()])
+        checked += 1
+        if (board.to_dict().get("stats") or {}) == stats:
+            continue
+
+        repaired += 1
+        print(f"{board.reference.path}: {read_stats(board.to_dict())} -> {read_stats({'stats': stats})}")
+        if not dry_run:
+            await board.reference.update({"stats": stats, **board_versions.bump()})
+    return checked, repaired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-board task counters")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    recompute_parser = subcommands.add_parser("recompute", help="recount tasks and repair boards whose counters drifted")
+    recompute_parser.add_argument("--board", help="only recompute this board id")
+    recompute_parser.add_argument("--dry-run", action="store_true", help="report drift without writing")
+    args = parser.parse_args()
+
+    if args.command == "recompute":
+        checked, repaired = asyncio.run(recompute(storage.client(), args.board, args.dry_run))
+        print(f"Checked {checked} board documents, {'found' if args.dry_run else 'repaired'} {repaired} with drifted counters")
+
+
+if __name__ == "__main__":
+    main()
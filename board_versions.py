@@ -0,0 +1,56 @@
+# every board document carries a "version" that each mutation increments in the same batch as its writes (see bump).
+# the read endpoints turn it into an ETag, so a client polling a board that hasn't changed gets a 304 for the price of
+# the board read the handler does anyway, and the tasks subcollection isn't touched at all.
+#
+# boards written before the counter existed have no version yet and count as 0 until their next mutation.
+import hashlib
+
+from fastapi.responses import Response
+from google.cloud import firestore
+
+# browsers may keep the responses but have to check back with us before reusing them
+CACHE_CONTROL = "private, no-cache"
+
+
+def bump():
+    # merge into the update applied to every copy of the board
+    return {"version": firestore.Increment(1)}
+
+
+def board_version(board_data):
+    return board_data.get("version", 0)
+
+
+def board_etag(board_id, board_data, *variant):
+    # variant is whatever else shapes the response on top of the board, like the query string of a task listing
+    tag = f"{board_id}.{board_version(board_data)}"
+    if variant:
+        tag += "." + hashlib.sha1("\x00".join(str(part) for part in variant).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{tag}"'
+
+
+def boards_etag(user_id, boards):
+    # for a whole board list: changes when a board is added, removed or mutated
+    digest = hashlib.sha1(user_id.encode("utf-8"))
+    for board_id, board_data in sorted(boards, key=lambda board: board[0]):
+        digest.update(f"\x00{board_id}.{board_version(board_data)}".encode("utf-8"))
+    return f'W/"boards.{digest.hexdigest()[:16]}"'
+
+
+def matches(request, etag):
+    # If-None-Match can hold several tags and they are compared weakly, so the W/ prefix doesn't matter
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == wanted for candidate in header.split(","))
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers=headers(etag))
+
+
+def headers(etag, extra=None):
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, **(extra or {})}
@@ -0,0 +1,144 @@
+# compression of responses, negotiated with the client's Accept-Encoding. brotli when the client takes it and the
+# package is installed, gzip otherwise, so brotli is an optional extra rather than a requirement:
+#
+#   pip install brotli
+#
+# CompressionMiddleware compresses the app's own responses (JSON, NDJSON and HTML pages) once they are at least
+# MIN_SIZE bytes, anything smaller costs more to compress than it saves. streamed responses (the ndjson task listing)
+# are compressed as they go, each chunk flushed so nothing is held back. the event stream is left alone, and static
+# files are precompressed when they are built (see static_assets.py).
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bytes below which a response is sent as it is
+MIN_SIZE = 1024
+
+# media types that are worth compressing
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/html")
+
+# levels for responses compressed on the fly, fast rather than as small as possible
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# file extension of each encoding's precompressed copy
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+
+def available():
+    # the encodings we can produce, most preferred first
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding, encodings=None):
+    # the first of encodings (available() by default) the client accepts, or None for no compression
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in available() if encodings is None else encodings:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, finish):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, finish):
+        return self._compressor.process(data) + (self._compressor.finish() if finish else self._compressor.flush())
+
+
+def compressor(encoding, best=False):
+    # best is for files compressed once at build time
+    if encoding == "br":
+        return _Brotli(11 if best else BROTLI_QUALITY)
+    return _Gzip(9 if best else GZIP_LEVEL)
+
+
+def compress(data, encoding, best=False):
+    return compressor(encoding, best).compress(data, True)
+
+
+def _compressible(headers):
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type in COMPRESSIBLE_TYPES and "content-encoding" not in headers
+
+
+class CompressionMiddleware:
+    # pure ASGI like MetricsMiddleware, so streamed responses keep streaming
+    def __init__(self, app, minimum_size=MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # the start of the response is held back until the first body chunk says whether it is worth compressing
+        start = None
+        encoder = None
+
+        async def send_compressed(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                if _compressible(headers):
+                    # the response depends on Accept-Encoding whether or not this one ends up compressed
+                    headers.add_vary_header("Accept-Encoding")
+                    if more_body or len(body) >= self.minimum_size:
+                        encoder = compressor(encoding)
+                        headers["Content-Encoding"] = encoding
+                        if "content-length" in headers:
+                            del headers["Content-Length"]
+                if encoder is not None and not more_body:
+                    # the whole body is here, so the compressed length is known
+                    body = encoder.compress(body, True)
+                    headers["Content-Length"] = str(len(body))
+                    encoder = None
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+
+            if encoder is not None:
+                message = {**message, "body": encoder.compress(body, not more_body)}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
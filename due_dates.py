@@ -0,0 +1,207 @@
+# what is overdue or due soon, behind GET /boards/{board_id}/overdue and GET /me/due, and the notifications sent when a
+# task falls due.
+#
+# both endpoints are a single range query on the task index entries (see task_search.py), which have one entry per task
+# whatever STORAGE_MODE is and carry the due date, completion and assignee:
+#
+#   overdue   board_id == X and completed == False and due_date < now                        order by due_date
+#   due soon  assigned_to == Y and completed == False and now <= due_date < now + hours      order by due_date
+#
+# so they only read the tasks they return, and what one worker writes is seen by every other one straight away. the
+# composite indexes they need are in firestore.indexes.json.
+#
+# the notification scheduler sends a "due_soon" notification REMINDER_LEAD seconds before a task is due and an "overdue"
+# one when it is, to every sink listed in DUE_NOTIFICATIONS (comma separated). it is off unless DUE_NOTIFICATIONS is
+# set, and should be set on one worker only: every worker that runs it sends its own notifications.
+#
+#   log     a log record per notification
+#   events  a task_due event on the board's event stream, {"kind": ..., "task": {...}}. only clients connected to the
+#           worker that runs the scheduler get it
+#
+# other sinks can be added with add_sink(), a sink is anything with an async notify(notification). every POLL_INTERVAL
+# seconds the scheduler queries the tasks that fell due since its last look and the ones due within REMINDER_LEAD,
+# with the composite index on (completed, due_date), so it never reads more than the next hour's tasks. a task that is
+# created or moved to within REMINDER_LEAD of its due date gets its "due_soon" on the next poll. notifications whose
+# time had already passed when the scheduler started are not sent, so a restart doesn't repeat them.
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+import app_logging
+import board_events
+import lazy
+import task_query
+import task_search
+
+# seconds before the due date that the "due_soon" notification goes out
+REMINDER_LEAD = 3600
+
+# seconds between the scheduler's queries, and so how late a notification can be
+POLL_INTERVAL = int(os.environ.get("DUE_POLL_INTERVAL", "60"))
+
+DEFAULT_HOURS = 24
+MAX_HOURS = 24 * 31
+
+DUE_SOON = "due_soon"
+OVERDUE = "overdue"
+
+# what a result shows of a task
+FIELDS = ("title", "due_date", "assigned_to")
+
+log = app_logging.get_logger("due_dates")
+
+
+def timestamp(value):
+    # due dates are naive UTC when the client sent no offset, timezone aware otherwise
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def parse_hours(value):
+    if value is None:
+        return DEFAULT_HOURS
+    try:
+        hours = float(value)
+    except ValueError:
+        raise ValueError("hours must be a number")
+    if not 0 < hours <= MAX_HOURS:
+        raise ValueError(f"hours must be more than 0 and at most {MAX_HOURS}")
+    return hours
+
+
+def _open_tasks(db):
+    return db.collection(task_search.INDEX_COLLECTION).where("completed", "==", False)
+
+
+def _task(entry_data):
+    return task_query.serialize_task(entry_data["task_id"], {field: entry_data.get(field) for field in FIELDS})
+
+
+async def _entries(query):
+    async for entry_doc in query.stream():
+        yield entry_doc.to_dict()
+
+
+async def overdue(db, board_id, now=None):
+    # open tasks on the board that were due before now, the longest overdue first
+    now = now or datetime.now(timezone.utc)
+    query = _open_tasks(db).where("board_id", "==", board_id).where("due_date", "<", now).order_by("due_date")
+    return [_task(entry_data) async for entry_data in _entries(query)]
+
+
+async def due_soon(db, user_id, hours, now=None):
+    # open tasks assigned to the user that fall due in the next `hours`, the soonest first, as (board_id, task)
+    now = now or datetime.now(timezone.utc)
+    query = (
+        _open_tasks(db).where("assigned_to", "==", user_id)
+        .where("due_date", ">=", now).where("due_date", "<", now + timedelta(hours=hours))
+        .order_by("due_date")
+    )
+    return [(entry_data["board_id"], _task(entry_data)) async for entry_data in _entries(query)]
+
+
+class LogSink:
+    async def notify(self, notification):
+        log.info("task due", extra={
+            "kind": notification["kind"],
+            "board_id": notification["board_id"],
+            "task_id": notification["task"]["id"],
+            "assigned_to": notification["task"].get("assigned_to"),
+        })
+
+
+class BoardEventSink:
+    async def notify(self, notification):
+        board_events.hub.publish(notification["board_id"], "task_due", {
+            "kind": notification["kind"], "task": notification["task"],
+        })
+
+
+SINKS = {"log": LogSink, "events": BoardEventSink}
+
+
+class Scheduler:
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self._task = None
+        # where the last poll left off: tasks due up to then have had their "overdue"
+        self._checked_until = None
+        # (board_id, task_id, due timestamp) of the tasks within REMINDER_LEAD that have had their "due_soon", until
+        # they fall due
+        self._reminded = set()
+
+    def start(self, db):
+        # off when there is nowhere to send notifications
+        if self.sinks and self._task is None:
+            self._task = asyncio.create_task(self._run(db))
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, db):
+        # the client may not have been built yet, that happens off the event loop
+        db = await lazy.ready(db)
+        while True:
+            try:
+                await self.poll(db)
+            except Exception:
+                # the next poll picks up from where the last one that worked left off
+                log.exception("checking for due tasks failed")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def poll(self, db, now=None):
+        # returns the notifications it sent
+        now = now or datetime.now(timezone.utc)
+        starting = self._checked_until is None
+        checked_from = now if starting else self._checked_until
+
+        soon = _open_tasks(db).where("due_date", ">", now).where("due_date", "<=", now + timedelta(seconds=REMINDER_LEAD))
+        reminders = []
+        reminded = set()
+        async for entry_data in _entries(soon.order_by("due_date")):
+            key = (entry_data["board_id"], entry_data["task_id"], timestamp(entry_data["due_date"]))
+            reminded.add(key)
+            if not starting and key not in self._reminded:
+                reminders.append({"kind": DUE_SOON, "board_id": entry_data["board_id"], "task": _task(entry_data)})
+
+        fell_due = []
+        if checked_from < now:
+            query = _open_tasks(db).where("due_date", ">", checked_from).where("due_date", "<=", now)
+            fell_due = [
+                {"kind": OVERDUE, "board_id": entry_data["board_id"], "task": _task(entry_data)}
+                async for entry_data in _entries(query.order_by("due_date"))
+            ]
+
+        # only what is still ahead is kept, the rest has fallen due
+        self._reminded = reminded
+        self._checked_until = now
+        for notification in fell_due + reminders:
+            await self._send(notification)
+        return fell_due + reminders
+
+    async def _send(self, notification):
+        for sink in self.sinks:
+            try:
+                await sink.notify(notification)
+            except Exception:
+                # one broken sink doesn't keep the others from hearing about it
+                log.exception("due date notification failed", extra={"sink": type(sink).__name__})
+
+
+def sinks(environ=os.environ):
+    names = [name.strip() for name in environ.get("DUE_NOTIFICATIONS", "").split(",") if name.strip()]
+    for name in names:
+        if name not in SINKS:
+            raise ValueError(f"Unknown DUE_NOTIFICATIONS sink {name!r}")
+    return [SINKS[name]() for name in names]
+
+
+scheduler = Scheduler(sinks())
+
+
+def add_sink(sink):
+    scheduler.sinks.append(sink)
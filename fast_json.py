@@ -0,0 +1,74 @@
+# JSON encoding for the big responses (task listings, board lists, change feed events). uses orjson when it is
+# installed and the standard library otherwise, so it is an optional speed up rather than a requirement:
+#
+#   pip install orjson
+#
+# both encoders take datetimes as they come out of firestore and write them the way .isoformat() does, so handlers hand
+# over task and board documents as they are instead of converting every timestamp first.
+import json
+from datetime import date, datetime
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# bytes of encoded lines collected before they are sent
+NDJSON_CHUNK_SIZE = 16 * 1024
+
+
+def _default(value):
+    # firestore timestamps are a datetime subclass, which orjson doesn't serialize on its own
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    # returns bytes
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# characters that could end a <script> element or break it apart, written as escapes instead
+_SCRIPT_ESCAPES = {"<": "\\u003c", ">": "\\u003e", "&": "\\u0026", "\u2028": "\\u2028", "\u2029": "\\u2029"}
+
+
+def script_json(content):
+    # a str that can go inside <script type="application/json"> in a template as it is, for data embedded in a page
+    text = dumps(content).decode("utf-8")
+    for character, escape in _SCRIPT_ESCAPES.items():
+        text = text.replace(character, escape)
+    return text
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def wants_ndjson(request):
+    # streaming is opt in, either with the Accept header or ?format=ndjson for clients that can't set headers
+    return request.query_params.get("format") == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(rows, headers=None):
+    # rows is an async iterator of objects. each one is encoded as soon as it is produced, and the lines go out in chunks
+    # of about NDJSON_CHUNK_SIZE because a send per line costs more than encoding it
+    async def lines():
+        chunk = bytearray()
+        async for row in rows:
+            chunk += dumps(row)
+            chunk += b"\n"
+            if len(chunk) >= NDJSON_CHUNK_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+        if chunk:
+            yield bytes(chunk)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,197 @@
+# background jobs for work that is too big to finish inside a request. the request records what has to happen, starts a
+# job and returns its id, and the job runs on the same worker's event loop while the client follows it with
+# GET /jobs/{job_id}. a job is a document in the jobs collection:
+#
+#   {"kind": "add_member", "params": {...}, "created_by": USER_ID, "status": "queued" | "running" | "succeeded" | "failed",
+#    "progress": {"step": ..., "done": ..., "total": ... or None}, "retries": 0, "error": None,
+#    "created_at": ..., "updated_at": ..., "finished_at": ...}
+#
+# the work itself is a coroutine function registered for its kind with @register(kind). it is called as
+# run(job, db, **params) and reports progress through job.step() and job.advance(). writes go through job.commit(), which
+# retries a failed commit with backoff, rebuilding the writes each time. every step has to be safe to repeat, because a
+# retry can follow a commit that did land, and a job whose worker stopped before it finished can be run again from the
+# start (see member_jobs.py rerun).
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from google.api_core import exceptions
+
+import app_logging
+import metrics
+
+JOBS_COLLECTION = "jobs"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# tries per write, the first one included
+MAX_ATTEMPTS = 5
+
+# seconds before the first retry, doubled for every one after it
+RETRY_DELAY = 0.5
+
+# progress is written at most this often in seconds, plus at the start of every step
+PROGRESS_INTERVAL = 1.0
+
+# errors that are worth another try. anything else fails the job straight away
+TRANSIENT_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+log = app_logging.get_logger("jobs")
+
+_kinds = {}
+
+# the asyncio tasks of the jobs running on this worker, so they aren't garbage collected halfway
+_running = set()
+
+
+class CommitFailed(Exception):
+    # some of a WriteBatcher's chunks didn't land. failures is what WriteBatcher.commit() returned
+    def __init__(self, failures):
+        super().__init__(failures[0]["error"])
+        self.failures = failures
+
+
+def register(kind):
+    def decorator(run):
+        _kinds[kind] = run
+        return run
+    return decorator
+
+
+def job_ref(db, job_id):
+    return db.collection(JOBS_COLLECTION).document(job_id)
+
+
+class Job:
+    def __init__(self, db, job_id, data):
+        self.db = db
+        self.id = job_id
+        self.data = data
+        self._saved_at = 0.0
+
+    @property
+    def ref(self):
+        return job_ref(self.db, self.id)
+
+    async def _save(self, **fields):
+        self.data.update(fields, updated_at=datetime.utcnow())
+        update = {**fields, "progress": self.data["progress"], "retries": self.data["retries"], "updated_at": self.data["updated_at"]}
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                await self.ref.update(update)
+                break
+            except TRANSIENT_ERRORS as e:
+                await self._backoff(attempt, e)
+        self._saved_at = time.monotonic()
+
+    async def _backoff(self, attempt, error):
+        # re-raises error once the attempts are used up
+        if attempt == MAX_ATTEMPTS:
+            raise error
+        log.warning("job write failed, retrying", extra={"job_id": self.id, "attempt": attempt, "error": str(error)})
+        self.data["retries"] += 1
+        await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+    async def step(self, name, total=None):
+        self.data["progress"] = {"step": name, "done": 0, "total": total}
+        await self._save()
+
+    async def advance(self, count=1):
+        self.data["progress"]["done"] += count
+        if time.monotonic() - self._saved_at >= PROGRESS_INTERVAL:
+            await self._save()
+
+    async def commit(self, build):
+        # build() returns a storage.WriteBatcher with the writes to make, or None once there is nothing left to do. it is
+        # called again for every attempt, so it can re-read whatever it bases the writes on. returns what build() did
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                batcher = await build()
+                if batcher is None:
+                    return None
+                failures = await batcher.commit()
+                if not failures:
+                    return batcher
+                raise CommitFailed(failures)
+            except (CommitFailed, *TRANSIENT_ERRORS) as e:
+                await self._backoff(attempt, e)
+
+
+async def start(db, kind, created_by, **params):
+    # records the job and starts it on this worker. returns the job id
+    if kind not in _kinds:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    ref = db.collection(JOBS_COLLECTION).document()
+    now = datetime.utcnow()
+    data = {
+        "kind": kind,
+        "params": params,
+        "created_by": created_by,
+        "status": QUEUED,
+        "progress": {"step": None, "done": 0, "total": None},
+        "retries": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    await ref.set(data)
+    schedule(Job(db, ref.id, data))
+    return ref.id
+
+
+def schedule(job):
+    task = asyncio.create_task(_run(job))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def _run(job):
+    # the job's firestore operations belong to no request, the one that started it has usually finished by now
+    metrics.untracked()
+    run = _kinds[job.data["kind"]]
+    extra = {"job_id": job.id, "kind": job.data["kind"]}
+    log.info("job started", extra=extra)
+    try:
+        await job._save(status=RUNNING)
+        await run(job, job.db, **job.data["params"])
+    except Exception as e:
+        log.exception("job failed", extra=extra)
+        try:
+            await job._save(status=FAILED, error=str(e), finished_at=datetime.utcnow())
+        except Exception:
+            log.exception("could not record the job's failure", extra=extra)
+        return
+    await job._save(status=SUCCEEDED, finished_at=datetime.utcnow())
+    log.info("job succeeded", extra={**extra, "retries": job.data["retries"]})
+
+
+async def load(db, job_id):
+    # the job document as a Job, or None
+    job_doc = await job_ref(db, job_id).get()
+    if not job_doc.exists:
+        return None
+    return Job(db, job_doc.id, job_doc.to_dict())
+
+
+async def drain(timeout=None):
+    # waits for the jobs running on this worker, e.g. on shutdown. returns how many were still running at the timeout
+    if not _running:
+        return 0
+    _, pending = await asyncio.wait(set(_running), timeout=timeout)
+    return len(pending)
+
+
+def serialize_job(job):
+    return {"id": job.id, **job.data}
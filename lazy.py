@@ -0,0 +1,65 @@
+# clients that are slow to build and not needed until a request uses them. main.py wraps the firestore client
+# (credential discovery, the gRPC channel), the HTTP adapter the token verifier fetches signing certs with and the
+# template environment in Lazy, so importing the app doesn't wait for any of them and a cold worker starts taking
+# requests sooner. warmup.py can build them right after startup instead of on the first request.
+#
+# a Lazy stands in for the value itself: attribute access and calls go through to it, building it the first time,
+# once, however many threads get there together. a factory that raises is tried again on the next use.
+#
+# building one can take a while and the lock is a thread lock, so the event loop itself never builds or waits for one:
+# async code gets at a Lazy through ready(), which does both on a worker thread, and BuildFirst makes sure the ones
+# request handlers use directly are built before a request reaches them.
+import asyncio
+import threading
+
+
+class Lazy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self.built = False
+
+    def get(self):
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    self._value = self._factory()
+                    self.built = True
+        return self._value
+
+    def __getattr__(self, name):
+        # only called for attributes the Lazy doesn't have itself
+        if name in ("_factory", "_lock", "_value", "built"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+async def ready(value):
+    # builds a Lazy on a worker thread so the event loop isn't held up meanwhile, or waits there for the thread that is
+    # already building it. anything else is returned as it is
+    if isinstance(value, Lazy):
+        if value.built:
+            return value.get()
+        return await asyncio.to_thread(value.get)
+    return value
+
+
+class BuildFirst:
+    # ASGI middleware: a request waits (without blocking the loop) for `values` to be built before it is handled. once
+    # they are it is one attribute check per value. requests for the paths in skip, which don't use them, go straight
+    # through
+    def __init__(self, app, values, skip=()):
+        self.app = app
+        self.values = values
+        self.skip = frozenset(skip)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.skip:
+            for value in self.values:
+                if not value.built:
+                    await ready(value)
+        await self.app(scope, receive, send)
@@ -1,23 +1,190 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+import asyncio
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+from google.api_core import exceptions
 from google.cloud import firestore
 from datetime import datetime
+from token_cache import TokenVerifier
+import app_logging
+import board_access
+import board_events
+import board_index
+import board_snapshot
+import board_stats
+import board_versions
+import compression
+import due_dates
+import fast_json
+import jobs
+import lazy
+import member_jobs
+import metrics
+import my_tasks
+import static_assets
+import task_query
+import task_search
+import title_index
+import storage
+import task_batch
+import user_directory
+import warmup
+
+#structured logs on stderr, see app_logging.py for the LOG_* settings
+app_logging.configure()
+log = app_logging.get_logger("main")
 
 #define the app that will contain all of our routing for Fast API
 app = FastAPI()
 
-#we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
+#latency, status and firestore operations of every request for GET /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+#JSON and pages over compression.MIN_SIZE go out compressed for clients that accept it, see compression.py
+app.add_middleware(compression.CompressionMiddleware)
+
+#we need a request object to be able to talk to firebase for verifying user logins. it is only built (and the requests
+#library only imported) when the signing certs are first fetched, see lazy.py
+def build_request_adapter():
+    from google.auth.transport import requests
+    return requests.Request()
+
+firebase_request_adapter = lazy.Lazy(build_request_adapter)
+
+#verified tokens and the firebase signing certs are cached in process so a returning user doesn't pay for the crypto check
+token_verifier = TokenVerifier(firebase_request_adapter)
+
+#define the static and templates directories. built assets are served precompressed and cached for good, templates
+#link to them with asset_url (see static_assets.py)
+app.mount('/static', static_assets.StaticAssets(directory='static'), name='static')
+
+def build_templates():
+    templates = Jinja2Templates(directory="templates")
+    templates.env.globals["asset_url"] = static_assets.asset_url
+    return templates
+
+templates = lazy.Lazy(build_templates)
+
+#the async client so that firestore round trips don't block the event loop for every other request on this worker, or
+#the in-memory store with DATASTORE=memory (see storage.client). built on first use rather than at import
+db = lazy.Lazy(storage.client)
+
+#handlers use db and templates directly, so they are built on a worker thread before the first request gets to them.
+#the health checks answer whether or not they are
+app.add_middleware(lazy.BuildFirst, values=[db, templates], skip=["/healthz", "/readyz"])
+
+#how long a worker that is shutting down waits for its background jobs
+JOB_SHUTDOWN_TIMEOUT = 20
+
+@app.on_event("startup")
+async def start_warm_up():
+    # the WARM_UP hooks run in the background, GET /readyz says when they are done (see warmup.py)
+    warmup.readiness.start(warmup.requested())
+
+@warmup.hook("firestore")
+async def warm_up_firestore():
+    # one read of a document that doesn't exist finds the credentials and connects the channel
+    client = await lazy.ready(db)
+    await client.collection("warmup").document("warmup").get()
+
+@warmup.hook("certs")
+async def warm_up_certs():
+    await asyncio.to_thread(token_verifier.certs.get)
+
+@warmup.hook("templates")
+async def warm_up_templates():
+    environment = (await lazy.ready(templates)).env
+    for name in ("main.html", "board.html"):
+        environment.get_template(name)
+
+@app.on_event("startup")
+async def watch_board_access():
+    # off unless BOARD_ACCESS_LISTENER=1, see board_access.start_listener
+    app.state.board_access_watches = board_access.start_listener()
+
+@app.on_event("startup")
+async def start_due_notifications():
+    # sends due-soon and overdue notifications to the DUE_NOTIFICATIONS sinks, off unless it is set (see due_dates.py)
+    due_dates.scheduler.start(db)
+
+@app.on_event("shutdown")
+async def finish_jobs():
+    # give background jobs on this worker a chance to finish, see member_jobs.py for rerunning the ones that don't
+    await jobs.drain(JOB_SHUTDOWN_TIMEOUT)
+    due_dates.scheduler.stop()
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the worker is up and answering, nothing else is checked
+    return JSONResponse(status_code=200, content={"status": "ok"}, headers={"Cache-Control": "no-store"})
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: 503 until the WARM_UP hooks have finished, so new instances only get traffic once they are warm
+    status = warmup.readiness.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status, headers={"Cache-Control": "no-store"})
+
+@app.exception_handler(board_access.AccessDenied)
+async def access_denied(request: Request, exc: board_access.AccessDenied):
+    return JSONResponse(status_code=exc.status_code, content={"message": exc.message})
+
+async def current_user(request: Request):
+    id_token = request.cookies.get("token")
+    if not id_token:
+        raise board_access.AccessDenied(401, "Unauthorized")
+    
+    try:
+        user_token = await token_verifier.verify_async(id_token)
+    except ValueError:
+        user_token = None
+    if not user_token:
+        raise board_access.AccessDenied(401, "Invalid token")
+    return user_token
+
+async def authorize(board_id, user_id, creator_action=None):
+    # the one membership/creator check for board-scoped handlers. it goes through the board access cache, so a board
+    # this worker has seen recently is authorized without reading it again
+    if not board_id:
+        raise board_access.AccessDenied(400, "Board ID is required")
+    
+    access = await board_access.lookup(db, board_id, user_id)
+    if access is None:
+        raise board_access.AccessDenied(404, "Board not found")
+    if creator_action and not access.is_creator:
+        raise board_access.AccessDenied(403, f"Only board creator can {creator_action}")
+    if not access.is_member:
+        raise board_access.AccessDenied(403, "Access denied")
+    return access
+
+async def board_member(board_id: str, user_token=Depends(current_user)):
+    return await authorize(board_id, user_token["sub"])
+
+def board_creator(action):
+    async def dependency(board_id: str, user_token=Depends(current_user)):
+        return await authorize(board_id, user_token["sub"], action)
+    return dependency
 
-#define the static and templates directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
+def fanout_response(batcher, failures, status_code, message, failure_message, **extra):
+    # copies of the board (and indexes) that didn't take the write are reported back to the caller rather than only
+    # printed. if none of the copies took it the mutation failed outright
+    if not failures:
+        return JSONResponse(status_code=status_code, content={"message": message, **extra})
+    if not landed(batcher, failures):
+        return JSONResponse(status_code=500, content={"message": failure_message, "failed": failures})
+    return JSONResponse(status_code=207, content={"message": f"{message} with errors", "failed": failures, **extra})
 
-db = firestore.Client()
+def job_response(job_id, message):
+    # the change is recorded and the rest is up to a background job the client can follow at Location
+    return JSONResponse(status_code=202, content={"message": message, "job_id": job_id}, headers={"Location": f"/jobs/{job_id}"})
+
+def landed(batcher, failures):
+    # whether a write made it to at least one copy of the board. index writes don't count, they only follow the copies
+    return not failures or not {failure["target"] for failure in failures} >= batcher.copies
+
+def publish(batcher, failures, board_id, event, data):
+    # pushes a change to everyone watching the board, as long as it landed on at least one copy of it
+    if landed(batcher, failures):
+        board_events.hub.publish(board_id, event, data)
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -31,11 +198,10 @@ async def root(request: Request):
     # if we have an ID token we will verify it against firebase. If it doesn't check out then log the error message that is returned
     if id_token:
         try:
-            user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+            user_token = await token_verifier.verify_async(id_token)
         except ValueError as err:
-            # dump this message to console as it will not be displayed on the template. use for debugging but if you are building for
-            # production you should handle this much more gracefully.
-            print(str(err))
+            # logged as it will not be displayed on the template
+            log.info("token verification failed", extra={"error": str(err)})
     
     return templates.TemplateResponse('main.html', {"request":request, 'user_token':user_token, "error_message":error_message})
 
@@ -43,66 +209,57 @@ async def root(request: Request):
 async def view_board(request: Request, board_id: str):
     id_token = request.cookies.get("token")
     if not id_token:
-        print("No token found")
+        log.debug("no token", extra={"board_id": board_id})
         return JSONResponse(status_code=401, content={"message": "Unauthorized"})
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = await token_verifier.verify_async(id_token)
         if not user_token:
-            print("Invalid token")
+            log.debug("invalid token", extra={"board_id": board_id})
             return JSONResponse(status_code=401, content={"message": "Invalid token"})
         
         user_id = user_token["sub"]
-        print(f"User ID: {user_id}")
-        print(f"Board ID: {board_id}")
         
-        # First check if the board exists in the user's collection
-        user_board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-        user_board_doc = user_board_ref.get()
-        
-        if user_board_doc.exists:
-            print("Found board in user's collection")
-            board_data = user_board_doc.to_dict()
-            print(f"Board members: {board_data.get('members', [])}")
+        # First check the canonical board and/or the user's own copy, depending on the storage mode
+        board_ref, board_data = await storage.load_board(db, board_id, user_id)
+
+        if board_data is not None:
+            log.debug("board found", extra={"board_id": board_id, "user_id": user_id, "members": len(board_data.get("members", []))})
+        elif not storage.uses_replicas():
+            log.debug("board not found", extra={"board_id": board_id, "user_id": user_id})
+            return JSONResponse(status_code=404, content={"message": "Board not found"})
         else:
-            print("Board not found in user's collection, searching other users")
-            # If not in user's collection, search all users
-            board_found = False
-            all_users = db.collection("users").stream()
-            
-            for user in all_users:
-                print(f"Checking user: {user.id}")
-                other_board_ref = db.collection("users").document(user.id).collection("taskboards").document(board_id)
-                other_board_doc = other_board_ref.get()
-                
-                if other_board_doc.exists:
-                    print(f"Found board in user {user.id}'s collection")
-                    board_data = other_board_doc.to_dict()
-                    print(f"Board members: {board_data.get('members', [])}")
-                    # Check if the current user is a member
-                    if user_id in board_data.get("members", []):
-                        print("Current user is a member, copying board")
-                        board_found = True
-                        # Copy the board to user's collection if they don't have it
-                        user_board_ref.set(board_data)
-                        # Copy all tasks
-                        tasks_ref = other_board_ref.collection("tasks").stream()
-                        for task in tasks_ref:
-                            task_data = task.to_dict()
-                            user_board_ref.collection("tasks").document(task.id).set(task_data)
-                        break
-            
-            if not board_found:
-                print("Board not found in any user's collection")
+            log.debug("board not in user's collection, looking it up in the board index", extra={"board_id": board_id, "user_id": user_id})
+            # If not in user's collection, find the owner's copy through the index
+            user_board_ref = storage.replica_board_ref(db, user_id, board_id)
+            other_board_ref, other_board_doc = await board_index.find_board(db, board_id)
+            if other_board_doc is None:
+                log.debug("board not found in board index", extra={"board_id": board_id, "user_id": user_id})
                 return JSONResponse(status_code=404, content={"message": "Board not found"})
+
+            board_ref, board_data = other_board_ref, other_board_doc.to_dict()
+            # Check if the current user is a member
+            if user_id in board_data.get("members", []):
+                log.info("copying board to member", extra={"board_id": board_id, "user_id": user_id})
+                # Copy the board and all tasks to user's collection if they don't have it
+                batcher = storage.WriteBatcher(db)
+                batcher.set(user_board_ref, board_data)
+                tasks_ref = other_board_ref.collection("tasks").stream()
+                async for task in tasks_ref:
+                    batcher.set(user_board_ref.collection("tasks").document(task.id), task.to_dict())
+                for failure in await batcher.commit():
+                    log.warning("copying board to member failed", extra={"board_id": board_id, "user_id": user_id, "error": failure["error"]})
+                await board_index.add_replica(db, board_id, user_id)
         
         # At this point, we should have board_data
         if user_id not in board_data.get("members", []):
-            print(f"Access denied. User {user_id} not in members list: {board_data.get('members', [])}")
+            log.info("access denied", extra={"board_id": board_id, "user_id": user_id})
             return JSONResponse(status_code=403, content={"message": "Access denied"})
         
         is_creator = user_id == board_data.get("creator_id")
-        print(f"User is creator: {is_creator}")
+        
+        # The members, stats and first page of tasks go into the page, so it renders without fetching them first
+        snapshot = await board_snapshot.read(db, board_id, board_ref, board_data)
         
         return templates.TemplateResponse('board.html', {
             "request": request,
@@ -110,14 +267,17 @@ async def view_board(request: Request, board_id: str):
             "error_message": "No error here",
             "board_id": board_id,
             "is_creator": is_creator,
-            "board_title": board_data.get("title", "")
+            "board_title": board_data.get("title", ""),
+            "snapshot": fast_json.script_json(snapshot),
+            "task_page_size": board_snapshot.TASK_PAGE_SIZE,
+            "task_card_fields": board_snapshot.CARD_FIELDS,
         })
         
     except ValueError as e:
-        print(f"Error in view_board: {str(e)}")
+        log.info("view_board token error", extra={"board_id": board_id, "error": str(e)})
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    except Exception as e:
-        print(f"Unexpected error in view_board: {str(e)}")
+    except Exception:
+        log.exception("view_board failed", extra={"board_id": board_id})
         return JSONResponse(status_code=500, content={"message": "Internal server error"})
 
 @app.post("/boards")
@@ -126,24 +286,36 @@ async def create_board(request: Request):
     if not id_token:
         return JSONResponse(status_code=401, content={"message": "Unauthorized"})
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    user_token = await token_verifier.verify_async(id_token)
     if not user_token:
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
     
     user_id = user_token["sub"]
     data = await request.json()
     
-    # Create board under user's document
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document()
+    # Create the board (canonical and/or under the user's document, depending on the storage mode)
+    board_refs = storage.new_board_refs(db, user_id)
+    board_id = board_refs[0].id
     board_data = {
         "title": data.get("title"),
         "creator_id": user_id,
         "members": [user_id],  # Initialize with creator
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "stats": board_stats.initial_stats()
     }
-    board_ref.set(board_data)
-    
-    return JSONResponse(status_code=201, content={"message": "Board created successfully", "board_id": board_ref.id})
+    batcher = storage.WriteBatcher(db)
+    for board_ref in board_refs:
+        batcher.set(board_ref, board_data)
+    if storage.uses_canonical():
+        batcher.set(storage.membership_ref(db, user_id, board_id), {"joined_at": board_data["created_at"]})
+    
+    failures = await batcher.commit()
+    if failures:
+        return JSONResponse(status_code=500, content={"message": "Failed to create board", "failed": failures})
+    if storage.uses_replicas():
+        await board_index.record_board(db, board_id, user_id)
+    
+    return JSONResponse(status_code=201, content={"message": "Board created successfully", "board_id": board_id})
 
 @app.get("/boards")
 async def get_boards(request: Request):
@@ -151,197 +323,111 @@ async def get_boards(request: Request):
     if not id_token:
         return JSONResponse(status_code=401, content={"message": "Unauthorized"})
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    user_token = await token_verifier.verify_async(id_token)
     if not user_token:
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
     
     user_id = user_token["sub"]
     
-    # Get boards from user's collection
-    boards_ref = db.collection("users").document(user_id).collection("taskboards").stream()
+    # Get the user's boards (from their memberships and/or their own copies)
+    boards_ref = await storage.list_boards(db, user_id)
+    
+    # Nothing to send if none of the boards changed since the client's copy
+    etag = board_versions.boards_etag(user_id, boards_ref)
+    if board_versions.matches(request, etag):
+        return board_versions.not_modified(etag)
     
-    # Convert Firestore documents to dict and handle datetime serialization
-    boards = []
-    for board in boards_ref:
-        board_dict = board.to_dict()
-        # Convert datetime to ISO format string
-        if "created_at" in board_dict:
-            board_dict["created_at"] = board_dict["created_at"].isoformat()
-        boards.append({"id": board.id, **board_dict})
+    # Datetimes are written out in ISO format by the encoder
+    boards = [{"id": board_id, **board_dict} for board_id, board_dict in boards_ref]
     
-    return JSONResponse(status_code=200, content=boards)
+    return fast_json.FastJSONResponse(status_code=200, content=boards, headers=board_versions.headers(etag))
 
 @app.get("/boards/{board_id}/members")
-async def get_board_members(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+async def get_board_members(board_id: str, request: Request, access=Depends(board_member)):
+    # The members list and version come from the board document itself
+    board_ref, board_data = await access.board()
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+    etag = board_versions.board_etag(board_id, board_data, "members")
+    if board_versions.matches(request, etag):
+        return board_versions.not_modified(etag)
     
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        # Try to find the board in other users' collections
-        all_users = db.collection("users").stream()
-        board_found = False
-        for user in all_users:
-            board_ref = db.collection("users").document(user.id).collection("taskboards").document(board_id)
-            board_doc = board_ref.get()
-            if board_doc.exists:
-                board_data = board_doc.to_dict()
-                if user_id in board_data.get("members", []):
-                    board_found = True
-                    break
-        
-        if not board_found:
-            return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
+    # Get member details, from the profile cache or with a single batched read for the ones it doesn't have
+    members = await board_snapshot.members(db, board_data)
     
-    # Get member details
-    members = []
-    for member_id in board_data.get("members", []):
-        user_doc = db.collection("users").document(member_id).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            members.append({
-                "id": member_id,
-                "email": user_data.get("email"),
-                "is_creator": member_id == board_data.get("creator_id")
-            })
-    
-    return JSONResponse(status_code=200, content=members)
+    return JSONResponse(status_code=200, content=members, headers=board_versions.headers(etag))
 
 @app.post("/boards/{board_id}/members")
-async def add_board_member(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        print("No token found in add_board_member")
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
+async def add_board_member(board_id: str, request: Request, access=Depends(board_creator("add members"))):
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-        if not user_token:
-            print("Invalid token in add_board_member")
-            return JSONResponse(status_code=401, content={"message": "Invalid token"})
-        
-        user_id = user_token["sub"]
+        user_id = access.user_id
         data = await request.json()
         member_email = data.get("email")
         
-        print(f"Adding member with email: {member_email} to board: {board_id}")
-        print(f"Creator ID: {user_id}")
-        
         if not member_email:
-            print("No email provided")
             return JSONResponse(status_code=400, content={"message": "Email is required"})
         
-        # Get board details from creator's collection
-        board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-        board_doc = board_ref.get()
-        
-        if not board_doc.exists:
-            print("Board not found")
-            return JSONResponse(status_code=404, content={"message": "Board not found"})
-        
-        board_data = board_doc.to_dict()
-        print(f"Current board members: {board_data.get('members', [])}")
-        
-        # Check if user is the creator
-        if user_id != board_data.get("creator_id"):
-            print(f"User {user_id} is not the creator {board_data.get('creator_id')}")
-            return JSONResponse(status_code=403, content={"message": "Only board creator can add members"})
+        # Get board details (the canonical board or the creator's copy). The new member's copy is built from it, so
+        # it has to be current rather than what the access check cached
+        board_ref, board_data = await access.board()
         
         # Get user ID from email
         users_ref = db.collection("users").where("email", "==", member_email).limit(1).stream()
-        user_docs = list(users_ref)
+        user_docs = [user async for user in users_ref]
         
         if not user_docs:
-            print(f"No user found with email: {member_email}")
+            log.info("no user with the member's email", extra={"board_id": board_id, "user_id": user_id})
             return JSONResponse(status_code=404, content={"message": "User not found. Make sure the user has signed up first."})
         
         member_id = user_docs[0].id
-        print(f"Found member ID: {member_id}")
         
         # Check if member is already in the board
         if member_id in board_data.get("members", []):
-            print("Member already in board")
             return JSONResponse(status_code=400, content={"message": "User is already a member of this board"})
         
         # Add member to board's members list
         if "members" not in board_data:
             board_data["members"] = [board_data["creator_id"]]
         board_data["members"].append(member_id)
-        print(f"Updated members list: {board_data['members']}")
         
-        # First update the board in the creator's collection
-        board_ref.set(board_data)
+        # Record the new member on the board we read, and give them their membership and/or the board document of their
+        # own copy so they can open it right away. Only the list is touched so that counters moved by concurrent task
+        # writes aren't overwritten. These few writes share one batch
+        batcher = storage.WriteBatcher(db)
+        batcher.update(board_ref, {"members": firestore.ArrayUnion([member_id]), **board_versions.bump()})
         
-        # Then create/update the board in the new member's collection
-        member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-        member_board_ref.set(board_data)
+        if storage.uses_canonical():
+            batcher.set(storage.membership_ref(db, member_id, board_id), {"joined_at": datetime.utcnow()})
         
-        # Copy all tasks to the new member's board
-        tasks_ref = board_ref.collection("tasks").stream()
-        for task in tasks_ref:
-            task_data = task.to_dict()
-            member_board_ref.collection("tasks").document(task.id).set(task_data)
+        if storage.uses_replicas():
+            await board_index.add_replica(db, board_id, member_id)
+            member_board_ref = storage.replica_board_ref(db, member_id, board_id)
+            batcher.set(member_board_ref, {**board_data, "version": board_versions.board_version(board_data) + 1})
         
-        # Update the board in all other members' collections to keep members list in sync
-        for existing_member_id in board_data["members"]:
-            if existing_member_id not in [user_id, member_id]:  # Skip creator and new member
-                existing_member_ref = db.collection("users").document(existing_member_id).collection("taskboards").document(board_id)
-                existing_member_ref.set(board_data)
+        failures = await batcher.commit()
+        board_access.cache.invalidate(board_id)
+        if failures:
+            return fanout_response(batcher, failures, 202, "Member added successfully", "Failed to add member")
         
-        print(f"Board updated in all collections with members: {board_data['members']}")
-        return JSONResponse(status_code=200, content={"message": "Member added successfully"})
+        # The other copies' member lists and the tasks of the new copy are brought up to date by a background job
+        job_id = await jobs.start(db, member_jobs.ADD_MEMBER, user_id, board_id=board_id, member_id=member_id, source=board_ref.path)
+        log.info("member added", extra={
+            "board_id": board_id, "user_id": user_id, "member_id": member_id, "members": len(board_data["members"]),
+            "failed": len(failures),
+        })
+        publish(batcher, failures, board_id, "member_added", {"member": user_directory.profile(member_id, user_docs[0].to_dict())})
+        return job_response(job_id, "Member added successfully")
         
+    except board_access.AccessDenied:
+        raise
     except Exception as e:
-        print(f"Error in add_board_member: {str(e)}")
+        log.exception("add_board_member failed", extra={"board_id": board_id})
         return JSONResponse(status_code=500, content={"message": f"Failed to add member: {str(e)}"})
 
 @app.post("/boards/{board_id}/tasks")
-async def create_task(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+async def create_task(board_id: str, request: Request, access=Depends(board_member)):
+    user_id = access.user_id
     data = await request.json()
     
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
-    
-    # Check for duplicate task names
-    tasks_ref = board_ref.collection("tasks").where("title", "==", data.get("title")).stream()
-    if any(task.exists for task in tasks_ref):
-        return JSONResponse(status_code=400, content={"message": "A task with this name already exists"})
-    
     # Create task data
     task_data = {
         "title": data.get("title"),
@@ -355,103 +441,134 @@ async def create_task(board_id: str, request: Request):
     }
     
     # Create task with the same ID in all member collections
-    task_id = board_ref.collection("tasks").document().id  # Generate a new task ID
+    task_id = access.board_ref.collection("tasks").document().id  # Generate a new task ID
+    
+    # Add task to the board and/or all member collections
+    # Each copy of the task lands in the same batch as the counter update on its board. Reserving the title goes first,
+    # so a duplicate name rejects the whole create before anything is written
+    board_update = {**board_stats.increments(None, task_data), **board_versions.bump()}
+    batcher = storage.WriteBatcher(db)
+    title_index.claim(batcher, db, board_id, task_data["title"], task_id)
+    task_search.index(batcher, db, board_id, task_id, task_data)
+    for member_board_ref in await access.write_refs():
+        batcher.keep_together(2)
+        batcher.set(member_board_ref.collection("tasks").document(task_id), task_data)
+        batcher.merge(member_board_ref, board_update)
     
-    # Add task to all member collections
-    for member_id in board_data.get("members", []):
-        member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-        member_board_ref.collection("tasks").document(task_id).set(task_data)
+    try:
+        failures = await batcher.commit()
+    except exceptions.AlreadyExists:
+        return JSONResponse(status_code=400, content={"message": "A task with this name already exists"})
     
-    return JSONResponse(status_code=201, content={"message": "Task created successfully"})
+    publish(batcher, failures, board_id, "task_created", {"task": task_query.serialize_task(task_id, task_data)})
+    return fanout_response(batcher, failures, 201, "Task created successfully", "Failed to create task", task_id=task_id)
 
 @app.get("/boards/{board_id}/tasks")
-async def get_board_tasks(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+async def get_board_tasks(board_id: str, request: Request, access=Depends(board_member)):
+    # Pagination, filters and field projection (see task_query.py)
+    try:
+        page = task_query.TaskPage(request.query_params)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    # The version on the board document says whether the client's copy is still current
+    board_ref, board_data = await access.board()
+    
+    # The board hasn't changed since the client fetched this page, so don't read the tasks at all
+    ndjson = fast_json.wants_ndjson(request)
+    etag = board_versions.board_etag(board_id, board_data, "tasks", request.url.query, *(["ndjson"] if ndjson else []))
+    if board_versions.matches(request, etag):
+        return board_versions.not_modified(etag)
+    
+    tasks_ref = board_ref.collection("tasks")
+    if ndjson:
+        # One task per line, encoded as it comes off the Firestore stream. The cursor for the next page isn't known
+        # until the page has been read, so it comes last as a {"next_cursor": ...} line instead of a header
+        async def rows():
+            async for task in page.stream(tasks_ref):
+                yield task
+            if page.next_cursor:
+                yield {"next_cursor": page.next_cursor}
+        
+        return fast_json.ndjson_response(rows(), headers=board_versions.headers(etag, {"Vary": "Accept"}))
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
+    # Only the requested page of tasks is read from the board's collection
+    tasks, next_cursor = await page.fetch(tasks_ref)
     
+    headers = {"Vary": "Accept", **({"X-Next-Cursor": next_cursor} if next_cursor else {})}
+    return fast_json.FastJSONResponse(status_code=200, content=tasks, headers=board_versions.headers(etag, headers))
+
+@app.get("/boards/{board_id}/events")
+async def board_event_stream(board_id: str, request: Request, access=Depends(board_member)):
+    user_id = access.user_id
+    
+    # Server-sent events with every change made to the board from now on (see board_events.py)
+    return StreamingResponse(
+        board_events.hub.stream(board_id, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/me/tasks")
+async def get_my_tasks(request: Request, user_token=Depends(current_user)):
+    # One page of the tasks assigned to the caller across all of their boards, soonest due first (see my_tasks.py)
     user_id = user_token["sub"]
+    try:
+        page = my_tasks.MyTasksPage(request.query_params, user_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
     
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
+    # The boards the caller can see, for their titles and to leave out boards they have just been removed from
+    boards = dict(await storage.list_boards(db, user_id))
+    tasks, next_cursor = await page.read(db, boards)
     
-    board_data = board_doc.to_dict()
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return fast_json.FastJSONResponse(status_code=200, content=tasks, headers=headers)
+
+@app.get("/me/due")
+async def get_my_due_tasks(request: Request, user_token=Depends(current_user)):
+    # The open tasks assigned to the caller that fall due in the next ?hours= (24 by default), soonest first, from one
+    # range query on the task index (see due_dates.py)
+    user_id = user_token["sub"]
+    try:
+        hours = due_dates.parse_hours(request.query_params.get("hours"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
     
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
+    due = await due_dates.due_soon(db, user_id, hours)
     
-    # Get tasks from board's collection
-    tasks_ref = board_ref.collection("tasks").stream()
+    # Leave out boards the caller has just been removed from and name the rest, like GET /me/tasks
+    boards = dict(await storage.list_boards(db, user_id)) if due else {}
+    tasks = [
+        {"board_id": board_id, "board_title": boards[board_id].get("title", ""), **task}
+        for board_id, task in due if board_id in boards
+    ]
+    return fast_json.FastJSONResponse(status_code=200, content=tasks)
+
+@app.get("/tasks/search")
+async def search_tasks(request: Request, user_token=Depends(current_user)):
+    # Tasks on any of the caller's boards whose title or description has words starting with every word of ?q=, best
+    # matches first (see task_search.py)
+    try:
+        limit = task_search.parse_limit(request.query_params.get("limit"))
+        task_search.query_words(request.query_params.get("q", ""))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
     
-    # Convert Firestore documents to dict and handle datetime serialization
-    tasks = []
-    for task in tasks_ref:
-        task_dict = task.to_dict()
-        # Convert datetime fields to ISO format strings
-        if "due_date" in task_dict:
-            task_dict["due_date"] = task_dict["due_date"].isoformat()
-        if "completed_at" in task_dict and task_dict["completed_at"]:
-            task_dict["completed_at"] = task_dict["completed_at"].isoformat()
-        if "created_at" in task_dict:
-            task_dict["created_at"] = task_dict["created_at"].isoformat()
-        tasks.append({"id": task.id, **task_dict})
+    boards = dict(await storage.list_boards(db, user_token["sub"]))
+    results, truncated = await task_search.search(db, boards, request.query_params.get("q", ""), limit)
     
-    return JSONResponse(status_code=200, content=tasks)
+    # Some matches on a very large board may not have been looked at
+    headers = {"X-Search-Truncated": "true"} if truncated else None
+    return fast_json.FastJSONResponse(status_code=200, content=results, headers=headers)
 
 @app.put("/tasks/{task_id}")
-async def update_task(task_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+async def update_task(task_id: str, request: Request, user_token=Depends(current_user)):
     data = await request.json()
     
-    # Get board ID from the request
+    # The board ID comes in the request body
     board_id = data.get("board_id")
-    if not board_id:
-        return JSONResponse(status_code=400, content={"message": "Board ID is required"})
-    
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
-    
-    # Get task from board's collection
-    task_ref = board_ref.collection("tasks").document(task_id)
-    task_doc = task_ref.get()
-    
-    if not task_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Task not found"})
-    
-    task_data = task_doc.to_dict()
-    
-    # Check for duplicate task names if title is being updated
-    if "title" in data and data["title"] != task_data["title"]:
-        tasks_ref = board_ref.collection("tasks").where("title", "==", data["title"]).stream()
-        if any(task.exists for task in tasks_ref):
-            return JSONResponse(status_code=400, content={"message": "A task with this name already exists"})
+    access = await authorize(board_id, user_token["sub"])
     
     # Update task data
     update_data = {}
@@ -470,202 +587,221 @@ async def update_task(task_id: str, request: Request):
     if "assigned_to" in data:
         update_data["assigned_to"] = data["assigned_to"]
     
-    # Update task in all member collections
-    for member_id in board_data.get("members", []):
+    task_ref = access.board_ref.collection("tasks").document(task_id)
+    entry_ref = task_search.entry_ref(db, board_id, task_id)
+    for _ in range(storage.MAX_ATTEMPTS):
+        # Get task from board's collection, and its search index entry which the counters are moved from
+        docs = {doc.reference.path: doc async for doc in db.get_all([task_ref, entry_ref])}
+        task_doc, entry_doc = docs[task_ref.path], docs[entry_ref.path]
+        
+        if not task_doc.exists:
+            return JSONResponse(status_code=404, content={"message": "Task not found"})
+        
+        task_data = task_doc.to_dict()
+        
+        # Update task in the board and/or all member collections. Merging the full task means a copy that is missing
+        # the task gets the whole thing, so we don't have to read every copy first to find out
+        full_task_data = task_data.copy()
+        full_task_data.update(update_data)
+        
+        # Completing/reopening and assigning/unassigning move the board counters along with the task, and any change
+        # moves the board version
+        counted = task_search.counted(entry_doc, task_data)
+        board_update = {**board_stats.increments(counted, full_task_data), **board_versions.bump()}
+        batcher = storage.WriteBatcher(db)
+        
+        # A rename claims the new title in the same batch as the task write
+        renamed = not title_index.same_title(task_data.get("title"), full_task_data.get("title"))
+        if renamed:
+            title_index.claim(batcher, db, board_id, full_task_data["title"], task_id)
+        
+        # The search index entry is rewritten whatever changed, it also shows the due date and completion. It only
+        # goes through if nobody has changed the task since we read the entry
+        task_search.index(batcher, db, board_id, task_id, full_task_data, entry_doc)
+        if renamed:
+            title_index.release(batcher, db, board_id, task_data.get("title"))
+        
+        for member_board_ref in await access.write_refs():
+            batcher.keep_together(2)
+            batcher.set(member_board_ref.collection("tasks").document(task_id), full_task_data, merge=True)
+            batcher.merge(member_board_ref, board_update)
+        
         try:
-            member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-            member_task_ref = member_board_ref.collection("tasks").document(task_id)
-            
-            # Check if task exists in member's collection
-            member_task_doc = member_task_ref.get()
-            if not member_task_doc.exists:
-                # If task doesn't exist, create it with full task data
-                full_task_data = task_data.copy()
-                full_task_data.update(update_data)
-                member_task_ref.set(full_task_data)
-            else:
-                # If task exists, just update it
-                member_task_ref.update(update_data)
-        except Exception as e:
-            print(f"Error updating task for member {member_id}: {str(e)}")
+            failures = await batcher.commit()
+        except exceptions.AlreadyExists:
+            return JSONResponse(status_code=400, content={"message": "A task with this name already exists"})
+        except exceptions.FailedPrecondition:
+            # Someone else changed the task first, start over from what it is now
             continue
+        
+        publish(batcher, failures, board_id, "task_updated", {"task": task_query.serialize_task(task_id, full_task_data)})
+        return fanout_response(batcher, failures, 200, "Task updated successfully", "Failed to update task")
     
-    return JSONResponse(status_code=200, content={"message": "Task updated successfully"})
+    return JSONResponse(status_code=409, content={"message": "The task is being changed by someone else, try again"})
 
 @app.delete("/tasks/{task_id}")
-async def delete_task(task_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
-    
-    # Get board ID from the request
+async def delete_task(task_id: str, request: Request, user_token=Depends(current_user)):
+    # The board ID comes in the query string
     board_id = request.query_params.get("board_id")
-    if not board_id:
-        return JSONResponse(status_code=400, content={"message": "Board ID is required"})
-    
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
+    access = await authorize(board_id, user_token["sub"])
+    
+    task_ref = access.board_ref.collection("tasks").document(task_id)
+    entry_ref = task_search.entry_ref(db, board_id, task_id)
+    for _ in range(storage.MAX_ATTEMPTS):
+        # Get the task, and its search index entry so we know which counters it was contributing to
+        docs = {doc.reference.path: doc async for doc in db.get_all([task_ref, entry_ref])}
+        task_doc, entry_doc = docs[task_ref.path], docs[entry_ref.path]
+        
+        if not task_doc.exists:
+            return JSONResponse(status_code=404, content={"message": "Task not found"})
+        
+        # Delete task from the board and/or all member collections, freeing up its title
+        task_data = task_doc.to_dict()
+        board_update = {**board_stats.increments(task_search.counted(entry_doc, task_data), None), **board_versions.bump()}
+        batcher = storage.WriteBatcher(db)
+        task_search.remove(batcher, db, board_id, task_id, entry_doc)
+        title_index.release(batcher, db, board_id, task_data.get("title"))
+        for member_board_ref in await access.write_refs():
+            batcher.keep_together(2)
+            batcher.delete(member_board_ref.collection("tasks").document(task_id))
+            batcher.merge(member_board_ref, board_update)
+        
+        try:
+            failures = await batcher.commit()
+        except exceptions.FailedPrecondition:
+            # Someone else changed or deleted the task first, start over from what it is now
+            continue
+        
+        publish(batcher, failures, board_id, "task_deleted", {"id": task_id})
+        return fanout_response(batcher, failures, 200, "Task deleted successfully", "Failed to delete task")
     
-    board_data = board_doc.to_dict()
+    return JSONResponse(status_code=409, content={"message": "The task is being changed by someone else, try again"})
+
+@app.post("/boards/{board_id}/tasks:batch")
+async def batch_tasks(board_id: str, request: Request, access=Depends(board_member)):
+    # Many creates, updates, completions and deletes for one token check, one access check and one fan-out
+    # (see task_batch.py)
+    data = await request.json()
+    try:
+        batch = task_batch.TaskBatch(data, access.user_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    # The tasks are read from the same copy of the board the writes are fanned out from
+    member_board_refs = await access.write_refs()
+    for _ in range(storage.MAX_ATTEMPTS):
+        await batch.validate(db, board_id, access.board_ref)
+        if not batch.changes:
+            status_code = 200 if batch.ok else 400
+            return JSONResponse(status_code=status_code, content={"message": "Nothing to change", "results": batch.results})
+        
+        batcher = storage.WriteBatcher(db)
+        batch.write(batcher, db, board_id, member_board_refs)
+        
+        try:
+            failures = await batcher.commit()
+        except exceptions.AlreadyExists:
+            # Someone took one of the titles since we checked, nothing was written
+            return JSONResponse(status_code=400, content={"message": "A task with this name already exists"})
+        except exceptions.FailedPrecondition:
+            # Someone changed one of the tasks since we read it, nothing was written. Start over from what they are now
+            batch = task_batch.TaskBatch(data, access.user_id)
+            continue
+        
+        publish(batcher, failures, board_id, "tasks_changed", batch.event())
+        return fanout_response(
+            batcher, failures, 200 if batch.ok else 207, "Tasks updated successfully", "Failed to update tasks",
+            results=batch.results,
+        )
     
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
+    return JSONResponse(status_code=409, content={"message": "The tasks are being changed by someone else, try again"})
+
+@app.get("/boards/{board_id}/overdue")
+async def get_overdue_tasks(board_id: str, access=Depends(board_member)):
+    # Open tasks on the board that are past their due date, longest overdue first, from one range query on the task index
+    return fast_json.FastJSONResponse(status_code=200, content=await due_dates.overdue(db, board_id))
+
+@app.get("/boards/{board_id}/snapshot")
+async def get_board_snapshot(board_id: str, request: Request, access=Depends(board_member)):
+    # The board, its members, stats and first page of tasks in one response (see board_snapshot.py)
+    board_ref, board_data = await access.board()
     
-    # Delete task from all member collections
-    for member_id in board_data.get("members", []):
-        member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-        member_task_ref = member_board_ref.collection("tasks").document(task_id)
-        member_task_ref.delete()
+    etag = board_versions.board_etag(board_id, board_data, "snapshot")
+    if board_versions.matches(request, etag):
+        return board_versions.not_modified(etag)
     
-    return JSONResponse(status_code=200, content={"message": "Task deleted successfully"})
+    snapshot = await board_snapshot.read(db, board_id, board_ref, board_data)
+    return fast_json.FastJSONResponse(status_code=200, content=snapshot, headers=board_versions.headers(etag))
 
 @app.get("/boards/{board_id}/stats")
-async def get_board_stats(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
-    
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
+async def get_board_stats(board_id: str, request: Request, access=Depends(board_member)):
+    # The counters and version live on the board document
+    board_ref, board_data = await access.board()
     
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
+    etag = board_versions.board_etag(board_id, board_data, "stats")
+    if board_versions.matches(request, etag):
+        return board_versions.not_modified(etag)
     
-    board_data = board_doc.to_dict()
+    # The counters live on the board document we just read, see board_snapshot.stats for boards that don't have them yet
+    stats = await board_snapshot.stats(board_ref, board_data)
     
-    # Check if user has access to the board
-    if user_id not in board_data.get("members", []):
-        return JSONResponse(status_code=403, content={"message": "Access denied"})
-    
-    # Get tasks from board's collection
-    tasks_ref = board_ref.collection("tasks").stream()
-    tasks = [task.to_dict() for task in tasks_ref]
-    
-    stats = {
-        "total_tasks": len(tasks),
-        "active_tasks": len([t for t in tasks if not t.get("completed", False)]),
-        "completed_tasks": len([t for t in tasks if t.get("completed", False)]),
-        "unassigned_tasks": len([t for t in tasks if not t.get("assigned_to")])
-    }
-    
-    return JSONResponse(status_code=200, content=stats)
+    return JSONResponse(status_code=200, content=stats, headers=board_versions.headers(etag))
 
 @app.put("/boards/{board_id}")
-async def update_board(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+async def update_board(board_id: str, request: Request, access=Depends(board_creator("update the board"))):
     data = await request.json()
     
-    # Get board details
-    board_ref = db.collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user is the creator
-    if user_id != board_data.get("creator_id"):
-        return JSONResponse(status_code=403, content={"message": "Only board creator can update the board"})
-    
     # Update board
     update_data = {}
     if "title" in data:
         update_data["title"] = data["title"]
     
-    board_ref.update(update_data)
+    batcher = storage.WriteBatcher(db)
+    if update_data:
+        for member_board_ref in await access.write_refs():
+            batcher.merge(member_board_ref, {**update_data, **board_versions.bump()})
     
-    return JSONResponse(status_code=200, content={"message": "Board updated successfully"})
+    failures = await batcher.commit()
+    if update_data:
+        publish(batcher, failures, board_id, "board_updated", update_data)
+    return fanout_response(batcher, failures, 200, "Board updated successfully", "Failed to update board")
 
 @app.delete("/boards/{board_id}")
-async def delete_board(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+async def delete_board(board_id: str, request: Request, access=Depends(board_creator("delete the board"))):
+    user_id = access.user_id
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
-    
-    # Get board details
-    board_ref = db.collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user is the creator
-    if user_id != board_data.get("creator_id"):
-        return JSONResponse(status_code=403, content={"message": "Only board creator can delete the board"})
+    # The member check below has to see the current board, not the cached access
+    board_ref, board_data = await access.board()
     
     # Check if there are any tasks
-    tasks_ref = db.collection("tasks").where("board_id", "==", board_id).stream()
-    if any(task.exists for task in tasks_ref):
+    tasks_ref = board_ref.collection("tasks").limit(1).stream()
+    if any([task.exists async for task in tasks_ref]):
         return JSONResponse(status_code=400, content={"message": "Cannot delete board with existing tasks"})
     
     # Check if there are any non-owning members
     if len(board_data.get("members", [])) > 1:
         return JSONResponse(status_code=400, content={"message": "Cannot delete board with existing members"})
     
-    # Delete board
-    board_ref.delete()
+    # Delete board everywhere it is stored
+    batcher = storage.WriteBatcher(db)
+    for member_board_ref in storage.write_refs(db, board_id, board_ref, board_data.get("members", [])):
+        batcher.delete(member_board_ref)
     
-    return JSONResponse(status_code=200, content={"message": "Board deleted successfully"})
-
-@app.delete("/boards/{board_id}/members/{member_id}")
-async def remove_board_member(board_id: str, member_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+    if storage.uses_canonical():
+        batcher.delete(storage.membership_ref(db, user_id, board_id))
     
-    # Get board details from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
+    failures = await batcher.commit()
+    board_access.cache.invalidate(board_id)
+    if storage.uses_replicas() and not failures:
+        await board_index.remove_board(db, board_id)
+    publish(batcher, failures, board_id, "board_deleted", {})
     
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user is the creator
-    if user_id != board_data.get("creator_id"):
-        return JSONResponse(status_code=403, content={"message": "Only board creator can remove members"})
+    return fanout_response(batcher, failures, 200, "Board deleted successfully", "Failed to delete board")
+
+@app.delete("/boards/{board_id}/members/{member_id}")
+async def remove_board_member(board_id: str, member_id: str, request: Request, access=Depends(board_creator("remove members"))):
+    # The remaining members are worked out from the current board, not the cached access
+    board_ref, board_data = await access.board()
     
     # Check if member exists
     if member_id not in board_data.get("members", []):
@@ -675,24 +811,27 @@ async def remove_board_member(board_id: str, member_id: str, request: Request):
     if member_id == board_data.get("creator_id"):
         return JSONResponse(status_code=400, content={"message": "Cannot remove the board creator"})
     
-    # Remove member from board in creator's collection
-    board_ref.update({
-        "members": firestore.ArrayRemove([member_id])
-    })
-    
-    # Mark member's tasks as unassigned in creator's collection
-    tasks_ref = board_ref.collection("tasks").where("assigned_to", "==", member_id).stream()
-    for task in tasks_ref:
-        task.reference.update({
-            "assigned_to": None,
-            "previously_assigned": member_id  # Add this field to track previously assigned user
-        })
-    
-    # Remove board from member's collection
-    member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-    member_board_ref.delete()
-    
-    return JSONResponse(status_code=200, content={"message": "Member removed successfully"})
+    # Take the member off the board we read and remove their membership and/or the board document of their own copy,
+    # so they lose access right away. These few writes share one batch
+    batcher = storage.WriteBatcher(db)
+    batcher.update(board_ref, {"members": firestore.ArrayRemove([member_id]), **board_versions.bump()})
+    if storage.uses_canonical():
+        batcher.delete(storage.membership_ref(db, member_id, board_id))
+    if storage.uses_replicas():
+        batcher.delete(storage.replica_board_ref(db, member_id, board_id))
+    
+    failures = await batcher.commit()
+    board_access.cache.invalidate(board_id)
+    if failures:
+        return fanout_response(batcher, failures, 202, "Member removed successfully", "Failed to remove member")
+    if storage.uses_replicas():
+        await board_index.remove_replica(db, board_id, member_id)
+    
+    # The other copies, unassigning the member's tasks (previously_assigned keeps who had them) and clearing out their
+    # old copy's tasks happen in a background job
+    job_id = await jobs.start(db, member_jobs.REMOVE_MEMBER, access.user_id, board_id=board_id, member_id=member_id, source=board_ref.path)
+    publish(batcher, failures, board_id, "member_removed", {"id": member_id})
+    return job_response(job_id, "Member removed successfully")
 
 @app.post("/users")
 async def create_user(request: Request):
@@ -700,7 +839,7 @@ async def create_user(request: Request):
     if not id_token:
         return JSONResponse(status_code=401, content={"message": "Unauthorized"})
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    user_token = await token_verifier.verify_async(id_token)
     if not user_token:
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
     
@@ -709,17 +848,21 @@ async def create_user(request: Request):
     
     # Check if user document already exists
     user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
+    user_doc = await user_ref.get()
     
     if user_doc.exists:
         return JSONResponse(status_code=200, content={"message": "User document already exists"})
     
     # Create user document
-    user_ref.set({
+    await user_ref.set({
         "email": user_token["email"],  # Use email from verified token
+        "email_lower": user_directory.normalize_email(user_token["email"]),  # For prefix search in the directory
         "created_at": datetime.utcnow()
     })
     
+    # Cached directory searches and profiles could be missing the new user
+    user_directory.user_created(user_id)
+    
     return JSONResponse(status_code=201, content={"message": "User created successfully"})
 
 @app.post("/users/check")
@@ -732,50 +875,26 @@ async def check_user_exists(request: Request):
     
     # Query Firestore for user with this email
     users_ref = db.collection("users").where("email", "==", email).limit(1).stream()
-    user_exists = any(user.exists for user in users_ref)
+    user_exists = any([user.exists async for user in users_ref])
     
     return JSONResponse(status_code=200, content={"exists": user_exists})
 
 @app.put("/boards/{board_id}/rename")
-async def rename_board(board_id: str, request: Request):
-    id_token = request.cookies.get("token")
-    if not id_token:
-        return JSONResponse(status_code=401, content={"message": "Unauthorized"})
-    
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
-    if not user_token:
-        return JSONResponse(status_code=401, content={"message": "Invalid token"})
-    
-    user_id = user_token["sub"]
+async def rename_board(board_id: str, request: Request, access=Depends(board_creator("rename the board"))):
     data = await request.json()
     new_title = data.get("title")
     
     if not new_title:
         return JSONResponse(status_code=400, content={"message": "Title is required"})
     
-    # Get board from user's collection
-    board_ref = db.collection("users").document(user_id).collection("taskboards").document(board_id)
-    board_doc = board_ref.get()
-    
-    if not board_doc.exists:
-        return JSONResponse(status_code=404, content={"message": "Board not found"})
-    
-    board_data = board_doc.to_dict()
-    
-    # Check if user is the creator
-    if user_id != board_data.get("creator_id"):
-        return JSONResponse(status_code=403, content={"message": "Only board creator can rename the board"})
-    
-    # Update board title
-    board_ref.update({"title": new_title})
-    
-    # Update title in all members' collections
-    for member_id in board_data.get("members", []):
-        if member_id != user_id:  # Skip creator as we already updated their copy
-            member_board_ref = db.collection("users").document(member_id).collection("taskboards").document(board_id)
-            member_board_ref.update({"title": new_title})
+    # Update board title in the board and/or all members' collections
+    batcher = storage.WriteBatcher(db)
+    for member_board_ref in await access.write_refs():
+        batcher.merge(member_board_ref, {"title": new_title, **board_versions.bump()})
     
-    return JSONResponse(status_code=200, content={"message": "Board renamed successfully"})
+    failures = await batcher.commit()
+    publish(batcher, failures, board_id, "board_updated", {"title": new_title})
+    return fanout_response(batcher, failures, 200, "Board renamed successfully", "Failed to rename board")
 
 @app.get("/users")
 async def get_all_users(request: Request):
@@ -783,18 +902,43 @@ async def get_all_users(request: Request):
     if not id_token:
         return JSONResponse(status_code=401, content={"message": "Unauthorized"})
     
-    user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    user_token = await token_verifier.verify_async(id_token)
     if not user_token:
         return JSONResponse(status_code=401, content={"message": "Invalid token"})
     
-    # Get all users from Firestore
-    users_ref = db.collection("users").stream()
-    users = []
-    for user in users_ref:
-        user_data = user.to_dict()
-        users.append({
-            "id": user.id,
-            "email": user_data.get("email")
-        })
+    # One page of users whose email starts with ?prefix=, the next page is at ?cursor=<X-Next-Cursor>
+    try:
+        limit = user_directory.parse_limit(request.query_params.get("limit"))
+        users, next_cursor = await user_directory.search(
+            db, request.query_params.get("prefix", ""), limit, request.query_params.get("cursor")
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return JSONResponse(status_code=200, content=users, headers=headers)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_token=Depends(current_user)):
+    # Status and progress of a background job, for the user who started it
+    job = await jobs.load(db, job_id)
+    if job is None or job.data.get("created_by") != user_token["sub"]:
+        return JSONResponse(status_code=404, content={"message": "Job not found"})
+    
+    return fast_json.FastJSONResponse(status_code=200, content=jobs.serialize_job(job), headers={"Cache-Control": "no-store"})
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    # Prometheus text format for this worker, see metrics.py. Only for the scraper: METRICS_TOKEN, or a local client
+    # with METRICS_ALLOW_LOCAL=1
+    if not metrics.allowed(request):
+        return JSONResponse(status_code=403, content={"message": "Access denied"})
     
-    return JSONResponse(status_code=200, content=users)
\ No newline at end of file
+    # Hit rates come from the in-process caches' own counters
+    return metrics.response({
+        "tokens": token_verifier.tokens,
+        "certs": token_verifier.certs,
+        "board_access": board_access.cache,
+        "user_search": user_directory.search_cache,
+        "user_profiles": user_directory.profile_cache,
+    }, board_events.hub.stats()["subscribers"])
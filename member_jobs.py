@@ -0,0 +1,207 @@
+# the slow half of adding and removing board members, run as background jobs (see jobs.py) so the request only has to
+# record the membership change:
+#
+#   add_member     POST /boards/{id}/members adds the member to the board it read (the canonical board or the creator's
+#                  copy) and writes their membership and/or the board document of their own copy, so they can open the
+#                  board straight away. the job adds them to every other copy's member list, then copies the tasks into
+#                  their copy
+#   remove_member  DELETE /boards/{id}/members/{member_id} takes the member off the board it read and deletes their
+#                  membership and their copy's board document, so they lose access straight away. the job takes them off
+#                  every other copy, unassigns their tasks in every copy and deletes the tasks left in their old copy
+#
+# writes go out in batches of up to storage.BATCH_LIMIT. each step works from what is in firestore when it runs, so it
+# can be repeated: unassigning re-queries the member's tasks and only counts the ones it changes, copying overwrites
+# with the same data. a job that didn't finish because its worker stopped can be run again:
+#
+#   python member_jobs.py list [--status running]
+#   python member_jobs.py rerun JOB_ID
+import argparse
+import asyncio
+
+from google.cloud import firestore
+
+import board_events
+import board_versions
+import jobs
+import storage
+import task_query
+import task_search
+
+ADD_MEMBER = "add_member"
+REMOVE_MEMBER = "remove_member"
+
+
+async def _current_board(db, source):
+    board_doc = await db.document(source).get()
+    if not board_doc.exists:
+        # the board was deleted since the request, nothing is left to bring up to date
+        return None, None
+    return board_doc.reference, board_doc.to_dict()
+
+
+async def _update_other_copies(job, db, board_id, board_ref, board_data, skip, update):
+    # applies update to every copy of the board apart from the one the request already wrote and those in skip
+    refs = [
+        ref for ref in storage.write_refs(db, board_id, board_ref, board_data.get("members", []))
+        if ref.path != board_ref.path and ref.path not in skip
+    ]
+    await job.step("members", len(refs))
+
+    async def build():
+        if not refs:
+            return None
+        batcher = storage.WriteBatcher(db)
+        for ref in refs:
+            batcher.merge(ref, {**update, **board_versions.bump()})
+        return batcher
+
+    await job.commit(build)
+    await job.advance(len(refs))
+
+
+@jobs.register(ADD_MEMBER)
+async def add_member(job, db, board_id, member_id, source):
+    board_ref, board_data = await _current_board(db, source)
+    if board_data is None:
+        return
+    member_board_ref = storage.replica_board_ref(db, member_id, board_id)
+    await _update_other_copies(job, db, board_id, board_ref, board_data, {member_board_ref.path}, {
+        "members": firestore.ArrayUnion([member_id]),
+    })
+    if not storage.uses_replicas():
+        return
+
+    # the member's copy of the board document was written by the request, the tasks follow a batch at a time. each
+    # batch moves the copy's version along with it, so a member who loads the board part way through isn't told it is
+    # unchanged (see board_versions.py) once the rest of the tasks are in
+    await job.step("tasks", board_data.get("stats", {}).get("total_tasks"))
+    page = []
+
+    async def build():
+        if not page:
+            return None
+        batcher = storage.WriteBatcher(db)
+        for task_id, task_data in page:
+            batcher.set(member_board_ref.collection("tasks").document(task_id), task_data)
+        batcher.merge(member_board_ref, board_versions.bump())
+        return batcher
+
+    async for task in board_ref.collection("tasks").stream():
+        page.append((task.id, task.to_dict()))
+        if len(page) == storage.BATCH_LIMIT - 1:
+            await job.commit(build)
+            await job.advance(len(page))
+            page = []
+    await job.commit(build)
+    await job.advance(len(page))
+
+
+@jobs.register(REMOVE_MEMBER)
+async def remove_member(job, db, board_id, member_id, source):
+    board_ref, board_data = await _current_board(db, source)
+    if board_data is None:
+        return
+    member_board_ref = storage.replica_board_ref(db, member_id, board_id)
+    await _update_other_copies(job, db, board_id, board_ref, board_data, {member_board_ref.path}, {
+        "members": firestore.ArrayRemove([member_id]),
+    })
+
+    # every copy is unassigned from its own tasks, so a copy that had drifted still ends up with none of theirs
+    copies = storage.write_refs(db, board_id, board_ref, board_data.get("members", []))
+    await job.step("unassign")
+    for copy_ref in copies:
+        while True:
+            unassigned = []
+
+            async def build():
+                # at most one batch: the tasks, their index entries and the board's counter, committed together
+                unassigned.clear()
+                tasks = copy_ref.collection("tasks").where("assigned_to", "==", member_id).limit((storage.BATCH_LIMIT - 1) // 2)
+                async for task in tasks.stream():
+                    unassigned.append((task.id, {**task.to_dict(), "assigned_to": None, "previously_assigned": member_id}))
+                if not unassigned:
+                    return None
+                batcher = storage.WriteBatcher(db)
+                for task_id, task_data in unassigned:
+                    batcher.set(copy_ref.collection("tasks").document(task_id), task_data, merge=True)
+                    if copy_ref.path == board_ref.path:
+                        # the index entries follow the copy the request read, like the events below
+                        task_search.index(batcher, db, board_id, task_id, task_data)
+                batcher.merge(copy_ref, {
+                    "stats.unassigned_tasks": firestore.Increment(len(unassigned)), **board_versions.bump(),
+                })
+                return batcher
+
+            if await job.commit(build) is None:
+                break
+            if copy_ref.path == board_ref.path:
+                # watchers hear about each task once, from the copy the request read
+                await job.advance(len(unassigned))
+                board_events.hub.publish(board_id, "tasks_changed", {
+                    "tasks": [task_query.serialize_task(task_id, task_data) for task_id, task_data in unassigned],
+                    "deleted": [],
+                })
+
+    if not storage.uses_replicas():
+        return
+
+    # the request deleted the board document of the member's copy, its tasks go now. this also catches tasks that other
+    # members' writes put there before their copies stopped listing the member
+    await job.step("replica")
+    while True:
+        deleted = []
+
+        async def build():
+            deleted.clear()
+            async for task in member_board_ref.collection("tasks").limit(storage.BATCH_LIMIT).stream():
+                deleted.append(task.reference)
+            if not deleted:
+                return None
+            batcher = storage.WriteBatcher(db)
+            for task_ref in deleted:
+                batcher.delete(task_ref)
+            return batcher
+
+        if await job.commit(build) is None:
+            break
+        await job.advance(len(deleted))
+
+
+async def list_jobs(db, status=None):
+    query = db.collection(jobs.JOBS_COLLECTION)
+    if status:
+        query = query.where("status", "==", status)
+    return [jobs.Job(db, job_doc.id, job_doc.to_dict()) async for job_doc in query.stream()]
+
+
+async def rerun(db, job_id):
+    job = await jobs.load(db, job_id)
+    if job is None:
+        raise SystemExit(f"No job {job_id}")
+    job.data.update(status=jobs.QUEUED, error=None, retries=0, finished_at=None)
+    await jobs.schedule(job)
+    return await jobs.load(db, job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and rerun member onboarding and offboarding jobs")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    list_parser = subcommands.add_parser("list", help="list jobs")
+    list_parser.add_argument("--status", choices=[jobs.QUEUED, jobs.RUNNING, jobs.SUCCEEDED, jobs.FAILED])
+    rerun_parser = subcommands.add_parser("rerun", help="run a job again from the start and wait for it")
+    rerun_parser.add_argument("job_id")
+    args = parser.parse_args()
+
+    db = storage.client()
+    if args.command == "list":
+        for job in asyncio.run(list_jobs(db, args.status)):
+            progress = job.data["progress"]
+            print(f"{job.id}  {job.data['kind']:<14} {job.data['status']:<10} {job.data['params'].get('board_id')}  "
+                  f"{progress['step']} {progress['done']}/{progress['total'] if progress['total'] is not None else '?'}")
+    else:
+        job = asyncio.run(rerun(db, args.job_id))
+        print(f"{job.id}  {job.data['status']}  {job.data['error'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,600 @@
+# an in-process stand-in for google.cloud.firestore.AsyncClient, covering the parts of the API the app uses. every
+# module that reads or writes data (storage.py, task_query.py, user_directory.py, title_index.py, ...) goes through the
+# client handed to it, so this is a complete second backend for the app:
+#
+#   DATASTORE=memory uvicorn main:app
+#
+# see storage.client(). the data lives in the worker process and is gone when it exits, so this is for running the API
+# locally, tests and profiling, and only makes sense with a single worker.
+#
+# documents are kept in one dict per collection, so everything under a board is found by its path. equality filters on
+# INDEXED_FIELDS (assignee, title, email) and array-contains filters on ARRAY_INDEXED_FIELDS (the search index's terms)
+# are answered from an index by collection name instead of scanning, which covers collection group queries too.
+#
+# every document has an update_time that moves on each write, and update() and delete() in a batch take the
+# option=db.write_option(last_update_time=...) precondition (see storage.WriteBatcher.update_unchanged).
+#
+# every RPC can be given a simulated latency. blocking=True sleeps with time.sleep instead of asyncio.sleep, which is
+# what the old synchronous firestore.Client did to the event loop. reads, writes and queries are counted so benchmarks
+# can report firestore operations per request, and comparing latency=0 with real firestore separates the app's own
+# overhead from the datastore's. the counts also go to the observer, which is how they reach GET /metrics.
+import asyncio
+import copy
+import random
+import string
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+_ID_CHARS = string.ascii_letters + string.digits
+
+# fields with an equality index: {collection name: {value: {(collection_path, doc_id)}}}
+INDEXED_FIELDS = ("assigned_to", "title", "email", "email_lower")
+
+# array fields with an index of their elements, same layout
+ARRAY_INDEXED_FIELDS = ("terms",)
+
+
+def _new_id():
+    return "".join(random.choice(_ID_CHARS) for _ in range(20))
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _has_field(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False
+        value = value[part]
+    return True
+
+
+def _comparable(value):
+    # firestore keeps timestamps in UTC, so a naive datetime is the same instant as an aware one in UTC and they can be
+    # compared and ordered together
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _apply_value(current, value):
+    if value is transforms.DELETE_FIELD:
+        return transforms.DELETE_FIELD
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(item for item in value.values if item not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in (current if isinstance(current, list) else []) if item not in value.values]
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    return copy.deepcopy(value)
+
+
+def _set_field(data, field_path, value):
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    resolved = _apply_value(target.get(parts[-1]), value)
+    if resolved is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = resolved
+
+
+def _merge(data, updates):
+    # keys are field names rather than paths here, and maps are merged into so transforms inside them are applied
+    for key, value in updates.items():
+        if isinstance(value, dict):
+            if not isinstance(data.get(key), dict):
+                data[key] = {}
+            _merge(data[key], value)
+        else:
+            resolved = _apply_value(data.get(key), value)
+            if resolved is transforms.DELETE_FIELD:
+                data.pop(key, None)
+            else:
+                data[key] = resolved
+
+
+class MemorySnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_field(self._data or {}, field_path)
+
+
+class MemoryDocumentReference:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    @property
+    def parent(self):
+        return MemoryCollectionReference(self._client, self._collection_path)
+
+    def collection(self, name):
+        return MemoryCollectionReference(self._client, f"{self.path}/{name}")
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def _snapshot(self):
+        return MemorySnapshot(self, self._client._load(self._collection_path, self.id), self._client._update_times.get(self.path))
+
+    async def get(self, field_paths=None, transaction=None):
+        await self._client._rpc()
+        self._client._count("reads")
+        return self._snapshot()
+
+    async def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        await batch.commit()
+
+    async def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        await batch.commit()
+
+    async def update(self, field_updates, option=None):
+        batch = self._client.batch()
+        batch.update(self, field_updates, option=option)
+        await batch.commit()
+
+    async def delete(self, option=None):
+        batch = self._client.batch()
+        batch.delete(self, option=option)
+        await batch.commit()
+
+
+class MemoryQuery:
+    def __init__(self, client, collection_path=None, group=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._group = group
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._offset = 0
+        self._start = None
+        self._end = None
+        self._projection = None
+
+    def _copy(self, **changes):
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        query._filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        query = self._copy()
+        query._orders.append((field_path, direction == "DESCENDING"))
+        return query
+
+    def limit(self, count):
+        return self._copy(_limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(_offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(_projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(_start=(document_fields_or_snapshot, False))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(_start=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot):
+        return self._copy(_end=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot):
+        return self._copy(_end=(document_fields_or_snapshot, True))
+
+    def _candidates(self):
+        indexed = self._client._indexed(self._group or self._collection_path.rsplit("/", 1)[-1], self._filters)
+        if indexed is not None:
+            for collection_path, doc_id in list(indexed):
+                if self._group is None and collection_path != self._collection_path:
+                    continue
+                yield collection_path, doc_id, self._client._load(collection_path, doc_id)
+            return
+        if self._group is None:
+            for doc_id, data in self._client._collection(self._collection_path).items():
+                yield self._collection_path, doc_id, data
+            return
+        for collection_path, docs in self._client._collections.items():
+            if collection_path.rsplit("/", 1)[-1] == self._group:
+                for doc_id, data in docs.items():
+                    yield collection_path, doc_id, data
+
+    def _matches(self, data):
+        for field_path, op, value in self._filters:
+            if not _has_field(data, field_path):
+                return False
+            current = _comparable(_get_field(data, field_path))
+            value = _comparable(value)
+            try:
+                if op == "==" and not current == value:
+                    return False
+                if op == "!=" and not current != value:
+                    return False
+                if op == "<" and not current < value:
+                    return False
+                if op == "<=" and not current <= value:
+                    return False
+                if op == ">" and not current > value:
+                    return False
+                if op == ">=" and not current >= value:
+                    return False
+                if op == "in" and current not in value:
+                    return False
+                if op == "not-in" and current in value:
+                    return False
+                if op == "array_contains" and value not in (current or []):
+                    return False
+                if op == "array_contains_any" and not set(value) & set(current or []):
+                    return False
+            except TypeError:
+                # firestore only compares values of the same type
+                return False
+        return True
+
+    def _sort_key(self, collection_path, doc_id, data):
+        key = []
+        for field_path, _ in self._orders:
+            if field_path == "__name__":
+                value = f"{collection_path}/{doc_id}"
+            else:
+                value = _comparable(_get_field(data, field_path))
+            key.append((value is not None, value))
+        key.append((True, f"{collection_path}/{doc_id}"))
+        return key
+
+    def _cursor_values(self, cursor):
+        if isinstance(cursor, MemorySnapshot):
+            cursor = {**(cursor._data or {}), "__name__": cursor.reference}
+            values = [self._cursor_value(cursor, field_path) for field_path, _ in self._orders]
+            return values + [cursor["__name__"].path]
+        if isinstance(cursor, dict):
+            return [self._cursor_value(cursor, field_path) for field_path, _ in self._orders]
+        return list(cursor)
+
+    def _cursor_value(self, cursor, field_path):
+        if field_path != "__name__":
+            return _get_field(cursor, field_path)
+        # like the real client, a plain id is a document in the queried collection
+        name = cursor.get("__name__")
+        if isinstance(name, str):
+            return f"{self._collection_path}/{name}"
+        return name.path
+
+    def _compare(self, row_key, cursor_values):
+        for index, cursor_value in enumerate(cursor_values):
+            present, value = row_key[index]
+            cursor_value = _comparable(cursor_value)
+            if index < len(self._orders):
+                descending = self._orders[index][1]
+            else:
+                descending = False
+            if value == cursor_value:
+                continue
+            try:
+                less = (value is not None, value) < (cursor_value is not None, cursor_value)
+            except TypeError:
+                less = str(value) < str(cursor_value)
+            return (1 if less else -1) if descending else (-1 if less else 1)
+        return 0
+
+    def _run(self):
+        rows = [row for row in self._candidates() if self._matches(row[2])]
+        for field_path, _ in self._orders:
+            # firestore leaves out documents that don't have the ordered field
+            if field_path != "__name__":
+                rows = [row for row in rows if _has_field(row[2], field_path)]
+
+        # document path is the final tie breaker, then stable sorts from the last order_by to the first
+        keyed = [(self._sort_key(*row), row) for row in rows]
+        keyed.sort(key=lambda item: item[0][-1])
+        for index in reversed(range(len(self._orders))):
+            descending = self._orders[index][1]
+            keyed.sort(key=lambda item: item[0][index], reverse=descending)
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            values = self._cursor_values(cursor)
+            keyed = [item for item in keyed if self._compare(item[0], values) > (-1 if inclusive else 0)]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            values = self._cursor_values(cursor)
+            keyed = [item for item in keyed if self._compare(item[0], values) < (1 if inclusive else 0)]
+
+        keyed = keyed[self._offset:]
+        if self._limit is not None:
+            keyed = keyed[:self._limit]
+
+        for _, (collection_path, doc_id, data) in keyed:
+            if self._projection is not None:
+                data = {field: _get_field(data, field) for field in self._projection if _has_field(data, field)}
+            reference = MemoryDocumentReference(self._client, collection_path, doc_id)
+            yield MemorySnapshot(reference, data, self._client._update_times.get(reference.path))
+
+    async def stream(self, transaction=None):
+        # like the real client, documents are handed over one at a time instead of after the whole result has arrived
+        await self._client._rpc()
+        self._client._count("queries")
+        returned = 0
+        for snapshot in self._run():
+            returned += 1
+            self._client._count("reads")
+            yield snapshot
+        # firestore bills a query that returns nothing as one read
+        if not returned:
+            self._client._count("reads")
+
+    async def get(self, transaction=None):
+        return [snapshot async for snapshot in self.stream()]
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, path):
+        super().__init__(client, collection_path=path)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        if "/" not in self.path:
+            return None
+        parent_path, doc_id = self.path.rsplit("/", 1)[0].rsplit("/", 1)
+        return MemoryDocumentReference(self._client, parent_path, doc_id)
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, self.path, document_id or _new_id())
+
+    async def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        await ref.set(document_data)
+        return None, ref
+
+    async def list_documents(self):
+        await self._client._rpc()
+        for doc_id in list(self._client._collection(self.path)):
+            yield self.document(doc_id)
+
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, document_data, merge=False):
+        self._ops.append(("set", reference, document_data, merge, None))
+
+    def create(self, reference, document_data):
+        self._ops.append(("create", reference, document_data, False, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._ops.append(("update", reference, field_updates, False, option))
+
+    def delete(self, reference, option=None):
+        self._ops.append(("delete", reference, None, False, option))
+
+    def __len__(self):
+        return len(self._ops)
+
+    async def commit(self):
+        await self._client._rpc()
+        if len(self._ops) > 500:
+            raise exceptions.InvalidArgument("maximum 500 writes allowed per request")
+
+        # check every precondition before applying anything, a batch is all or nothing
+        pending = {}
+        for op, reference, _, _, option in self._ops:
+            exists = pending.get(reference.path, self._client._load(reference._collection_path, reference.id) is not None)
+            if op == "create" and exists:
+                raise exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+            if op == "update" and not exists:
+                raise exceptions.NotFound(f"No document to update: {reference.path}")
+            if option is not None and self._client._update_times.get(reference.path) != option["last_update_time"]:
+                raise exceptions.FailedPrecondition(f"Document changed since it was read: {reference.path}")
+            pending[reference.path] = op != "delete"
+
+        for op, reference, data, merge, _ in self._ops:
+            self._client._apply(op, reference, data, merge)
+        self._client._count("writes", len(self._ops))
+        self._client._count("commits")
+        self._ops = []
+        return []
+
+
+class MemoryFirestore:
+    def __init__(self, latency=0.0, blocking=False, observer=None):
+        self.latency = latency
+        self.blocking = blocking
+        # called with (operation, count) for every read, write, query and commit, see metrics.record_operation
+        self.observer = observer
+        self._collections = {}
+        # {document path: update_time}
+        self._update_times = {}
+        self._clock = datetime.now(timezone.utc)
+        self._indexes = {field: {} for field in INDEXED_FIELDS + ARRAY_INDEXED_FIELDS}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.commits = 0
+        self.rpcs = 0
+
+    def counters(self):
+        return {"reads": self.reads, "writes": self.writes, "queries": self.queries, "commits": self.commits, "rpcs": self.rpcs}
+
+    def _count(self, operation, count=1):
+        setattr(self, operation, getattr(self, operation) + count)
+        if self.observer is not None:
+            self.observer(operation, count)
+
+    async def _rpc(self):
+        self.rpcs += 1
+        if not self.latency:
+            return
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+    def _collection(self, path):
+        return self._collections.get(path, {})
+
+    def _load(self, collection_path, doc_id):
+        return self._collections.get(collection_path, {}).get(doc_id)
+
+    def _touch(self, path):
+        # a new update_time for the document, later than any before it even if the clock hasn't moved
+        self._clock = max(datetime.now(timezone.utc), self._clock + timedelta(microseconds=1))
+        self._update_times[path] = self._clock
+
+    def _apply(self, op, reference, data, merge):
+        collection_path = reference._collection_path
+        docs = self._collections.setdefault(collection_path, {})
+        self._unindex(collection_path, reference.id, docs.get(reference.id))
+        if op == "delete":
+            docs.pop(reference.id, None)
+            self._update_times.pop(reference.path, None)
+            return
+        if op in ("set", "create") and not merge:
+            docs[reference.id] = {}
+        current = docs.setdefault(reference.id, {})
+        if op == "update":
+            for field_path, value in data.items():
+                _set_field(current, field_path, value)
+        else:
+            _merge(current, data)
+        self._touch(reference.path)
+        self._index(collection_path, reference.id, current)
+
+    def _index_entries(self, data):
+        # (field, value) for every indexed field the document has a value for that can be looked up
+        if not data:
+            return
+        for field in INDEXED_FIELDS:
+            if field in data:
+                try:
+                    hash(data[field])
+                except TypeError:
+                    continue
+                yield field, data[field]
+        for field in ARRAY_INDEXED_FIELDS:
+            if isinstance(data.get(field), list):
+                for value in data[field]:
+                    try:
+                        hash(value)
+                    except TypeError:
+                        continue
+                    yield field, value
+
+    def _index(self, collection_path, doc_id, data):
+        name = collection_path.rsplit("/", 1)[-1]
+        for field, value in self._index_entries(data):
+            self._indexes[field].setdefault(name, {}).setdefault(value, set()).add((collection_path, doc_id))
+
+    def _unindex(self, collection_path, doc_id, data):
+        name = collection_path.rsplit("/", 1)[-1]
+        for field, value in self._index_entries(data):
+            entries = self._indexes[field].get(name, {}).get(value)
+            if entries is not None:
+                entries.discard((collection_path, doc_id))
+                if not entries:
+                    del self._indexes[field][name][value]
+
+    def _indexed(self, name, filters):
+        # the smallest set of documents an equality or array-contains filter on an indexed field narrows a query down to,
+        # or None if none of its filters can use an index. the query still checks every filter on what comes back
+        best = None
+        for field_path, op, value in filters:
+            indexed = field_path in INDEXED_FIELDS if op == "==" else op == "array_contains" and field_path in ARRAY_INDEXED_FIELDS
+            if not indexed:
+                continue
+            try:
+                entries = self._indexes[field_path].get(name, {}).get(value, ())
+            except TypeError:
+                continue
+            if best is None or len(entries) < len(best):
+                best = entries
+        return best
+
+    def collection(self, collection_id):
+        return MemoryCollectionReference(self, collection_id)
+
+    def collection_group(self, collection_id):
+        return MemoryQuery(self, group=collection_id)
+
+    def document(self, document_path):
+        collection_path, doc_id = document_path.rsplit("/", 1)
+        return MemoryDocumentReference(self, collection_path, doc_id)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    @staticmethod
+    def write_option(last_update_time):
+        return {"last_update_time": last_update_time}
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        await self._rpc()
+        for reference in references:
+            self._count("reads")
+            yield reference._snapshot()
+
+    def seed(self, path, data):
+        # write a document directly, without counting it as a write. used to build benchmark datasets
+        collection_path, doc_id = path.rsplit("/", 1)
+        docs = self._collections.setdefault(collection_path, {})
+        self._unindex(collection_path, doc_id, docs.get(doc_id))
+        docs[doc_id] = copy.deepcopy(data)
+        self._touch(path)
+        self._index(collection_path, doc_id, docs[doc_id])
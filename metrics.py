@@ -0,0 +1,274 @@
+# request metrics for GET /metrics, in the prometheus text format:
+#
+#   http_request_duration_seconds          histogram per method and route template
+#   http_requests_total                    per method, route and status code
+#   firestore_operations_total             reads, writes, queries and commits per method and route. divide by
+#                                          http_request_duration_seconds_count for the cost of a single request
+#   cache_requests_total                   hits and misses of the in-process caches (tokens, signing certs, board
+#                                          access, user search, profiles), so hit rates are hits / (hits + misses)
+#   board_event_subscribers                open GET /boards/{id}/events streams on this worker
+#
+# the numbers are per worker process. MetricsMiddleware times every request and gives it a counter that the datastore
+# client adds its operations to (see CountingAsyncClient and memory_store.MemoryFirestore.observer), so a request is
+# charged for exactly the firestore work done on its behalf. the events stream is timed for as long as it stays open.
+#
+# the metrics show the traffic of every route, so they aren't public. the scraper sends
+#
+#   Authorization: Bearer <METRICS_TOKEN>
+#
+# and without METRICS_TOKEN set nobody gets them. METRICS_ALLOW_LOCAL=1 also lets in clients connecting from the
+# loopback address, for a scraper on the same host. don't set it behind a reverse proxy on the same host: every request
+# it forwards comes from the loopback address. everyone else gets a 403.
+import contextvars
+import hmac
+import os
+import threading
+import time
+
+from fastapi.responses import Response
+
+# upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+OPERATIONS = ("reads", "writes", "queries", "commits")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+
+METRICS_ALLOW_LOCAL = os.environ.get("METRICS_ALLOW_LOCAL") == "1"
+
+LOCAL_CLIENTS = ("127.0.0.1", "::1")
+
+# the operations of the request being handled, {operation: count}
+_current = contextvars.ContextVar("firestore_operations", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.requests = {}
+        self.operations = {}
+        # operations that happen outside any request, like the startup listener or background work
+        self.background = dict.fromkeys(OPERATIONS, 0)
+
+    def record_request(self, method, route, status, seconds, operations):
+        with self._lock:
+            histogram = self.latency.get((method, route))
+            if histogram is None:
+                histogram = self.latency[(method, route)] = Histogram()
+            histogram.observe(seconds)
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for operation, count in operations.items():
+                key = (method, route, operation)
+                self.operations[key] = self.operations.get(key, 0) + count
+
+    def record_background(self, operation, count):
+        with self._lock:
+            self.background[operation] += count
+
+    def clear(self):
+        with self._lock:
+            self.latency.clear()
+            self.requests.clear()
+            self.operations.clear()
+            self.background = dict.fromkeys(OPERATIONS, 0)
+
+    def render(self, caches, subscribers):
+        # caches is {name: object with a stats() that has hits and misses}
+        with self._lock:
+            latency = {key: (list(h.buckets), h.count, h.sum) for key, h in self.latency.items()}
+            requests = dict(self.requests)
+            operations = dict(self.operations)
+            background = dict(self.background)
+
+        lines = [
+            "# HELP http_request_duration_seconds Time from receiving a request to finishing its response.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), (buckets, count, total) in sorted(latency.items()):
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {count}")
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {total:.6f}")
+
+        lines += ["# HELP http_requests_total Requests by response status.", "# TYPE http_requests_total counter"]
+        for (method, route, status), count in sorted(requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP firestore_operations_total Datastore operations, by the request they were made for.",
+            "# TYPE firestore_operations_total counter",
+        ]
+        for (method, route, operation), count in sorted(operations.items()):
+            lines.append(f'firestore_operations_total{{method="{method}",route="{_escape(route)}",op="{operation}"}} {count}')
+        for operation, count in background.items():
+            lines.append(f'firestore_operations_total{{method="",route="background",op="{operation}"}} {count}')
+
+        lines += ["# HELP cache_requests_total In-process cache lookups.", "# TYPE cache_requests_total counter"]
+        for name, cache in caches.items():
+            stats = cache.stats()
+            lines.append(f'cache_requests_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+            lines.append(f'cache_requests_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+
+        lines += [
+            "# HELP board_event_subscribers Open board event streams.",
+            "# TYPE board_event_subscribers gauge",
+            f"board_event_subscribers {subscribers}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+registry = Registry()
+
+
+def record_operation(operation, count=1):
+    # called by the datastore client for every operation it makes
+    operations = _current.get()
+    if operations is None:
+        registry.record_background(operation, count)
+    else:
+        operations[operation] += count
+
+
+def untracked():
+    # for work that outlives the request that started it (see jobs.py). its operations count as background from here on
+    _current.set(None)
+
+
+def allowed(request):
+    # whether the request may read the metrics, see METRICS_TOKEN above
+    if METRICS_TOKEN is not None:
+        expected = f"Bearer {METRICS_TOKEN}".encode("utf-8")
+        if hmac.compare_digest(request.headers.get("authorization", "").encode("utf-8"), expected):
+            return True
+    if METRICS_ALLOW_LOCAL:
+        return request.client is not None and request.client.host in LOCAL_CLIENTS
+    return False
+
+
+def response(caches, subscribers):
+    return Response(registry.render(caches, subscribers), media_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    # plain ASGI so streaming responses pass straight through
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        operations = dict.fromkeys(OPERATIONS, 0)
+        token = _current.set(operations)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current.reset(token)
+            # the router leaves the matched route in the scope, the template keeps ids out of the labels
+            route = scope.get("route")
+            name = route.path if route is not None else (scope.get("root_path") or "unmatched")
+            registry.record_request(scope["method"], name, status, time.perf_counter() - started, operations)
+
+
+def counting_firestore_client():
+    # firestore.AsyncClient whose RPCs are counted with record_operation. every read, query and commit the async client
+    # makes goes through one of the wrapped GAPIC calls, whatever reference or query object it started from
+    from google.cloud import firestore
+
+    class CountingAsyncClient(firestore.AsyncClient):
+        @property
+        def _firestore_api(self):
+            api = super()._firestore_api
+            if self.__dict__.get("_counted_api_for") is not api:
+                self._counted_api = _CountingAPI(api)
+                self._counted_api_for = api
+            return self._counted_api
+
+    return CountingAsyncClient()
+
+
+class _CountingAPI:
+    def __init__(self, api):
+        self._api = api
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    async def batch_get_documents(self, *args, **kwargs):
+        responses = await self._api.batch_get_documents(*args, **kwargs)
+
+        async def counted():
+            async for item in responses:
+                # a document that doesn't exist is billed as a read too
+                record_operation("reads")
+                yield item
+
+        return counted()
+
+    async def run_query(self, *args, **kwargs):
+        record_operation("queries")
+        responses = await self._api.run_query(*args, **kwargs)
+
+        async def counted():
+            returned = 0
+            async for item in responses:
+                if item.document:
+                    returned += 1
+                    record_operation("reads")
+                yield item
+            # a query that returns nothing is billed as one read
+            if not returned:
+                record_operation("reads")
+
+        return counted()
+
+    async def run_aggregation_query(self, *args, **kwargs):
+        record_operation("queries")
+        record_operation("reads")
+        return await self._api.run_aggregation_query(*args, **kwargs)
+
+    async def commit(self, *args, **kwargs):
+        request = kwargs.get("request") or (args[0] if args else None)
+        writes = request.get("writes", []) if isinstance(request, dict) else getattr(request, "writes", [])
+        record_operation("commits")
+        record_operation("writes", len(writes))
+        return await self._api.commit(*args, **kwargs)
@@ -0,0 +1,148 @@
+# offline tool for moving boards off the per-member replicas and onto the canonical layout described in storage.py.
+#
+# the rollout is:
+#
+#   1. deploy with STORAGE_MODE=dual so new writes land in both layouts
+#   2. python migrate_storage.py migrate          copies every board, its tasks and a membership per member
+#   3. deploy with STORAGE_MODE=canonical
+#   4. python migrate_storage.py prune-replicas   deletes the users/{uid}/taskboards copies once nothing reads them
+#
+# a board is migrated in three steps. its tasks are copied first, while readers in dual mode still use the replica. then
+# the canonical board document is written from a fresh read of the source, which flips readers over to it and from
+# then on every write goes to both layouts. writes made between the copy and the flip only reached the replicas, so
+# last the canonical tasks are reconciled with the source: missing or changed tasks are copied again, tasks deleted in
+# the meantime are deleted, and the counters are recomputed from the result. a write racing that last step can still
+# leave a difference behind, and running migrate again for the board (--board) reconciles it the same way.
+import argparse
+import asyncio
+
+import board_index
+import board_stats
+import board_versions
+import storage
+
+
+async def source_boards(db, board_id=None):
+    # returns {board_id: (board_ref, board_data, holder_ids)} using the creator's copy as the source of truth. stubs
+    # (see storage.is_stub) are never the source, but their holders are listed so prune-replicas deletes them too
+    sources = {}
+    holders = {}
+    replicas = storage.iter_board_copies(db, canonical=False, replicas=True, board_id=board_id, skip_stubs=False)
+    async for board in replicas:
+        holder_id = board.reference.parent.parent.id
+        holders.setdefault(board.id, []).append(holder_id)
+        board_data = board.to_dict()
+        if storage.is_stub(board_data):
+            continue
+        if board.id not in sources or holder_id == board_data.get("creator_id"):
+            sources[board.id] = (board.reference, board_data)
+
+    for stub_id in holders.keys() - sources.keys():
+        print(f"Skipping {stub_id}: no complete copy of the board to migrate from")
+    return {source_id: (*source, holders[source_id]) for source_id, source in sources.items()}
+
+
+async def commit(batcher, dry_run):
+    if dry_run:
+        return batcher.writes
+    failures = await batcher.commit()
+    if failures:
+        raise RuntimeError(f"{len(failures)} writes failed, first error: {failures[0]['error']}")
+    return batcher.writes
+
+
+async def migrate_board(db, source_id, source_ref, stale_members, dry_run=False):
+    canonical_ref = storage.canonical_board_ref(db, source_id)
+
+    # 1. the tasks, committed before the board document flips readers over to them
+    batcher = storage.WriteBatcher(db)
+    async for task in source_ref.collection("tasks").stream():
+        batcher.set(canonical_ref.collection("tasks").document(task.id), task.to_dict())
+    writes = await commit(batcher, dry_run)
+
+    # 2. the flip, with the members, title and version the source has now rather than when the migration started
+    board_doc = await source_ref.get()
+    if not board_doc.exists:
+        # deleted since, whatever was copied is left for prune-replicas to find
+        return writes
+    board_data = board_doc.to_dict()
+    members = board_data.get("members", [])
+    batcher = storage.WriteBatcher(db)
+    batcher.set(canonical_ref, board_data, merge=True)
+    for member_id in members:
+        batcher.set(storage.membership_ref(db, member_id, source_id), {"joined_at": board_data.get("created_at")})
+    for member_id in set(stale_members) - set(members):
+        batcher.delete(storage.membership_ref(db, member_id, source_id))
+    writes += await commit(batcher, dry_run)
+
+    # 3. writes now reach both layouts, so what the canonical tasks are missing was written before the flip. the
+    # canonical side is read first: a task created after that is in both by the time the source is read
+    canonical_tasks = {task.id: task.to_dict() async for task in canonical_ref.collection("tasks").stream()}
+    source_tasks = {task.id: task.to_dict() async for task in source_ref.collection("tasks").stream()}
+    batcher = storage.WriteBatcher(db)
+    for task_id, task_data in source_tasks.items():
+        if canonical_tasks.get(task_id) != task_data:
+            batcher.set(canonical_ref.collection("tasks").document(task_id), task_data)
+    for task_id in canonical_tasks.keys() - source_tasks.keys():
+        batcher.delete(canonical_ref.collection("tasks").document(task_id))
+    batcher.update(canonical_ref, {"stats": board_stats.compute_stats(source_tasks.values()), **board_versions.bump()})
+    writes += await commit(batcher, dry_run)
+    return writes
+
+
+async def migrate(db, board_id=None, dry_run=False):
+    boards = await source_boards(db, board_id)
+    writes = 0
+
+    for source_id, (source_ref, board_data, _) in boards.items():
+        writes += await migrate_board(db, source_id, source_ref, board_data.get("members", []), dry_run)
+
+    return len(boards), writes
+
+
+async def prune_replicas(db, board_id=None, dry_run=False):
+    boards = await source_boards(db, board_id)
+    pruned = 0
+    writes = 0
+
+    for source_id, (_, _, holder_ids) in boards.items():
+        if not (await storage.canonical_board_ref(db, source_id).get()).exists:
+            print(f"Skipping {source_id}: not migrated yet")
+            continue
+
+        batcher = storage.WriteBatcher(db)
+        for holder_id in holder_ids:
+            replica_ref = storage.replica_board_ref(db, holder_id, source_id)
+            async for task in replica_ref.collection("tasks").stream():
+                batcher.delete(task.reference)
+            batcher.delete(replica_ref)
+        batcher.delete(board_index.index_ref(db, source_id))
+        writes += await commit(batcher, dry_run)
+        pruned += 1
+
+    return pruned, writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move boards from per-member replicas to the canonical layout")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (
+        ("migrate", "copy boards, tasks and memberships into the canonical layout"),
+        ("prune-replicas", "delete the per-member copies of boards that have been migrated"),
+    ):
+        subparser = subcommands.add_parser(name, help=help_text)
+        subparser.add_argument("--board", help="only process this board id")
+        subparser.add_argument("--dry-run", action="store_true", help="count the writes without committing them")
+    args = parser.parse_args()
+
+    db = storage.client()
+    if args.command == "migrate":
+        count, writes = asyncio.run(migrate(db, args.board, args.dry_run))
+        print(f"Migrated {count} boards ({writes} writes{', dry run' if args.dry_run else ''})")
+    elif args.command == "prune-replicas":
+        count, writes = asyncio.run(prune_replicas(db, args.board, args.dry_run))
+        print(f"Pruned replicas of {count} boards ({writes} writes{', dry run' if args.dry_run else ''})")
+
+
+if __name__ == "__main__":
+    main()
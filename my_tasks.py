@@ -0,0 +1,65 @@
+# GET /me/tasks: the tasks assigned to the caller on all of their boards, soonest due first, a page at a time.
+#
+#   limit         page size, DEFAULT_PAGE_SIZE unless given, up to task_query.MAX_PAGE_SIZE
+#   cursor        the X-Next-Cursor header of the previous page
+#   completed     true / false
+#   due_after     ISO datetime, tasks due at or after it
+#   due_before    ISO datetime, tasks due before it
+#
+# the tasks come from the task index (see task_search.py), which has one entry per task whatever STORAGE_MODE is and
+# carries the assignee. a page is a single query on it, assigned_to == caller ordered by due_date, instead of one per
+# board, and the composite indexes it needs are in firestore.indexes.json. entries on boards the caller can no longer
+# see (a member removal whose job hasn't unassigned their tasks yet) are left out of the page, and the query is run
+# again from the last entry it returned to fill their places, up to MAX_QUERIES times. a page that is still short then
+# comes with a cursor for the rest.
+import task_query
+import task_search
+
+DEFAULT_PAGE_SIZE = 50
+
+# queries per page at most
+MAX_QUERIES = 5
+
+PARAMS = ("limit", "cursor", "completed", "due_after", "due_before")
+
+
+class MyTasksPage(task_query.TaskPage):
+    def __init__(self, params, user_id):
+        params = {name: params[name] for name in PARAMS if params.get(name)}
+        params.setdefault("limit", str(DEFAULT_PAGE_SIZE))
+        super().__init__(params, order_by_due_date=True)
+        self.assigned_to = user_id
+
+    async def read(self, db, boards):
+        # returns (tasks, next_cursor). boards is {board_id: board_data} for every board the caller can see
+        self.next_cursor = None
+        tasks = []
+        last = None
+        for _ in range(MAX_QUERIES):
+            scanned = 0
+            async for entry_doc in self.query(db.collection(task_search.INDEX_COLLECTION)).stream():
+                if len(tasks) == self.limit:
+                    self.next_cursor = task_query.encode_cursor(*last, self.by_due_date)
+                    return tasks, self.next_cursor
+                entry_data = entry_doc.to_dict()
+                last = (entry_doc.id, entry_data)
+                scanned += 1
+                board = boards.get(entry_data["board_id"])
+                if board is None:
+                    continue
+                tasks.append({
+                    "board_id": entry_data["board_id"],
+                    "board_title": board.get("title", ""),
+                    "id": entry_data["task_id"],
+                    "title": entry_data.get("title"),
+                    "description": entry_data.get("description", ""),
+                    "due_date": entry_data.get("due_date"),
+                    "completed": entry_data.get("completed", False),
+                })
+            if scanned <= self.limit:
+                # the query ran out, this is the last page
+                return tasks, None
+            # limit + 1 entries came back but some were left out, so there may be room for more
+            self.cursor = {"__name__": last[0], "due_date": last[1]["due_date"]}
+        self.next_cursor = task_query.encode_cursor(*last, self.by_due_date)
+        return tasks, self.next_cursor
@@ -0,0 +1,146 @@
+# the files under /static, built once per deploy into content-hashed, precompressed copies:
+#
+#   python static_assets.py build [--static-dir static]
+#
+# writes static/dist/<name>.<hash>.<ext> for every file in static/, next to it a .gz (and a .br with the brotli package
+# installed, see compression.py) compressed as small as they go, and static/dist/manifest.json mapping each name to its
+# hashed one. templates link to assets through asset_url("styles.css"), which looks the name up in the manifest, so a
+# changed file gets a new url and browsers can keep the old one forever: hashed files are served with
+# Cache-Control: immutable, and the precompressed copy that matches the client's Accept-Encoding goes out in place of the
+# file. without a build asset_url falls back to the plain /static/<name>, served as before.
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+import compression
+
+STATIC_DIR = "static"
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+
+# the url the static directory is mounted at in main.py
+URL_PREFIX = "/static"
+
+HASH_LENGTH = 12
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# smaller files aren't worth a compressed copy
+MIN_SIZE = 256
+
+# {name: hashed name} from the manifest, read the first time it is needed
+_manifest = None
+
+
+def hashed_name(name, content):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def build(static_dir=STATIC_DIR):
+    # returns the manifest it wrote. the previous build is replaced
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.makedirs(dist_dir)
+
+    manifest = {}
+    for directory, subdirectories, files in os.walk(static_dir):
+        if os.path.abspath(directory) == os.path.abspath(static_dir) and DIST_DIR in subdirectories:
+            subdirectories.remove(DIST_DIR)
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as source:
+                content = source.read()
+            manifest[name] = hashed_name(name, content)
+
+            target = os.path.join(dist_dir, manifest[name])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as output:
+                output.write(content)
+            if len(content) < MIN_SIZE:
+                continue
+            for encoding in compression.available():
+                compressed = compression.compress(content, encoding, best=True)
+                if len(compressed) < len(content):
+                    with open(target + compression.EXTENSIONS[encoding], "wb") as output:
+                        output.write(compressed)
+
+    with open(os.path.join(dist_dir, MANIFEST), "w") as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+def manifest(static_dir=STATIC_DIR):
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(os.path.join(static_dir, DIST_DIR, MANIFEST)) as source:
+                _manifest = json.load(source)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+
+def asset_url(name):
+    # the url of a file in static/, its hashed copy once there is a build
+    hashed = manifest().get(name)
+    if hashed is None:
+        return f"{URL_PREFIX}/{name}"
+    return f"{URL_PREFIX}/{DIST_DIR}/{hashed}"
+
+
+class StaticAssets(StaticFiles):
+    # StaticFiles that serves built files as immutable and precompressed when the client accepts it
+    def __init__(self, directory):
+        super().__init__(directory=directory)
+        self.dist_dir = os.path.realpath(os.path.join(directory, DIST_DIR))
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        full_path = os.path.realpath(full_path)
+        if not full_path.startswith(self.dist_dir + os.sep) or full_path.endswith((".gz", ".br", MANIFEST)):
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        precompressed = [
+            encoding for encoding in compression.available()
+            if os.path.exists(full_path + compression.EXTENSIONS[encoding])
+        ]
+        headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+        encoding = compression.negotiate(Headers(scope=scope).get("accept-encoding", ""), precompressed)
+        if encoding is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers.update(headers)
+            return response
+        compressed_path = full_path + compression.EXTENSIONS[encoding]
+        return FileResponse(
+            compressed_path,
+            status_code=status_code,
+            headers={**headers, "Content-Encoding": encoding},
+            # the type of the file itself, not of its compressed copy
+            media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+            stat_result=os.stat(compressed_path),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build content-hashed, precompressed static assets")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    build_parser = subcommands.add_parser("build", help="hash and compress every file in the static directory")
+    build_parser.add_argument("--static-dir", default=STATIC_DIR)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        built = build(args.static_dir)
+        for name, hashed in sorted(built.items()):
+            print(f"{name} -> {DIST_DIR}/{hashed}")
+
+
+if __name__ == "__main__":
+    main()
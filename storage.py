@@ -0,0 +1,307 @@
+# where boards and tasks live in firestore.
+#
+# there are two layouts:
+#
+#   replicated  users/{uid}/taskboards/{board_id} (+ tasks) for every member. every write fans out to each member's copy
+#   canonical   boards/{board_id} (+ tasks) once, plus users/{uid}/memberships/{board_id} so we can list a user's boards
+#
+# STORAGE_MODE picks which one the app reads and writes:
+#
+#   replicated  the original layout, nothing canonical is touched
+#   dual        the migration phase. writes go to both layouts, reads prefer the canonical board and fall back to the
+#               caller's replica for boards that haven't been migrated yet (see migrate_storage.py)
+#   canonical   only the canonical layout. task mutations are O(1) writes no matter how many members a board has
+#
+# DATASTORE picks what holds the data:
+#
+#   firestore   the firestore project from the environment, the default
+#   memory      memory_store.py, an in-process store with the same API. nothing is persisted
+import asyncio
+import os
+
+from google.api_core import exceptions
+
+REPLICATED = "replicated"
+DUAL = "dual"
+CANONICAL = "canonical"
+
+STORAGE_MODE = os.environ.get("STORAGE_MODE", REPLICATED)
+if STORAGE_MODE not in (REPLICATED, DUAL, CANONICAL):
+    raise ValueError(f"Unknown STORAGE_MODE {STORAGE_MODE!r}")
+
+FIRESTORE = "firestore"
+MEMORY = "memory"
+
+DATASTORE = os.environ.get("DATASTORE", FIRESTORE)
+if DATASTORE not in (FIRESTORE, MEMORY):
+    raise ValueError(f"Unknown DATASTORE {DATASTORE!r}")
+
+BOARDS_COLLECTION = "boards"
+
+
+def client():
+    # the database client every data access goes through. both count their operations for GET /metrics
+    import metrics
+
+    if DATASTORE == MEMORY:
+        import memory_store
+
+        return memory_store.MemoryFirestore(observer=metrics.record_operation)
+    return metrics.counting_firestore_client()
+
+
+def uses_replicas():
+    return STORAGE_MODE != CANONICAL
+
+
+def uses_canonical():
+    return STORAGE_MODE != REPLICATED
+
+
+def canonical_board_ref(db, board_id):
+    return db.collection(BOARDS_COLLECTION).document(board_id)
+
+
+def replica_board_ref(db, user_id, board_id):
+    return db.collection("users").document(user_id).collection("taskboards").document(board_id)
+
+
+def membership_ref(db, user_id, board_id):
+    return db.collection("users").document(user_id).collection("memberships").document(board_id)
+
+
+def is_canonical(board_ref):
+    return board_ref.parent.id == BOARDS_COLLECTION
+
+
+def is_stub(board_data):
+    # a replica that only holds counters and a version: the merged board writes of a mutation (see WriteBatcher.merge)
+    # create one for a member who doesn't have a copy yet. it is treated as no copy at all, view_board replaces it with
+    # a full one the first time the member opens the board
+    return "creator_id" not in board_data
+
+
+async def load_board(db, board_id, user_id):
+    # returns (board_ref, board_data) for the copy of the board this request should read from, or (None, None).
+    # membership is not checked here, that is up to the caller
+    if uses_canonical():
+        board_doc = await canonical_board_ref(db, board_id).get()
+        if board_doc.exists:
+            return board_doc.reference, board_doc.to_dict()
+        if STORAGE_MODE == CANONICAL:
+            return None, None
+
+    board_doc = await replica_board_ref(db, user_id, board_id).get()
+    if board_doc.exists and not is_stub(board_doc.to_dict()):
+        return board_doc.reference, board_doc.to_dict()
+    return None, None
+
+
+def write_refs(db, board_id, board_ref, member_ids):
+    # every board document a mutation has to be applied to. in dual mode a board that was loaded from a replica hasn't
+    # been migrated yet, so we leave the canonical side alone rather than creating a half populated board there
+    refs = []
+    if board_ref is not None and is_canonical(board_ref):
+        refs.append(board_ref)
+    if uses_replicas():
+        refs.extend(replica_board_ref(db, member_id, board_id) for member_id in member_ids)
+    return refs
+
+
+def new_board_refs(db, user_id):
+    # refs for a board that is about to be created, all sharing the same generated id
+    if uses_canonical():
+        board_ref = db.collection(BOARDS_COLLECTION).document()
+        refs = [board_ref]
+        if uses_replicas():
+            refs.append(replica_board_ref(db, user_id, board_ref.id))
+        return refs
+    return [db.collection("users").document(user_id).collection("taskboards").document()]
+
+
+async def _canonical_boards(db, user_id):
+    membership_docs = db.collection("users").document(user_id).collection("memberships").stream()
+    board_refs = [canonical_board_ref(db, membership.id) async for membership in membership_docs]
+    if not board_refs:
+        return []
+    return [(board_doc.id, board_doc.to_dict()) async for board_doc in db.get_all(board_refs) if board_doc.exists]
+
+
+async def _replica_boards(db, user_id):
+    board_docs = db.collection("users").document(user_id).collection("taskboards").stream()
+    return [(board_doc.id, board_doc.to_dict()) async for board_doc in board_docs if not is_stub(board_doc.to_dict())]
+
+
+async def list_boards(db, user_id):
+    # returns [(board_id, board_data)] for every board the user can see. in dual mode both layouts are read at the
+    # same time, the canonical copy wins and replicas only fill in boards that haven't been migrated
+    sources = []
+    if uses_canonical():
+        sources.append(_canonical_boards(db, user_id))
+    if uses_replicas():
+        sources.append(_replica_boards(db, user_id))
+
+    boards = {}
+    for source in await asyncio.gather(*sources):
+        for board_id, board_data in source:
+            boards.setdefault(board_id, board_data)
+    return list(boards.items())
+
+
+async def iter_board_copies(db, canonical=None, replicas=None, board_id=None, skip_stubs=True):
+    # every board document in the database, for the offline tools: the canonical boards first, then the members'
+    # replicas, by default whichever of the two STORAGE_MODE uses. a replica's parent document is the user that holds
+    # it. top level taskboards documents, which aren't anybody's copy, are left out, and so are stubs unless asked for
+    if canonical is None:
+        canonical = uses_canonical()
+    if replicas is None:
+        replicas = uses_replicas()
+    board_queries = []
+    if canonical:
+        board_queries.append(db.collection(BOARDS_COLLECTION).stream())
+    if replicas:
+        board_queries.append(db.collection_group("taskboards").stream())
+
+    for board_query in board_queries:
+        async for board in board_query:
+            if board.reference.parent.parent is None and not is_canonical(board.reference):
+                continue
+            if board_id and board.id != board_id:
+                continue
+            if skip_stubs and is_stub(board.to_dict()):
+                continue
+            yield board
+
+
+# firestore rejects batches with more than 500 writes
+BATCH_LIMIT = 500
+
+# times a request reads and writes again when a precondition shows somebody else changed what it read
+MAX_ATTEMPTS = 5
+
+
+def merge_fields(fields):
+    # update() style fields ({"stats.total_tasks": ...}) as the nested dict set(..., merge=True) takes
+    merged = {}
+    for field_path, value in fields.items():
+        *parents, name = field_path.split(".")
+        target = merged
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[name] = value
+    return merged
+
+
+def write_target(ref):
+    # who a write belongs to, for error reporting: the member id for anything under users/{uid}, "board" for the
+    # canonical board, otherwise the collection it is in (an index like task_search or task_titles)
+    parts = ref.path.split("/")
+    if parts[0] == "users" and len(parts) > 1:
+        return parts[1]
+    if parts[0] == BOARDS_COLLECTION:
+        return "board"
+    return parts[0]
+
+
+class WriteBatcher:
+    # collects writes for a fan-out and commits them as write batches of at most BATCH_LIMIT operations. a chunk that
+    # fails doesn't stop the others; commit() returns [{"target": ..., "error": ...}] for every target (see write_target)
+    # with a write that didn't land
+    def __init__(self, db):
+        self._db = db
+        self._chunks = []
+        self._batch = None
+        self._targets = []
+        # writes with a precondition: creates, and updates or deletes of a document that mustn't have changed
+        self._checked = 0
+        self.targets = set()
+        # the targets that are a copy of the board or a member's data rather than an index, see main.fanout_response
+        self.copies = set()
+        self.writes = 0
+
+    def set(self, ref, data, merge=False):
+        self._next_batch(ref).set(ref, data, merge=merge)
+
+    def update(self, ref, data):
+        self._next_batch(ref).update(ref, data)
+
+    def merge(self, ref, fields):
+        # update() for a document that might not exist, like the copy of a member whose replica is missing. an update
+        # there would fail its whole batch and so every other copy in it, this creates the document instead
+        self._next_batch(ref).set(ref, merge_fields(fields), merge=True)
+
+    def delete(self, ref):
+        self._next_batch(ref).delete(ref)
+
+    def create(self, ref, data):
+        # a write that only succeeds if the document doesn't exist yet. creates have to come before any other write so
+        # they land in the first batch, which commit() sends on its own before the rest. if firestore rejects it nothing
+        # has been written and commit() raises AlreadyExists instead of returning failures
+        self._check()
+        self._next_batch(ref).create(ref, data)
+
+    def update_unchanged(self, ref, data, snapshot):
+        # an update that only succeeds if nothing has written the document since `snapshot` was read. like create() it
+        # goes in the first batch, and if the document has changed nothing is written and commit() raises
+        # FailedPrecondition, so the caller can read it again and start over
+        self._check()
+        self._next_batch(ref).update(ref, data, option=self._db.write_option(last_update_time=snapshot.update_time))
+
+    def delete_unchanged(self, ref, snapshot):
+        self._check()
+        self._next_batch(ref).delete(ref, option=self._db.write_option(last_update_time=snapshot.update_time))
+
+    def _check(self):
+        if self.writes != self._checked:
+            raise ValueError("writes with a precondition have to come before any other write")
+        if self._checked == BATCH_LIMIT:
+            raise ValueError(f"at most {BATCH_LIMIT} writes with a precondition fit in the first batch")
+        self._checked += 1
+
+    def keep_together(self, count):
+        # the next `count` writes go into the same batch, so they are committed atomically
+        if self._batch is not None and len(self._targets) + count > BATCH_LIMIT:
+            self._seal()
+
+    def _next_batch(self, ref):
+        if self._batch is None or len(self._targets) == BATCH_LIMIT:
+            self._seal()
+            self._batch = self._db.batch()
+        target = write_target(ref)
+        self._targets.append(target)
+        self.targets.add(target)
+        if ref.path.split("/")[0] in ("users", BOARDS_COLLECTION):
+            self.copies.add(target)
+        self.writes += 1
+        return self._batch
+
+    def _seal(self):
+        if self._batch is not None and self._targets:
+            self._chunks.append((self._batch, self._targets))
+        self._batch = None
+        self._targets = []
+
+    async def commit(self):
+        # the chunks are independent of each other so they are all sent at once, apart from the first one when it holds
+        # writes with a precondition (see create above)
+        self._seal()
+        chunks, self._chunks = self._chunks, []
+        failures = []
+        if self._checked and chunks:
+            try:
+                await chunks[0][0].commit()
+            except (exceptions.AlreadyExists, exceptions.FailedPrecondition):
+                raise
+            except Exception as e:
+                # none of the other chunks are sent either, so nothing at all was written
+                for target in dict.fromkeys(target for _, targets in chunks for target in targets):
+                    failures.append({"target": target, "error": str(e)})
+                return failures
+            chunks = chunks[1:]
+
+        results = await asyncio.gather(*(batch.commit() for batch, _ in chunks), return_exceptions=True)
+        for (_, targets), result in zip(chunks, results):
+            if isinstance(result, Exception):
+                for target in dict.fromkeys(targets):
+                    failures.append({"target": target, "error": str(result)})
+        return failures
@@ -0,0 +1,247 @@
+# the body of POST /boards/{board_id}/tasks:batch, which applies many task changes in one request:
+#
+#   {"operations": [
+#       {"op": "create", "title": ..., "description": ..., "due_date": ..., "assigned_to": ...},
+#       {"op": "update", "id": TASK_ID, ...any of title, description, due_date, completed, assigned_to},
+#       {"op": "complete", "id": TASK_ID},
+#       {"op": "delete", "id": TASK_ID}
+#   ]}
+#
+# every operation is checked against the board as it was before the batch, with one read for all the tasks it touches
+# and their search index entries and one for all the titles it claims. titles have to be unique inside the batch too, and a title that another task
+# holds is taken even if that task is renamed or deleted by the same batch. operations that don't pass are reported and
+# left out, the rest are written together.
+#
+# each copy of the board gets its task writes in groups of up to GROUP_SIZE, every group in the same write batch as a
+# single counter update for all of its tasks. the counters move from what the tasks' index entries held, and the
+# entries are only rewritten if nothing has changed them since they were read (see task_search.counted): if something
+# has, nothing is written and the request starts over. the response has one result per operation, in request order:
+#
+#   {"index": 0, "op": "create", "id": TASK_ID, "status": 201, "message": "Task created"}
+from datetime import datetime
+
+import board_stats
+import board_versions
+import storage
+import task_query
+import task_search
+import title_index
+
+MAX_OPERATIONS = 500
+
+# task writes per copy of the board that share one board update. with that update a group fills a write batch
+GROUP_SIZE = storage.BATCH_LIMIT - 1
+
+OPERATIONS = ("create", "update", "complete", "delete")
+
+UPDATE_FIELDS = ("title", "description", "due_date", "completed", "assigned_to")
+
+
+def _parse_due_date(value):
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("due_date must be an ISO datetime")
+
+
+class TaskBatch:
+    # the parsed operations. raises ValueError with a message that can go straight back to the client if the request
+    # as a whole is unusable, problems with single operations end up in their results instead
+    def __init__(self, data, user_id):
+        operations = data.get("operations") if isinstance(data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            raise ValueError("operations must be a non-empty list")
+        if len(operations) > MAX_OPERATIONS:
+            raise ValueError(f"A batch can have at most {MAX_OPERATIONS} operations")
+        # the title claims and the checked index entry writes have to fit in the one batch that is sent first (see
+        # storage.WriteBatcher.create), and an update that renames a task needs both
+        checked = sum(2 if operation.get("op") == "update" and "title" in operation else 1
+                      for operation in operations if isinstance(operation, dict))
+        if checked > storage.BATCH_LIMIT:
+            raise ValueError(
+                f"A batch of {len(operations)} operations can change the title of at most "
+                f"{max(storage.BATCH_LIMIT - len(operations), 0)} tasks"
+            )
+
+        self.user_id = user_id
+        self.results = []
+        # (index, op, task_id, before, after) for every operation that is going to be written
+        self.changes = []
+        self._pending = []
+        self._claims = []
+        # the index entries of the tasks the batch changes, as they were read
+        self._entries = {}
+        seen_ids = set()
+        for index, operation in enumerate(operations):
+            op = operation.get("op") if isinstance(operation, dict) else None
+            task_id = operation.get("id") if op in ("update", "complete", "delete") else None
+            self.results.append({"index": index, "op": op, "id": task_id, "status": None, "message": None})
+            if op not in OPERATIONS:
+                self._result(index, 400, f"op must be one of {', '.join(OPERATIONS)}")
+                continue
+            if op != "create":
+                if not task_id or not isinstance(task_id, str):
+                    self._result(index, 400, "Task ID is required")
+                    continue
+                if task_id in seen_ids:
+                    self._result(index, 400, "Task appears more than once in the batch")
+                    continue
+                seen_ids.add(task_id)
+            try:
+                fields = self._parse(op, operation)
+            except ValueError as e:
+                self._result(index, 400, str(e))
+                continue
+            self._pending.append((index, op, task_id, fields))
+
+    def _parse(self, op, operation):
+        if op == "delete":
+            return {}
+        if op == "complete":
+            return {"completed": True}
+        fields = {field: operation[field] for field in UPDATE_FIELDS if field in operation}
+        if op == "create":
+            if not fields.get("title"):
+                raise ValueError("Title is required")
+            if not fields.get("due_date"):
+                raise ValueError("due_date is required")
+        elif "title" in fields and not fields["title"]:
+            raise ValueError("Title is required")
+        if "due_date" in fields:
+            fields["due_date"] = _parse_due_date(fields["due_date"])
+        if "completed" in fields:
+            fields["completed"] = bool(fields["completed"])
+        return fields
+
+    def _result(self, index, status, message):
+        self.results[index].update(status=status, message=message)
+
+    @property
+    def ok(self):
+        return all(result["status"] in (200, 201) for result in self.results)
+
+    async def validate(self, db, board_id, board_ref):
+        # reads every task the batch touches from the copy of the board this request reads along with its index entry,
+        # and every title it claims from the title index, then decides what each operation writes
+        tasks_ref = board_ref.collection("tasks")
+        existing = {}
+        task_ids = [task_id for _, op, task_id, _ in self._pending if op != "create"]
+        if task_ids:
+            refs = [tasks_ref.document(task_id) for task_id in task_ids]
+            refs += [task_search.entry_ref(db, board_id, task_id) for task_id in task_ids]
+            async for doc in db.get_all(refs):
+                if not doc.exists:
+                    continue
+                if doc.reference.parent.id == task_search.INDEX_COLLECTION:
+                    self._entries[doc.id[len(board_id) + 1:]] = doc
+                else:
+                    existing[doc.id] = doc.to_dict()
+
+        now = datetime.utcnow()
+        claims = {}
+        planned = []
+        for index, op, task_id, fields in self._pending:
+            if op == "create":
+                task_id = tasks_ref.document().id
+                self.results[index]["id"] = task_id
+                before = None
+                after = {
+                    "title": fields["title"],
+                    "description": fields.get("description", ""),
+                    "due_date": fields["due_date"],
+                    "completed": False,
+                    "completed_at": None,
+                    "created_at": now,
+                    "assigned_to": fields.get("assigned_to"),
+                    "created_by": self.user_id,
+                }
+            else:
+                before = existing.get(task_id)
+                if before is None:
+                    self._result(index, 404, "Task not found")
+                    continue
+                if op == "complete" and before.get("completed"):
+                    # nothing to write, so completing a selection twice is harmless
+                    self._result(index, 200, "Task already completed")
+                    continue
+                if op == "delete":
+                    after = None
+                else:
+                    after = {**before, **fields}
+                    if "completed" in fields and fields["completed"] != bool(before.get("completed")):
+                        after["completed_at"] = now if fields["completed"] else None
+
+            if after is not None and (before is None or not title_index.same_title(before.get("title"), after["title"])):
+                key = title_index.normalize(after["title"])
+                if key in claims:
+                    self._result(index, 400, "Another operation in the batch uses this title")
+                    continue
+                claims[key] = (index, task_id, after["title"])
+            planned.append((index, op, task_id, before, after))
+
+        # a title held by a task already is taken, whatever else the batch does to that task
+        taken = set()
+        if claims:
+            refs = {}
+            for index, _, title in claims.values():
+                ref = title_index.reservation_ref(db, board_id, title)
+                refs[ref.id] = (ref, index)
+            async for reservation in db.get_all([ref for ref, _ in refs.values()]):
+                if reservation.exists:
+                    index = refs[reservation.id][1]
+                    taken.add(index)
+                    self._result(index, 400, "A task with this name already exists")
+        self._claims = [(task_id, title) for index, task_id, title in claims.values() if index not in taken]
+
+        for index, op, task_id, before, after in planned:
+            if index in taken:
+                continue
+            self.changes.append((index, op, task_id, before, after))
+            self._result(index, 201 if op == "create" else 200, {
+                "create": "Task created", "update": "Task updated", "complete": "Task completed", "delete": "Task deleted",
+            }[op])
+
+    def write(self, batcher, db, board_id, board_refs):
+        # claims and the checked index entries go first so a title taken or a task changed since validate() rejects the
+        # whole batch before anything is written (see WriteBatcher.create). they, the releases and the other entries are
+        # written once, the tasks once per copy of the board
+        claimed = set()
+        for task_id, title in self._claims:
+            title_index.claim(batcher, db, board_id, title, task_id)
+            claimed.add(title_index.normalize(title))
+        changes = sorted(self.changes, key=lambda change: change[2] not in self._entries)
+        for _, _, task_id, _, after in changes:
+            read = self._entries.get(task_id)
+            if after is None:
+                task_search.remove(batcher, db, board_id, task_id, read)
+            else:
+                task_search.index(batcher, db, board_id, task_id, after, read)
+        for _, _, _, before, after in self.changes:
+            if before is None or (after is not None and title_index.same_title(before.get("title"), after["title"])):
+                continue
+            # a task from before the title index can give up a title with no reservation that the batch just claimed
+            if title_index.normalize(before.get("title")) not in claimed:
+                title_index.release(batcher, db, board_id, before.get("title"))
+
+        for board_ref in board_refs:
+            for start in range(0, len(self.changes), GROUP_SIZE):
+                group = self.changes[start:start + GROUP_SIZE]
+                batcher.keep_together(len(group) + 1)
+                for _, op, task_id, before, after in group:
+                    task_ref = board_ref.collection("tasks").document(task_id)
+                    if after is None:
+                        batcher.delete(task_ref)
+                    else:
+                        # merging the full task, like update_task, fills in a copy that is missing it
+                        batcher.set(task_ref, after, merge=op != "create")
+                changes = [
+                    (task_search.counted(self._entries.get(task_id), before), after)
+                    for _, _, task_id, before, after in group
+                ]
+                batcher.merge(board_ref, {**board_stats.total_increments(changes), **board_versions.bump()})
+
+    def event(self):
+        # one tasks_changed event for the whole batch instead of one per task
+        tasks = [task_query.serialize_task(task_id, after) for _, _, task_id, _, after in self.changes if after is not None]
+        deleted = [task_id for _, _, task_id, _, after in self.changes if after is None]
+        return {"tasks": tasks, "deleted": deleted}
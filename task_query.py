@@ -0,0 +1,144 @@
+# turns the query string of GET /boards/{board_id}/tasks into a firestore query for one page of tasks.
+#
+#   limit         page size, up to MAX_PAGE_SIZE. without it the whole board comes back like it always has
+#   cursor        the X-Next-Cursor header of the previous page
+#   completed     true / false
+#   assigned_to   a user id, or "none" for unassigned tasks
+#   due_after     ISO datetime, tasks due at or after it
+#   due_before    ISO datetime, tasks due before it
+#   fields        comma separated task fields to return. the id is always included
+#   format        ndjson to stream the tasks one per line (same as sending Accept: application/x-ndjson)
+#
+# without a due date filter tasks come back in document id order, with one they are ordered by due_date. the composite
+# indexes these queries need are in firestore.indexes.json (firebase deploy --only firestore:indexes)
+import base64
+import binascii
+import json
+from datetime import datetime
+
+MAX_PAGE_SIZE = 500
+
+TASK_FIELDS = (
+    "title", "description", "due_date", "completed", "completed_at", "created_at", "assigned_to", "previously_assigned",
+    "created_by",
+)
+
+
+def _parse_datetime(name, value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO datetime")
+
+
+def _parse_bool(name, value):
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+
+class TaskPage:
+    # the parsed query string. raises ValueError with a message that can go straight back to the client.
+    # order_by_due_date orders by due date even without a due date filter
+    def __init__(self, params, order_by_due_date=False):
+        self.limit = None
+        if params.get("limit"):
+            try:
+                self.limit = int(params["limit"])
+            except ValueError:
+                raise ValueError("limit must be a number")
+            if not 1 <= self.limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        self.completed = _parse_bool("completed", params["completed"]) if params.get("completed") else None
+        self.assigned_to = params.get("assigned_to") or None
+        self.due_after = _parse_datetime("due_after", params["due_after"]) if params.get("due_after") else None
+        self.due_before = _parse_datetime("due_before", params["due_before"]) if params.get("due_before") else None
+        self.by_due_date = order_by_due_date or self.due_after is not None or self.due_before is not None
+
+        self.fields = None
+        if params.get("fields"):
+            self.fields = [field.strip() for field in params["fields"].split(",") if field.strip() and field.strip() != "id"]
+            unknown = [field for field in self.fields if field not in TASK_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown task fields: {', '.join(unknown)}")
+
+        self.cursor = decode_cursor(params["cursor"], self.by_due_date) if params.get("cursor") else None
+
+    def query(self, tasks_ref):
+        query = tasks_ref
+        if self.completed is not None:
+            query = query.where("completed", "==", self.completed)
+        if self.assigned_to == "none":
+            query = query.where("assigned_to", "==", None)
+        elif self.assigned_to:
+            query = query.where("assigned_to", "==", self.assigned_to)
+        if self.due_after is not None:
+            query = query.where("due_date", ">=", self.due_after)
+        if self.due_before is not None:
+            query = query.where("due_date", "<", self.due_before)
+
+        if self.by_due_date:
+            query = query.order_by("due_date")
+        query = query.order_by("__name__")
+
+        if self.fields is not None:
+            # the cursor needs the due date of the last task even when the client didn't ask for it
+            selected = list(self.fields)
+            if self.by_due_date and "due_date" not in selected:
+                selected.append("due_date")
+            query = query.select(selected)
+
+        if self.cursor is not None:
+            query = query.start_after(self.cursor)
+        if self.limit is not None:
+            # one extra task tells us whether there is another page without a second query
+            query = query.limit(self.limit + 1)
+        return query
+
+    async def stream(self, tasks_ref):
+        # yields the tasks of the page one at a time as firestore returns them. once it is exhausted next_cursor is set
+        # if there is another page
+        self.next_cursor = None
+        count = 0
+        last = None
+        async for task in self.query(tasks_ref).stream():
+            if self.limit is not None and count == self.limit:
+                self.next_cursor = encode_cursor(*last, self.by_due_date)
+                break
+            last = (task.id, task.to_dict())
+            count += 1
+            yield serialize_task(*last, self.fields)
+
+    async def fetch(self, tasks_ref):
+        # returns (tasks, next_cursor) for a response that is sent in one piece
+        tasks = [task async for task in self.stream(tasks_ref)]
+        return tasks, self.next_cursor
+
+
+def serialize_task(task_id, task_data, fields=None):
+    # datetimes are left as they are, fast_json.dumps writes them out in ISO format
+    if fields is not None:
+        return {"id": task_id, **{field: task_data[field] for field in fields if field in task_data}}
+    return {"id": task_id, **task_data}
+
+
+def encode_cursor(task_id, task_data, by_due_date):
+    position = {"id": task_id}
+    if by_due_date:
+        position["due_date"] = task_data["due_date"].isoformat()
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, by_due_date):
+    # the start_after() values for the page after the one the cursor came from
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        values = {"__name__": position["id"]}
+        if by_due_date:
+            values["due_date"] = datetime.fromisoformat(position["due_date"])
+        return values
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,263 @@
+# full-text search over task titles and descriptions, behind GET /tasks/search?q=.
+#
+# task_search/{board_id}:{task_id} is an inverted index entry per task: the words of its title and description, every
+# prefix of them from MIN_PREFIX characters on in "terms", and the fields a result shows. create_task, update_task,
+# delete_task and the batch endpoint write the entry in the same batch as the task, once per task whatever STORAGE_MODE is,
+# and the board counters are moved from what it held (see counted).
+# a deleted board's entries stay behind, but only boards the caller can still see are ever searched. the entries also
+# carry the assignee, which is what GET /me/tasks queries (see my_tasks.py).
+#
+# a search is one query per 30 of the caller's boards (the most an "in" filter takes), all sent at once:
+#
+#   board_id in [...] and terms array-contains <the longest query word>
+#
+# which needs the composite index on (board_id, terms) in firestore.indexes.json. what comes back is narrowed down to
+# entries where every query word starts some word of the task, and ranked: whole words beat prefixes, the title beats
+# the description, and a title that starts with the query beats one that only contains it. no task collection is read.
+#
+# a query reads at most MAX_CANDIDATES entries, in no particular order, before they are ranked. when one of the 30 board
+# queries reaches that, its boards are queried again one by one so a large board can't crowd out the others' matches.
+# a board that reaches it on its own can have matches that were never read: the response then says so with
+# X-Search-Truncated: true, and a longer or more specific query narrows it down.
+#
+# tasks created before the index existed are picked up with:
+#
+#   python task_search.py backfill [--board BOARD_ID] [--dry-run]
+import argparse
+import asyncio
+import re
+
+import storage
+
+INDEX_COLLECTION = "task_search"
+
+# prefixes shorter than this aren't indexed, so shorter query words are left out of a search
+MIN_PREFIX = 2
+
+# longer words are indexed and searched by their first MAX_PREFIX characters
+MAX_PREFIX = 20
+
+# prefixes per entry. the title's always fit, a long description's later words are cut
+MAX_TERMS = 500
+
+MAX_QUERY_WORDS = 8
+
+# entries read per query before ranking
+MAX_CANDIDATES = 200
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# board ids per query, firestore's limit for an "in" filter
+BOARDS_PER_QUERY = 30
+
+_WORD_RE = re.compile(r"\w+")
+
+# score of a query word matching a whole word or only the start of one, in the title or the description
+TITLE_WORD, TITLE_PREFIX, DESCRIPTION_WORD, DESCRIPTION_PREFIX = 8, 6, 3, 2
+
+# extra score for a title that starts with the query
+TITLE_START = 4
+
+
+def words(text):
+    # lowercased words in order, each once, cut to MAX_PREFIX characters
+    return list(dict.fromkeys(word[:MAX_PREFIX] for word in _WORD_RE.findall(str(text or "").casefold())))
+
+
+def entry_ref(db, board_id, task_id):
+    return db.collection(INDEX_COLLECTION).document(f"{board_id}:{task_id}")
+
+
+def entry(board_id, task_id, task_data):
+    title_words = words(task_data.get("title"))
+    description_words = words(task_data.get("description"))
+    terms = {}
+    for word in title_words + description_words:
+        for length in range(MIN_PREFIX, len(word) + 1):
+            terms[word[:length]] = None
+        if len(terms) >= MAX_TERMS:
+            break
+    return {
+        "board_id": board_id,
+        "task_id": task_id,
+        "title": task_data.get("title"),
+        "description": task_data.get("description", ""),
+        "due_date": task_data.get("due_date"),
+        "completed": bool(task_data.get("completed")),
+        "assigned_to": task_data.get("assigned_to"),
+        "title_words": title_words,
+        "description_words": description_words,
+        "terms": list(terms)[:MAX_TERMS],
+    }
+
+
+def index(batcher, db, board_id, task_id, task_data, read=None):
+    # the whole entry is rewritten, so it doesn't matter what it held before. given the entry as it was read, the write
+    # only goes through if nothing has changed it since (see counted)
+    ref = entry_ref(db, board_id, task_id)
+    if read is not None and read.exists:
+        batcher.update_unchanged(ref, entry(board_id, task_id, task_data), read)
+    else:
+        batcher.set(ref, entry(board_id, task_id, task_data))
+
+
+def remove(batcher, db, board_id, task_id, read=None):
+    ref = entry_ref(db, board_id, task_id)
+    if read is not None and read.exists:
+        batcher.delete_unchanged(ref, read)
+    else:
+        batcher.delete(ref)
+
+
+def counted(read, task_data):
+    # what the board counters have the task down as. the entry is the one document every change to the task writes
+    # whichever copy of the board it read, so changes that pass it to index() or remove() move the counters from what
+    # the entry says and one of two racing changes has to read again. a task from before the index has no entry, its
+    # copy is all there is to go on
+    if read is not None and read.exists:
+        return read.to_dict()
+    return task_data
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return min(limit, MAX_LIMIT)
+
+
+def query_words(query):
+    # raises ValueError for a query that can't match anything
+    searched = [word for word in words(query) if len(word) >= MIN_PREFIX][:MAX_QUERY_WORDS]
+    if not searched:
+        raise ValueError(f"q needs a word of at least {MIN_PREFIX} characters")
+    return searched
+
+
+def _match(word, candidates, whole, prefix):
+    if word in candidates:
+        return whole
+    if any(candidate.startswith(word) for candidate in candidates):
+        return prefix
+    return 0
+
+
+def score(searched, query, entry_data):
+    # 0 unless every searched word matches the task
+    title_words = entry_data.get("title_words", [])
+    description_words = entry_data.get("description_words", [])
+    total = 0
+    for word in searched:
+        best = max(
+            _match(word, title_words, TITLE_WORD, TITLE_PREFIX),
+            _match(word, description_words, DESCRIPTION_WORD, DESCRIPTION_PREFIX),
+        )
+        if not best:
+            return 0
+        total += best
+    if " ".join(title_words).startswith(" ".join(words(query))):
+        total += TITLE_START
+    return total
+
+
+def _rank(result):
+    # best score first, then open tasks before completed ones and the earliest due. timestamps because tasks can hold
+    # naive and timezone aware due dates side by side
+    points, entry_data = result
+    due_date = entry_data.get("due_date")
+    return -points, entry_data.get("completed", False), due_date is None, due_date.timestamp() if due_date else 0
+
+
+async def _candidates(db, board_ids, word):
+    # returns (entries, truncated), truncated when a board may have more entries than were read
+    query = (
+        db.collection(INDEX_COLLECTION)
+        .where("board_id", "in", board_ids)
+        .where("terms", "array_contains", word)
+        .limit(MAX_CANDIDATES)
+    )
+    entries = [entry_doc.to_dict() async for entry_doc in query.stream()]
+    if len(entries) < MAX_CANDIDATES:
+        return entries, False
+    if len(board_ids) == 1:
+        return entries, True
+    pages = await asyncio.gather(*(_candidates(db, [board_id], word) for board_id in board_ids))
+    return [entry_data for page, _ in pages for entry_data in page], any(truncated for _, truncated in pages)
+
+
+async def search(db, boards, query, limit):
+    # boards is {board_id: board_data} for every board the caller can see. returns the best `limit` matches, best first,
+    # and whether some entries went unread (see MAX_CANDIDATES)
+    searched = query_words(query)
+    board_ids = list(boards)
+    if not board_ids:
+        return [], False
+    # the longest word is the most selective one to look up
+    anchor = max(searched, key=len)
+    pages = await asyncio.gather(*(
+        _candidates(db, board_ids[start:start + BOARDS_PER_QUERY], anchor)
+        for start in range(0, len(board_ids), BOARDS_PER_QUERY)
+    ))
+
+    results = []
+    for page, _ in pages:
+        for entry_data in page:
+            points = score(searched, query, entry_data)
+            if points:
+                results.append((points, entry_data))
+    results.sort(key=_rank)
+    truncated = any(truncated for _, truncated in pages)
+    return [{
+        "board_id": entry_data["board_id"],
+        "board_title": boards[entry_data["board_id"]].get("title", ""),
+        "id": entry_data["task_id"],
+        "title": entry_data.get("title"),
+        "description": entry_data.get("description", ""),
+        "due_date": entry_data.get("due_date"),
+        "completed": entry_data.get("completed", False),
+        "score": points,
+    } for points, entry_data in results[:limit]], truncated
+
+
+async def backfill(db, board_id=None, dry_run=False):
+    # (re)writes the entry of every existing task, reading each board from the layout the current STORAGE_MODE reads
+    entries = {}
+    async for board in storage.iter_board_copies(db, board_id=board_id):
+        async for task in board.reference.collection("tasks").stream():
+            ref = entry_ref(db, board.id, task.id)
+            # the first copy of a task seen wins, canonical boards are read first
+            entries.setdefault(ref.path, (ref, entry(board.id, task.id, task.to_dict())))
+
+    batcher = storage.WriteBatcher(db)
+    for ref, data in entries.values():
+        batcher.set(ref, data)
+
+    if not dry_run:
+        failures = await batcher.commit()
+        if failures:
+            raise RuntimeError(f"{len(failures)} index writes failed, first error: {failures[0]['error']}")
+
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the task search index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="index existing tasks")
+    backfill_parser.add_argument("--board", help="only process this board id")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="scan and count without writing")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        count = asyncio.run(backfill(storage.client(), args.board, args.dry_run))
+        print(f"{'Would index' if args.dry_run else 'Indexed'} {count} tasks")
+
+
+if __name__ == "__main__":
+    main()
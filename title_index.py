@@ -0,0 +1,83 @@
+# task_titles/{board_id}/titles/{key} -> {"task_id": ..., "title": ...} reserves a task title on a board, so a duplicate
+# is caught by a single conditional write instead of querying the board's tasks before every create or rename.
+#
+# create_task and update_task claim the reservation with a create() in the same batch as the task write, which firestore
+# rejects if another task already holds the title, so two concurrent creates can't both get through. delete_task and
+# renames release the old reservation in that same batch. the index sits outside both storage layouts, so there is one
+# reservation per board whatever STORAGE_MODE is and migrate_storage.py doesn't need to know about it.
+#
+# tasks created before the index existed are picked up with:
+#
+#   python title_index.py backfill [--board BOARD_ID] [--dry-run]
+import argparse
+import asyncio
+import hashlib
+
+import storage
+
+INDEX_COLLECTION = "task_titles"
+
+
+def normalize(title):
+    # titles that only differ by case or spacing count as the same title
+    return " ".join(str(title or "").split()).casefold()
+
+
+def reservation_ref(db, board_id, title):
+    # document ids can't hold "/" and are capped in length, so the normalized title is hashed into the key
+    key = hashlib.sha256(normalize(title).encode("utf-8")).hexdigest()
+    return db.collection(INDEX_COLLECTION).document(board_id).collection("titles").document(key)
+
+
+def same_title(a, b):
+    return normalize(a) == normalize(b)
+
+
+def claim(batcher, db, board_id, title, task_id):
+    # has to be the first write added to the batcher, see WriteBatcher.create
+    batcher.create(reservation_ref(db, board_id, title), {"task_id": task_id, "title": title})
+
+
+def release(batcher, db, board_id, title):
+    batcher.delete(reservation_ref(db, board_id, title))
+
+
+async def backfill(db, board_id=None, dry_run=False):
+    # reserve the title of every existing task. where a board already has duplicates the first task seen keeps the
+    # title and the others are reported, they keep working but can't be renamed back to it
+    reservations = {}
+    async for board in storage.iter_board_copies(db, board_id=board_id):
+        async for task in board.reference.collection("tasks").stream():
+            title = task.to_dict().get("title")
+            ref = reservation_ref(db, board.id, title)
+            holder = reservations.setdefault(ref.path, (ref, task.id, title))
+            if holder[1] != task.id:
+                print(f"Duplicate title {title!r} on board {board.id}: task {task.id} (kept by {holder[1]})")
+
+    batcher = storage.WriteBatcher(db)
+    for ref, task_id, title in reservations.values():
+        batcher.set(ref, {"task_id": task_id, "title": title})
+
+    if not dry_run:
+        failures = await batcher.commit()
+        if failures:
+            raise RuntimeError(f"{len(failures)} reservation writes failed, first error: {failures[0]['error']}")
+
+    return len(reservations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-board task title reservations")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="reserve the titles of existing tasks")
+    backfill_parser.add_argument("--board", help="only process this board id")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="scan and count without writing")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        count = asyncio.run(backfill(storage.client(), args.board, args.dry_run))
+        print(f"{'Would reserve' if args.dry_run else 'Reserved'} {count} task titles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import google.auth.jwt
+from google.auth import exceptions
+
+import app_logging
+
+log = app_logging.get_logger("token_cache")
+
+# the same x509 endpoint google.oauth2.id_token.verify_firebase_token pulls its signing certs from
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+# how many verified tokens we keep around. each entry is the raw token plus its decoded claims
+MAX_CACHED_TOKENS = 10000
+
+# google normally serves the certs with a max-age of a few hours. if the header is missing we fall back to this
+DEFAULT_CERTS_MAX_AGE = 3600
+
+# once the certs are this close to expiring we start fetching fresh ones on a background thread so no request has to wait
+CERTS_REFRESH_MARGIN = 300
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class CertCache:
+    def __init__(self, request_adapter, certs_url=FIREBASE_CERTS_URL):
+        self._request = request_adapter
+        self._certs_url = certs_url
+        self._certs = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def get(self):
+        certs = self._certs
+        now = time.time()
+        if certs is not None and now < self._expires_at:
+            self.hits += 1
+            if now >= self._expires_at - CERTS_REFRESH_MARGIN:
+                self._refresh_in_background()
+            return certs
+
+        # cold or expired. only one caller does the fetch, everyone else waits on the lock and picks up the result
+        self.misses += 1
+        with self._lock:
+            if self._certs is None or time.time() >= self._expires_at:
+                self._fetch()
+            return self._certs
+
+    def refresh(self):
+        with self._lock:
+            self._fetch()
+        return self._certs
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                # the current certs are still valid until they expire, so the next caller will just retry
+                log.warning("background cert refresh failed", extra={"error": str(e)})
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="firebase-cert-refresh", daemon=True).start()
+
+    def _fetch(self):
+        response = self._request(self._certs_url, method="GET")
+        if response.status != 200:
+            raise exceptions.TransportError(f"Could not fetch certificates at {self._certs_url}")
+
+        self.fetches += 1
+        self._certs = json.loads(response.data.decode("utf-8"))
+        self._expires_at = time.time() + _max_age(response.headers)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "fetches": self.fetches, "expires_at": self._expires_at}
+
+
+class TokenCache:
+    def __init__(self, max_size=MAX_CACHED_TOKENS):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, id_token):
+        with self._lock:
+            entry = self._entries.get(id_token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            claims, expires_at = entry
+            if time.time() >= expires_at:
+                # the token itself has expired, so it has to go through full verification (and fail) again
+                del self._entries[id_token]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(id_token)
+            self.hits += 1
+            return claims
+
+    def put(self, id_token, claims):
+        expires_at = claims.get("exp")
+        if not expires_at:
+            return
+
+        with self._lock:
+            self._entries[id_token] = (claims, float(expires_at))
+            self._entries.move_to_end(id_token)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self._max_size}
+
+
+class TokenVerifier:
+    # drop in replacement for google.oauth2.id_token.verify_firebase_token(id_token, request). a returning user's token
+    # is served straight from the LRU, everything else is checked against the locally cached signing certs
+    def __init__(self, request_adapter, certs_url=FIREBASE_CERTS_URL, max_size=MAX_CACHED_TOKENS):
+        self.certs = CertCache(request_adapter, certs_url)
+        self.tokens = TokenCache(max_size)
+
+    def verify(self, id_token):
+        claims = self.tokens.get(id_token)
+        if claims is not None:
+            return claims
+        return self._verify_uncached(id_token)
+
+    async def verify_async(self, id_token):
+        # the cache hit is a dict lookup so it stays on the event loop. a miss means RSA and maybe an HTTP fetch for the
+        # certs, which goes to a worker thread instead of stalling every other request
+        claims = self.tokens.get(id_token)
+        if claims is not None:
+            return claims
+        return await asyncio.to_thread(self._verify_uncached, id_token)
+
+    def _verify_uncached(self, id_token):
+        try:
+            claims = google.auth.jwt.decode(id_token, certs=self.certs.get(), audience=None)
+        except ValueError as err:
+            # google rotates the signing keys, so a token signed with a key we haven't seen yet means our certs are stale
+            if "Certificate for key id" not in str(err):
+                raise
+            claims = google.auth.jwt.decode(id_token, certs=self.certs.refresh(), audience=None)
+
+        self.tokens.put(id_token, claims)
+        return claims
+
+    def stats(self):
+        return {"tokens": self.tokens.stats(), "certs": self.certs.stats()}
+
+
+def _max_age(headers):
+    cache_control = None
+    for key, value in headers.items():
+        if key.lower() == "cache-control":
+            cache_control = value
+            break
+
+    if cache_control:
+        match = _MAX_AGE_RE.search(cache_control)
+        if match:
+            return int(match.group(1))
+    return DEFAULT_CERTS_MAX_AGE
@@ -0,0 +1,203 @@
+# the user directory behind GET /users. users are searched by email prefix with a range query on email_lower, a
+# lowercased copy of the email written by create_user, and come back a page at a time ordered by email.
+#
+# recent searches are kept for a short while in search_cache, since the member picker repeats the same few prefixes as
+# people type. create_user clears it so a new user shows up straight away.
+#
+# member lists resolve user ids to emails through get_profiles, which reads every profile it doesn't have cached in a
+# single get_all and keeps them in profile_cache. create_user drops the new user's entry.
+#
+# users that signed up before email_lower existed are picked up with:
+#
+#   python user_directory.py backfill [--dry-run]
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# how many searches we remember and for how long
+MAX_CACHED_SEARCHES = 1000
+SEARCH_CACHE_TTL = 60
+
+# same for uid -> profile. emails don't change once a user has signed up, so these can live longer
+MAX_CACHED_PROFILES = 10000
+PROFILE_CACHE_TTL = 600
+
+# sorts after every character an email can contain, so [prefix, prefix + _PREFIX_END) is every string starting with it
+_PREFIX_END = "\uf8ff"
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+def profile(user_id, user_data):
+    return {"id": user_id, "email": user_data.get("email")}
+
+
+class TTLCache:
+    def __init__(self, max_size, ttl):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() >= entry[1]:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (result, time.time() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self._max_size}
+
+
+search_cache = TTLCache(MAX_CACHED_SEARCHES, SEARCH_CACHE_TTL)
+profile_cache = TTLCache(MAX_CACHED_PROFILES, PROFILE_CACHE_TTL)
+
+
+def user_created(user_id):
+    search_cache.clear()
+    profile_cache.pop(user_id)
+
+
+async def get_profiles(db, user_ids):
+    # returns {user_id: profile} for the users that exist. cached profiles cost nothing, the rest are one get_all
+    profiles = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = profile_cache.get(user_id)
+        if cached is not None:
+            profiles[user_id] = cached
+        else:
+            missing.append(user_id)
+
+    if missing:
+        user_refs = [db.collection("users").document(user_id) for user_id in missing]
+        async for user_doc in db.get_all(user_refs, field_paths=["email"]):
+            if user_doc.exists:
+                profiles[user_doc.id] = profile(user_doc.id, user_doc.to_dict())
+                profile_cache.put(user_doc.id, profiles[user_doc.id])
+    return profiles
+
+
+def parse_limit(value):
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def encode_cursor(user_id, email_lower):
+    position = {"id": user_id, "email": email_lower}
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {"email_lower": position["email"], "__name__": position["id"]}
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+async def search(db, prefix="", limit=DEFAULT_PAGE_SIZE, cursor=None):
+    # returns (users, next_cursor) for one page of users whose email starts with prefix. raises ValueError for a bad
+    # cursor
+    prefix = normalize_email(prefix)
+    key = (prefix, limit, cursor)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    query = db.collection("users")
+    if prefix:
+        query = query.where("email_lower", ">=", prefix).where("email_lower", "<", prefix + _PREFIX_END)
+    query = query.order_by("email_lower").order_by("__name__")
+    if cursor:
+        query = query.start_after(decode_cursor(cursor))
+    query = query.select(["email", "email_lower"]).limit(limit + 1)
+
+    users = []
+    next_cursor = None
+    # where the page ended, the cursor for the next one starts after it
+    last_id = last_email = None
+    async for user in query.stream():
+        if len(users) == limit:
+            next_cursor = encode_cursor(last_id, last_email)
+            break
+        user_data = user.to_dict()
+        last_id, last_email = user.id, user_data.get("email_lower")
+        users.append(profile(user.id, user_data))
+
+    result = (users, next_cursor)
+    search_cache.put(key, result)
+    return result
+
+
+async def backfill(db, dry_run=False):
+    # set email_lower on every user document that has an email but not the normalized copy
+    batcher = storage.WriteBatcher(db)
+    async for user in db.collection("users").stream():
+        user_data = user.to_dict()
+        if user_data.get("email") and user_data.get("email_lower") != normalize_email(user_data["email"]):
+            batcher.update(user.reference, {"email_lower": normalize_email(user_data["email"])})
+
+    if not dry_run:
+        failures = await batcher.commit()
+        if failures:
+            raise RuntimeError(f"{len(failures)} user writes failed, first error: {failures[0]['error']}")
+
+    return batcher.writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the searchable user directory")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="add email_lower to existing users")
+    backfill_parser.add_argument("--dry-run", action="store_true", help="scan and count without writing")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        count = asyncio.run(backfill(storage.client(), dry_run=args.dry_run))
+        print(f"{'Would update' if args.dry_run else 'Updated'} {count} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# work done right after startup so the first requests don't pay for it, and the readiness behind GET /readyz.
+# WARM_UP picks the hooks to run, comma separated, none by default:
+#
+#   firestore  builds the firestore client and makes one read, which finds the credentials and connects the channel
+#   certs      fetches the firebase signing certs logins are verified against
+#   templates  loads and compiles the page templates
+#
+# the hooks run in the background once the app has started, all at the same time, so the worker is accepting
+# connections while they do. GET /healthz answers as soon as it is, GET /readyz only once the hooks are done: point the
+# load balancer's readiness check at it and a new instance gets traffic when it can serve it quickly. a hook that fails
+# is logged and reported on /readyz without holding readiness back, whatever it was warming up is then built on first
+# use as it would be without WARM_UP.
+import asyncio
+import os
+import time
+
+import app_logging
+
+log = app_logging.get_logger("warmup")
+
+_hooks = {}
+
+
+def hook(name):
+    # registers an async function as the warm-up hook called name
+    def decorator(run):
+        _hooks[name] = run
+        return run
+    return decorator
+
+
+def requested(environ=os.environ):
+    names = [name.strip() for name in environ.get("WARM_UP", "").split(",") if name.strip()]
+    for name in names:
+        if name not in _hooks:
+            raise ValueError(f"Unknown WARM_UP hook {name!r}")
+    return names
+
+
+class Readiness:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        # hook name -> "pending", "done" or the error it failed with
+        self.hooks = {}
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def start(self, names):
+        self.hooks = dict.fromkeys(names, "pending")
+        if not names:
+            self.ready_at = time.monotonic()
+            return None
+        self._task = asyncio.create_task(self._run(names))
+        return self._task
+
+    async def _run(self, names):
+        await asyncio.gather(*(self._run_hook(name) for name in names))
+        self.ready_at = time.monotonic()
+        log.info("warm up finished", extra={"seconds": round(self.ready_at - self.started_at, 3), "hooks": self.hooks})
+
+    async def _run_hook(self, name):
+        started = time.monotonic()
+        try:
+            await _hooks[name]()
+        except Exception as e:
+            log.exception("warm up hook failed", extra={"hook": name})
+            self.hooks[name] = f"failed: {e}"
+            return
+        self.hooks[name] = "done"
+        log.info("warm up hook done", extra={"hook": name, "seconds": round(time.monotonic() - started, 3)})
+
+    def status(self):
+        return {"ready": self.ready, "hooks": self.hooks}
+
+
+readiness = Readiness()